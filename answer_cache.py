@@ -0,0 +1,230 @@
+"""Semantic cache of agent answers, looked up by question embedding."""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+from ingest_state import get_manifest
+
+# Lowest cosine similarity at which two questions count as the same. Kept high: questions that
+# differ in one word ("install on Windows" / "on macOS") often score around 0.9
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+class AnswerCache:
+    """Serves the answer to a question semantically equivalent to one answered before.
+
+    Answers are grouped by scope: the collections they were drawn from and the
+    settings that shape an answer (chat model, reranking, ...). Within a scope
+    the normalized embeddings of the cached questions form one matrix, so a
+    lookup is a single matrix-vector product: the nearest question wins if its
+    cosine similarity reaches `threshold`.
+
+    Each scope remembers the content version its answers were produced at
+    (e.g. the collections' versions from the ingest manifest). A lookup with
+    a different version drops the scope's answers, so nothing cached before
+    an ingest is served after it. An insert with a different version is
+    ignored, since the answer may predate the scope's current entries (an
+    ingest that finished while the agent was running). Entries also expire
+    after `ttl` seconds, and a full scope evicts its least recently used
+    answer.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[List[str]], Any],
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_entries: int = 512,
+        ttl: float = 3600.0,
+    ):
+        """Create an empty cache.
+
+        Args:
+            embed: Function mapping a list of texts to one embedding per text
+                (the embedding model, or a stub in tests)
+            threshold: Lowest cosine similarity that counts as the same question
+            max_entries: Maximum number of answers kept per scope
+            ttl: Seconds after which a cached answer expires
+        """
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._scopes: Dict[Hashable, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _vector(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed([question])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _scope(self, scope: Hashable, version: Hashable) -> Optional[Dict[str, Any]]:
+        """Return a scope's entries, dropping them if they were cached at another version."""
+        entries = self._scopes.get(scope)
+        if entries is not None and entries["version"] != version:
+            del self._scopes[scope]
+            return None
+        return entries
+
+    def get(self, scope: Hashable, version: Hashable, question: str) -> Optional[Dict[str, Any]]:
+        """Look up the answer to the most similar cached question.
+
+        Args:
+            scope: Identity of the collections and settings the answer must come from
+            version: Current content version of the scope
+            question: The question being asked
+
+        Returns:
+            A dict with the cached 'answer', the 'question' it answered and the
+            'similarity', or None on a miss
+        """
+        vector = self._vector(question)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._scope(scope, version)
+            hit = None
+            if entries is not None and entries["questions"]:
+                # Expired answers must not shadow a live one that is slightly less similar
+                similarities = entries["vectors"] @ vector
+                similarities[now - entries["created"] > self.ttl] = -np.inf
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entries["used"][best] = now
+                    hit = {
+                        "answer": entries["answers"][best],
+                        "question": entries["questions"][best],
+                        "similarity": float(similarities[best]),
+                    }
+            if hit is None:
+                self.misses += 1
+                metrics.increment("answer_cache_misses")
+            else:
+                self.hits += 1
+                metrics.increment("answer_cache_hits")
+            return hit
+
+    def put(self, scope: Hashable, version: Hashable, question: str, answer: str) -> None:
+        """Cache an answer, replacing the answer to a near-identical question if there is one.
+
+        Args:
+            scope: Identity of the collections and settings the answer came from
+            version: Content version the answer was produced at, read before producing it
+            question: The question that was answered
+            answer: The answer
+        """
+        if not answer:
+            return
+        vector = self._vector(question)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is not None and entries["version"] != version:
+                # Only lookups, which know the current version, may drop a scope
+                return
+            if entries is None:
+                entries = {
+                    "version": version,
+                    "vectors": np.empty((0, vector.shape[0]), dtype=np.float32),
+                    "questions": [],
+                    "answers": [],
+                    "created": np.empty(0),
+                    "used": np.empty(0),
+                }
+                self._scopes[scope] = entries
+            if len(entries["questions"]):
+                similarities = entries["vectors"] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._remove(entries, best)
+            # Drop expired answers, then the least recently used ones beyond capacity
+            for index in np.flatnonzero(now - entries["created"] > self.ttl)[::-1]:
+                self._remove(entries, int(index))
+            while len(entries["questions"]) >= self.max_entries:
+                self._remove(entries, int(np.argmin(entries["used"])))
+            entries["vectors"] = np.vstack([entries["vectors"], vector[None, :]])
+            entries["questions"].append(question)
+            entries["answers"].append(answer)
+            entries["created"] = np.append(entries["created"], now)
+            entries["used"] = np.append(entries["used"], now)
+
+    @staticmethod
+    def _remove(entries: Dict[str, Any], index: int) -> None:
+        entries["vectors"] = np.delete(entries["vectors"], index, axis=0)
+        del entries["questions"][index]
+        del entries["answers"][index]
+        entries["created"] = np.delete(entries["created"], index)
+        entries["used"] = np.delete(entries["used"], index)
+
+    def clear(self) -> None:
+        """Drop every cached answer."""
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current number of cached answers."""
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = sum(len(scope["questions"]) for scope in self._scopes.values())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+def answer_cache_key(
+    db_dir: str,
+    collections: Sequence[str],
+    settings: Tuple = (),
+) -> Tuple[Hashable, Hashable]:
+    """Build the scope and version for answers drawn from a set of collections.
+
+    Args:
+        db_dir: Directory where ChromaDB stores its data
+        collections: Collections the answer may draw on
+        settings: Anything else that shapes an answer (chat model, reranking, ...)
+
+    Returns:
+        (scope, version); the version changes whenever any of the collections
+        is written, which invalidates the scope's cached answers
+    """
+    collections = tuple(sorted(set(collections)))
+    manifest = get_manifest(db_dir)
+    scope = (os.path.abspath(db_dir), collections, tuple(settings))
+    return scope, tuple(manifest.get_version(collection) for collection in collections)
+
+
+_answer_caches_lock = threading.Lock()
+_answer_caches: Dict[Tuple[str, str], AnswerCache] = {}
+
+
+def get_answer_cache(db_dir: str, embedding_model: str = "all-MiniLM-L6-v2") -> AnswerCache:
+    """Get the process-wide answer cache for a ChromaDB directory and embedding model.
+
+    Questions are embedded with the same model (and on-disk embedding cache)
+    as the collections; the model is only loaded on the first lookup. The
+    similarity threshold comes from RAG_ANSWER_CACHE_THRESHOLD (default 0.95).
+    """
+    key = (os.path.abspath(db_dir), embedding_model)
+    cache = _answer_caches.get(key)
+    if cache is not None:
+        return cache
+
+    with _answer_caches_lock:
+        cache = _answer_caches.get(key)
+        if cache is None:
+            def embed(texts: List[str]) -> np.ndarray:
+                from embeddings import get_embedding_function
+                from utils import get_embedding_cache_path
+                return get_embedding_function(embedding_model, get_embedding_cache_path(db_dir)).embed(texts)
+
+            cache = AnswerCache(embed)
+            _answer_caches[key] = cache
+        return cache
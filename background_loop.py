@@ -0,0 +1,206 @@
+"""A long-lived event loop on a background thread, for synchronous callers such as Streamlit."""
+
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Dict, Iterator, List, Optional
+
+_ITEM, _DONE, _ERROR = range(3)
+
+
+class BackgroundLoop:
+    """Runs coroutines, async streams and long jobs on one event loop thread.
+
+    Everything that holds loop-bound state (the agent's HTTP clients, crawl
+    sessions, browser instances) lives on this loop, so a script thread can
+    hand work to it and return immediately instead of starting a fresh loop
+    with asyncio.run each time. All methods are safe to call from any thread.
+
+        runtime = get_background_loop()
+        deps = runtime.run(make_deps())
+        for token in runtime.stream(agent_tokens()):
+            ...
+        job_id = runtime.start_job(lambda report: insert_docs(url, progress_callback=report))
+        runtime.job(job_id)["progress"]
+    """
+
+    def __init__(self, name: str = "rag-event-loop"):
+        """Start the loop thread.
+
+        Args:
+            name: Name of the thread
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._jobs_lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._futures: Dict[str, concurrent.futures.Future] = {}
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The background event loop."""
+        return self._loop
+
+    def submit(self, coro: Coroutine[Any, Any, Any]) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop and return a future for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the loop and wait for its result."""
+        return self.submit(coro).result(timeout)
+
+    def stream(self, source: AsyncIterator[Any], timeout: Optional[float] = None) -> Iterator[Any]:
+        """Iterate an async iterator that runs on the loop, from the calling thread.
+
+        Items are handed over through a thread-safe queue as soon as the loop
+        produces them. If the caller stops iterating early (or its thread is
+        interrupted), the async iterator is cancelled.
+
+        Args:
+            source: Async iterator to drain, such as an async generator
+            timeout: Longest wait for the next item, in seconds
+
+        Raises:
+            queue.Empty: If no item arrived within `timeout`
+            Exception: Whatever the async iterator raised
+        """
+        items: queue.Queue = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in source:
+                    items.put((_ITEM, item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                items.put((_ERROR, e))
+            else:
+                items.put((_DONE, None))
+            finally:
+                aclose = getattr(source, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+
+        future = self.submit(pump())
+        try:
+            while True:
+                kind, value = items.get(timeout=timeout)
+                if kind == _DONE:
+                    return
+                if kind == _ERROR:
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    def start_job(
+        self,
+        make_job: Callable[[Callable[[Dict[str, Any]], None]], Awaitable[Any]],
+        name: str = ""
+    ) -> str:
+        """Start a long-running coroutine in the background and track its progress.
+
+        Args:
+            make_job: Called on the loop with a `report(progress_dict)` callback;
+                returns the awaitable to run (e.g. insert_docs(..., progress_callback=report))
+            name: Label shown with the job
+
+        Returns:
+            The job ID, to poll with job()
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "name": name,
+            "status": "running",
+            "progress": {},
+            "result": None,
+            "error": None,
+            "started": time.time(),
+            "finished": None,
+        }
+
+        def report(progress):
+            with self._jobs_lock:
+                job["progress"] = dict(progress)
+
+        def finish(status, result=None, error=None):
+            with self._jobs_lock:
+                job.update(status=status, result=result, error=error, finished=time.time())
+
+        async def run():
+            try:
+                result = await make_job(report)
+            except asyncio.CancelledError:
+                finish("cancelled")
+                raise
+            except Exception as e:
+                finish("failed", error=str(e))
+            else:
+                finish("done", result=result)
+
+        with self._jobs_lock:
+            self._jobs[job_id] = job
+            self._futures[job_id] = self.submit(run())
+        return job_id
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a snapshot of a job's status, progress, result and error, or None if unknown."""
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+            return {**job, "progress": dict(job["progress"])} if job is not None else None
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """Return snapshots of all jobs, oldest first."""
+        with self._jobs_lock:
+            return [{**job, "progress": dict(job["progress"])} for job in self._jobs.values()]
+
+    def cancel_job(self, job_id: str) -> bool:
+        """Cancel a running job; returns False if it was unknown or already finished."""
+        with self._jobs_lock:
+            future = self._futures.get(job_id)
+        if future is None or not future.cancel():
+            return False
+        with self._jobs_lock:
+            job = self._jobs[job_id]
+            # A job cancelled before it started never records its own status
+            if job["status"] == "running":
+                job.update(status="cancelled", finished=time.time())
+        return True
+
+    def stop(self) -> None:
+        """Cancel outstanding work and stop the loop thread."""
+        async def shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._thread.is_alive():
+            self.run(shutdown())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+
+_background_loop_lock = threading.Lock()
+_background_loop: Optional[BackgroundLoop] = None
+
+
+def get_background_loop() -> BackgroundLoop:
+    """Get the process-wide background loop, starting it on first use."""
+    global _background_loop
+    if _background_loop is not None:
+        return _background_loop
+
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = BackgroundLoop()
+        return _background_loop
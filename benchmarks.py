@@ -0,0 +1,512 @@
+"""Micro-benchmarks for the ingest and query pipeline.
+
+Usage:
+    python benchmarks.py chunk [--size-mb 5] [--files docs/*.md]
+    python benchmarks.py chunk-parallel [--pages 2000] [--workers 1 2 4 8]
+    python benchmarks.py crawl-scheduler [--pages 500] [--server-rps 50] [--server-capacity 8]
+    python benchmarks.py query [--docs 200] [--queries 500] [--batch-size 1 16 64] [--db-dir DIR]
+    python benchmarks.py compact [--vectors 200000] [--dim 384] [--candidates 20 50 100 400]
+    python benchmarks.py startup [--runs 5] [--db-dir DIR] [--importtime]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Sequence
+
+
+def legacy_smart_chunk_markdown(markdown: str, max_len: int = 1000) -> List[str]:
+    """The original regex-per-level chunker, kept as a baseline for comparison."""
+    def split_by_header(md, header_pattern):
+        indices = [m.start() for m in re.finditer(header_pattern, md, re.MULTILINE)]
+        indices.append(len(md))
+        return [md[indices[i]:indices[i+1]].strip() for i in range(len(indices)-1) if md[indices[i]:indices[i+1]].strip()]
+
+    chunks = []
+
+    for h1 in split_by_header(markdown, r'^# .+$'):
+        if len(h1) > max_len:
+            for h2 in split_by_header(h1, r'^## .+$'):
+                if len(h2) > max_len:
+                    for h3 in split_by_header(h2, r'^### .+$'):
+                        if len(h3) > max_len:
+                            for i in range(0, len(h3), max_len):
+                                chunks.append(h3[i:i+max_len].strip())
+                        else:
+                            chunks.append(h3)
+                else:
+                    chunks.append(h2)
+        else:
+            chunks.append(h1)
+
+    final_chunks = []
+
+    for c in chunks:
+        if len(c) > max_len:
+            final_chunks.extend([c[i:i+max_len].strip() for i in range(0, len(c), max_len)])
+        else:
+            final_chunks.append(c)
+
+    return [c for c in final_chunks if c]
+
+
+_WORDS = (
+    "crawler chunk embedding vector collection query retrieve agent model token "
+    "index sitemap page markdown header section context latency batch cache"
+).split()
+
+
+def synthetic_markdown(size_bytes: int, seed: int = 0) -> str:
+    """Generate a documentation-like markdown document of roughly `size_bytes`."""
+    rng = random.Random(seed)
+    parts: List[str] = []
+    total = 0
+    while total < size_bytes:
+        kind = rng.random()
+        if kind < 0.05:
+            block = f"# {' '.join(rng.choices(_WORDS, k=3)).title()}"
+        elif kind < 0.15:
+            block = f"## {' '.join(rng.choices(_WORDS, k=4)).title()}"
+        elif kind < 0.25:
+            block = f"### {' '.join(rng.choices(_WORDS, k=4)).title()}"
+        elif kind < 0.35:
+            lines = [f"    result = {rng.choice(_WORDS)}({rng.randint(0, 99)})" for _ in range(rng.randint(3, 40))]
+            block = "```python\n# " + rng.choice(_WORDS) + "\n" + "\n".join(lines) + "\n```"
+        elif kind < 0.4:
+            rows = [f"| {rng.choice(_WORDS)} | {rng.randint(0, 999)} |" for _ in range(rng.randint(3, 30))]
+            block = "| name | value |\n|---|---|\n" + "\n".join(rows)
+        else:
+            block = " ".join(rng.choices(_WORDS, k=rng.randint(20, 200))) + "."
+        parts.append(block)
+        total += len(block) + 2
+    return "\n\n".join(parts)
+
+
+def _time(func: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_chunk(args: argparse.Namespace) -> None:
+    from chunking import smart_chunk_markdown
+
+    if args.files:
+        documents = [open(path, encoding="utf-8").read() for path in args.files]
+    else:
+        documents = [synthetic_markdown(int(args.size_mb * 1024 * 1024), seed=i) for i in range(args.docs)]
+    total_mb = sum(len(d) for d in documents) / (1024 * 1024)
+
+    for name, func in (
+        ("legacy", lambda: [legacy_smart_chunk_markdown(d, args.chunk_size) for d in documents]),
+        ("single-pass", lambda: [smart_chunk_markdown(d, args.chunk_size) for d in documents]),
+        ("single-pass+overlap", lambda: [smart_chunk_markdown(d, args.chunk_size, overlap=args.chunk_size // 10) for d in documents]),
+    ):
+        seconds = _time(func, args.repeat)
+        chunks = [c for doc_chunks in func() for c in doc_chunks]
+        # The legacy chunker drops text before the first header of each level; show how much survives
+        kept = sum(len(c) for c in chunks) / (total_mb * 1024 * 1024)
+        print(f"{name:>20}: {seconds * 1000:9.1f} ms  {total_mb / seconds:7.1f} MB/s  {len(chunks)} chunks  {kept:6.1%} of text kept")
+
+
+def bench_chunk_parallel(args: argparse.Namespace) -> None:
+    from chunking import chunk_page, parallel_chunk_pages
+
+    pages = [
+        {"url": f"https://example.com/page-{i}", "markdown": synthetic_markdown(args.page_kb * 1024, seed=i)}
+        for i in range(args.pages)
+    ]
+    total_mb = sum(len(p["markdown"]) for p in pages) / (1024 * 1024)
+
+    serial = _time(lambda: [chunk_page(p, args.chunk_size) for p in pages], args.repeat)
+    print(f"{'serial':>10}: {serial:7.2f} s  {args.pages / serial:8.0f} pages/s  {total_mb / serial:6.1f} MB/s")
+    for workers in args.workers:
+        seconds = _time(
+            lambda: list(parallel_chunk_pages(pages, args.chunk_size, workers=workers, pages_per_task=args.pages_per_task)),
+            args.repeat,
+        )
+        print(f"{workers:>3} workers: {seconds:7.2f} s  {args.pages / seconds:8.0f} pages/s  "
+              f"{total_mb / seconds:6.1f} MB/s  speedup {serial / seconds:4.1f}x")
+
+
+async def _run_stub_crawl(args: argparse.Namespace, adaptive: bool) -> None:
+    from aiohttp import web
+    from fetcher import TieredFetcher, create_http_session
+    from scheduler import HostScheduler
+
+    # Stub site: answers 429 above `server_rps` and slows down as concurrency exceeds its capacity
+    state = {"active": 0, "window": 0.0, "count": 0}
+
+    async def page(request):
+        now = time.monotonic()
+        if now - state["window"] >= 1.0:
+            state["window"], state["count"] = now, 0
+        state["count"] += 1
+        if state["count"] > args.server_rps:
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        state["active"] += 1
+        try:
+            overload = max(0, state["active"] - args.server_capacity) / args.server_capacity
+            await asyncio.sleep(args.latency_ms / 1000 * (1 + 4 * overload))
+        finally:
+            state["active"] -= 1
+        return web.Response(text=synthetic_markdown(2048, seed=int(request.match_info["n"])), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/page/{n}", page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    try:
+        async with create_http_session() as session:
+            scheduler = HostScheduler(
+                session,
+                max_concurrent=args.max_concurrent,
+                requests_per_second=args.rps,
+                respect_robots=False,
+                adaptive=adaptive,
+                max_retries=args.max_retries,
+            )
+            async with TieredFetcher(session, mode="http", scheduler=scheduler) as fetcher:
+                async def fetch(n):
+                    try:
+                        await fetcher.fetch(f"http://127.0.0.1:{port}/page/{n}")
+                        return True
+                    except Exception:
+                        return False
+
+                start = time.perf_counter()
+                results = await asyncio.gather(*(fetch(n) for n in range(args.pages)))
+                seconds = time.perf_counter() - start
+        name = "adaptive" if adaptive else "fixed"
+        print(f"{name:>9}: {seconds:6.2f} s  {sum(results) / seconds:7.1f} pages/s  "
+              f"{args.pages - sum(results)} failed  {scheduler.stats['throttled']} throttled  "
+              f"final concurrency {scheduler.concurrency_limit}")
+    finally:
+        await runner.cleanup()
+
+
+def bench_crawl_scheduler(args: argparse.Namespace) -> None:
+    for adaptive in (False, True):
+        asyncio.run(_run_stub_crawl(args, adaptive))
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99 of a sample (nearest rank)."""
+    ordered = sorted(values)
+    return {f"p{p}": ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))] for p in (50, 95, 99)}
+
+
+class StubLLM:
+    """Stand-in for the chat model: waits a time-to-first-token, then streams canned tokens at a fixed rate."""
+
+    def __init__(self, ttft_ms: float = 300.0, tokens_per_second: float = 80.0, answer_tokens: int = 150):
+        self.ttft = ttft_ms / 1000
+        self.token_interval = 1.0 / tokens_per_second
+        self.answer_tokens = answer_tokens
+
+    async def answer(self, question: str, context: str) -> str:
+        await asyncio.sleep(self.ttft + self.answer_tokens * self.token_interval)
+        return " ".join(context.split()[:self.answer_tokens])
+
+
+def build_synthetic_collection(db_dir: str, collection_name: str, docs: int, embedding_model: str) -> int:
+    """Chunk and store `docs` synthetic pages in a collection (and its BM25 index); returns the chunk count."""
+    from chunking import chunk_page
+    from embeddings import get_embedding_function
+    from ingest_state import chunk_id
+    from lexical_index import get_lexical_index
+    from utils import add_documents_to_collection, get_collection, get_embedding_cache_path
+
+    collection = get_collection(db_dir, collection_name, embedding_model)
+    embedding_function = get_embedding_function(embedding_model, get_embedding_cache_path(db_dir))
+    lexical_index = get_lexical_index(db_dir)
+    total = 0
+    for i in range(docs):
+        page = {"url": f"https://example.com/docs/page-{i}", "markdown": synthetic_markdown(8 * 1024, seed=i)}
+        # Repeated synthetic chunks would collide on their content-addressed IDs
+        unique = {}
+        for chunk, meta in chunk_page(page, 1000):
+            unique.setdefault(chunk_id(page["url"], chunk), (chunk, {**meta, "source": page["url"]}))
+        ids = list(unique)
+        documents = [chunk for chunk, _ in unique.values()]
+        metadatas = [meta for _, meta in unique.values()]
+        add_documents_to_collection(collection, ids, documents, metadatas, embeddings=embedding_function.embed(documents))
+        lexical_index.add(collection_name, ids, documents)
+        total += len(ids)
+    return total
+
+
+def bench_query(args: argparse.Namespace) -> None:
+    from embeddings import get_embedding_function
+    from utils import (
+        QueryCache,
+        batch_query_collection,
+        format_results_as_context,
+        get_collection,
+        get_embedding_cache_path,
+    )
+
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix="rag-bench-")
+    if not args.db_dir:
+        chunks = build_synthetic_collection(db_dir, args.collection, args.docs, args.embedding_model)
+        print(f"synthetic corpus: {args.docs} pages, {chunks} chunks in {db_dir}")
+
+    rng = random.Random(0)
+    queries = [" ".join(rng.choices(_WORDS, k=rng.randint(3, 8))) for _ in range(args.queries)]
+    collection = get_collection(db_dir, args.collection, args.embedding_model)
+    embedding_function = get_embedding_function(args.embedding_model, get_embedding_cache_path(db_dir))
+    llm = StubLLM(args.llm_ttft_ms, args.llm_tokens_per_second)
+    # Every query is a miss, so the numbers measure retrieval rather than the cache
+    no_cache = QueryCache(max_entries=0)
+
+    for batch_size in args.batch_size:
+        timings: Dict[str, List[float]] = {"embed": [], "search": [], "context": [], "end-to-end": []}
+        start_all = time.perf_counter()
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+
+            # Stages in isolation: one encode call and one collection.query for the whole batch
+            t0 = time.perf_counter()
+            embeddings = embedding_function.embed(batch)
+            t1 = time.perf_counter()
+            collection.query(query_embeddings=embeddings, n_results=args.n_results, include=["documents", "metadatas", "distances"])
+            t2 = time.perf_counter()
+            timings["embed"] += [t1 - t0] * len(batch)
+            timings["search"] += [t2 - t1] * len(batch)
+
+            # End to end: batch retrieval (hybrid), context building and the stub LLM
+            t0 = time.perf_counter()
+            results = batch_query_collection(
+                db_dir, args.collection, batch, n_results=args.n_results,
+                embedding_model_name=args.embedding_model, cache=no_cache, hybrid=not args.vector_only
+            )
+            contexts = []
+            for result in results:
+                c0 = time.perf_counter()
+                contexts.append(format_results_as_context(result, max_tokens=args.context_tokens))
+                timings["context"].append(time.perf_counter() - c0)
+
+            async def answer_all():
+                return await asyncio.gather(*(llm.answer(q, c) for q, c in zip(batch, contexts)))
+
+            asyncio.run(answer_all())
+            timings["end-to-end"] += [time.perf_counter() - t0] * len(batch)
+
+        seconds = time.perf_counter() - start_all
+        print(f"batch size {batch_size}: {len(queries) / seconds:.1f} queries/s end to end")
+        for stage, values in timings.items():
+            stats = percentiles(values)
+            print(f"  {stage:>10}: " + "  ".join(f"{k} {v * 1000:8.2f} ms" for k, v in stats.items()))
+
+
+def synthetic_embeddings(count: int, dim: int, clusters: int = 1000, seed: int = 0):
+    """Unit vectors scattered around random cluster centres, like embeddings of many related pages."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def bench_compact(args: argparse.Namespace) -> None:
+    import numpy as np
+    import compact_store
+    from compact_store import CompactVectorStore
+
+    vectors = synthetic_embeddings(args.vectors, args.dim)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, args.vectors, args.queries)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    # Exact float32 top-k as ground truth
+    t0 = time.perf_counter()
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.n_results]
+    exact_ms = (time.perf_counter() - t0) * 1000 / args.queries
+    float_bytes = vectors.nbytes
+
+    with tempfile.TemporaryDirectory(prefix="rag-compact-") as directory:
+        store = CompactVectorStore(directory, dim=args.dim)
+        ids = [str(i) for i in range(args.vectors)]
+        for start in range(0, args.vectors, 10000):
+            store.add(ids[start:start + 10000], vectors[start:start + 10000])
+        memory = store.memory_bytes()
+        print(f"{args.vectors} vectors x {args.dim} dims, {args.queries} queries, recall@{args.n_results}")
+        print(f"  float32 vectors: {float_bytes / 2**20:8.1f} MiB   exact search {exact_ms:7.2f} ms/query")
+        print(f"  int8 tier:       {memory['compact'] / 2**20:8.1f} MiB   ({float_bytes / memory['compact']:.1f}x smaller;"
+              f" float32 copy for re-scoring stays on disk)")
+        # The first search of a large store trains its IVF index
+        t0 = time.perf_counter()
+        store.search(queries[0], args.n_results)
+        print(f"  first search:    {(time.perf_counter() - t0) * 1000:8.1f} ms   (trains the IVF index above"
+              f" {compact_store.IVF_MIN_ROWS} vectors)")
+
+        settings = [("int8 only", args.n_results, False)] + [(f"rescore {c}", c, True) for c in args.candidates]
+        for label, candidates, rescore in settings:
+            latencies = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                found, _ = store.search(query, args.n_results, candidates=candidates, rescore=rescore, nprobe=args.nprobe)
+                latencies.append(time.perf_counter() - t0)
+                hits += len(set(found[0]) & {str(i) for i in expected})
+            stats = percentiles(latencies)
+            print(f"  {label:>13}: recall {hits / (args.queries * args.n_results):.3f}   "
+                  + "  ".join(f"{k} {v * 1000:7.2f} ms" for k, v in stats.items()))
+
+
+# Runs in a fresh interpreter: times each import in turn, then a cold and a warm query
+_STARTUP_PROBE = """
+import json, sys, time
+db_dir, collection, model, modules = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4:]
+timings = {}
+for module in modules:
+    start = time.perf_counter()
+    __import__(module)
+    timings["import " + module] = time.perf_counter() - start
+from utils import QueryCache, cached_query_collection
+no_cache = QueryCache(max_entries=0)
+for label, text in (("first query", "configure the crawler"), ("second query", "embedding batch size")):
+    start = time.perf_counter()
+    # A fresh query text each run, so the embedding cache can't spare the model
+    cached_query_collection(db_dir, collection, f"{text} {time.time_ns()}", embedding_model_name=model, cache=no_cache)
+    timings[label] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def bench_startup(args: argparse.Namespace) -> None:
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix="rag-bench-")
+    if not args.db_dir:
+        # Built in a child process so this one doesn't hold the database open
+        subprocess.run(
+            [sys.executable, "-c",
+             "import sys, benchmarks; benchmarks.build_synthetic_collection(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4])",
+             db_dir, args.collection, str(args.docs), args.embedding_model],
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        print(f"synthetic corpus: {args.docs} pages in {db_dir}")
+
+    command = [sys.executable, "-c", _STARTUP_PROBE, db_dir, args.collection, args.embedding_model, *args.modules]
+    runs: Dict[str, List[float]] = {}
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run(command, check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        total = time.perf_counter() - start
+        for stage, seconds in {**json.loads(output.strip().splitlines()[-1]), "process total": total}.items():
+            runs.setdefault(stage, []).append(seconds)
+
+    print(f"{args.runs} cold starts (median / max):")
+    for stage, values in runs.items():
+        print(f"  {stage:>24}: {statistics.median(values) * 1000:9.1f} ms  {max(values) * 1000:9.1f} ms")
+
+    if args.importtime:
+        # -X importtime reports each module's cumulative import cost on stderr
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(args.modules)],
+            check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stderr
+        costs = []
+        for line in stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[1].strip().isdigit():
+                costs.append((int(fields[1]), fields[2].strip()))
+        print("slowest imports (cumulative):")
+        for microseconds, module in sorted(costs, reverse=True)[:args.importtime_top]:
+            print(f"  {microseconds / 1000:9.1f} ms  {module}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    chunk = subparsers.add_parser("chunk", help="Compare the chunker against the legacy implementation")
+    chunk.add_argument("--files", nargs="*", help="Markdown files to chunk (default: synthetic documents)")
+    chunk.add_argument("--size-mb", type=float, default=5.0, help="Size of each synthetic document")
+    chunk.add_argument("--docs", type=int, default=3, help="Number of synthetic documents")
+    chunk.add_argument("--chunk-size", type=int, default=1000)
+    chunk.add_argument("--repeat", type=int, default=3)
+    chunk.set_defaults(func=bench_chunk)
+
+    cpu_count = os.cpu_count() or 1
+    chunk_parallel = subparsers.add_parser("chunk-parallel", help="Measure how process-pool chunking scales with workers")
+    chunk_parallel.add_argument("--pages", type=int, default=2000)
+    chunk_parallel.add_argument("--page-kb", type=int, default=20, help="Size of each synthetic page")
+    chunk_parallel.add_argument("--workers", type=int, nargs="+",
+                                default=sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1))))
+    chunk_parallel.add_argument("--pages-per-task", type=int, default=16)
+    chunk_parallel.add_argument("--chunk-size", type=int, default=1000)
+    chunk_parallel.add_argument("--repeat", type=int, default=1)
+    chunk_parallel.set_defaults(func=bench_chunk_parallel)
+
+    crawl_scheduler = subparsers.add_parser(
+        "crawl-scheduler", help="Crawl a local rate-limited stub server with fixed and adaptive concurrency"
+    )
+    crawl_scheduler.add_argument("--pages", type=int, default=500)
+    crawl_scheduler.add_argument("--max-concurrent", type=int, default=32)
+    crawl_scheduler.add_argument("--rps", type=float, default=1000.0, help="Per-host request rate of the scheduler")
+    crawl_scheduler.add_argument("--max-retries", type=int, default=3)
+    crawl_scheduler.add_argument("--server-rps", type=int, default=50, help="Requests per second before the stub answers 429")
+    crawl_scheduler.add_argument("--server-capacity", type=int, default=8, help="Concurrent requests before the stub slows down")
+    crawl_scheduler.add_argument("--latency-ms", type=float, default=20.0)
+    crawl_scheduler.set_defaults(func=bench_crawl_scheduler)
+
+    query = subparsers.add_parser("query", help="Retrieval latency percentiles on a synthetic corpus with a stub LLM")
+    query.add_argument("--db-dir", help="Benchmark an existing ChromaDB directory instead of a synthetic corpus")
+    query.add_argument("--collection", default="bench")
+    query.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    query.add_argument("--docs", type=int, default=200, help="Number of synthetic pages")
+    query.add_argument("--queries", type=int, default=500)
+    query.add_argument("--batch-size", type=int, nargs="+", default=[1, 16, 64])
+    query.add_argument("--n-results", type=int, default=5)
+    query.add_argument("--context-tokens", type=int, default=3000)
+    query.add_argument("--vector-only", action="store_true", help="Skip BM25 fusion")
+    query.add_argument("--llm-ttft-ms", type=float, default=300.0)
+    query.add_argument("--llm-tokens-per-second", type=float, default=80.0)
+    query.set_defaults(func=bench_query)
+
+    compact = subparsers.add_parser("compact", help="Recall and memory of the int8 compact vector tier vs float32")
+    compact.add_argument("--vectors", type=int, default=200000)
+    compact.add_argument("--dim", type=int, default=384)
+    compact.add_argument("--queries", type=int, default=200)
+    compact.add_argument("--n-results", type=int, default=10)
+    compact.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100, 400],
+                         help="Candidates re-scored per query")
+    compact.add_argument("--nprobe", type=int, help="IVF lists searched per query (default: an eighth of them)")
+    compact.set_defaults(func=bench_compact)
+
+    startup = subparsers.add_parser("startup", help="Import and first-query latency of fresh processes")
+    startup.add_argument("--db-dir", help="Query an existing ChromaDB directory instead of a synthetic corpus")
+    startup.add_argument("--collection", default="bench")
+    startup.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    startup.add_argument("--docs", type=int, default=50, help="Number of synthetic pages")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--modules", nargs="+", default=["utils", "insert_docs", "rag_agent"],
+                         help="Modules to import, in order, before the first query")
+    startup.add_argument("--importtime", action="store_true", help="Also list the slowest imports")
+    startup.add_argument("--importtime-top", type=int, default=15)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
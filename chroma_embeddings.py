@@ -0,0 +1,25 @@
+"""Chroma adapter for the embedding functions in embeddings.py; importing it loads chromadb."""
+
+from typing import Any, List
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+
+class ChromaEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Presents a shared embedding function (see embeddings.get_embedding_function) to Chroma."""
+
+    def __init__(self, embedding_function: Any):
+        """Wrap an embedding function.
+
+        Args:
+            embedding_function: A SentenceTransformerEngine or CachedEmbeddingFunction
+        """
+        self.embedding_function = embedding_function
+
+    def embed(self, texts: List[str], **encode_kwargs: Any) -> np.ndarray:
+        """Embed texts as a float32 array (see the wrapped function's embed())."""
+        return self.embedding_function.embed(texts, **encode_kwargs)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return list(self.embedding_function.embed(list(input)))
@@ -0,0 +1,286 @@
+"""Markdown chunking and chunk metadata extraction.
+
+Kept free of crawler and database imports so it can be used (and benchmarked)
+on its own.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# One pass over the document finds every header and code-fence line
+_BOUNDARY = re.compile(r'^(?:(#{1,3}) .+|[ ]{0,3}(`{3,}|~{3,}).*)$', re.MULTILINE)
+
+# Fallback split points for sections that are still too long, coarsest first
+_SEPARATORS = (
+    re.compile(r'\n[ \t]*\n\s*'),  # paragraphs
+    re.compile(r'\n'),             # lines (keeps table rows intact)
+    re.compile(r'\s+'),            # words
+)
+
+Span = Tuple[int, int, int]  # (start, end, size)
+
+
+def _scan(markdown: str) -> Tuple[List[List[int]], List[Tuple[int, int]]]:
+    """Find header offsets per level and code-fence spans in a single pass."""
+    headers: List[List[int]] = [[], [], []]
+    fences: List[Tuple[int, int]] = []
+    fence_start, fence_marker = None, ''
+
+    for m in _BOUNDARY.finditer(markdown):
+        marker = m.group(2)
+        if fence_start is not None:
+            # Only a fence of the same character and at least the same length closes it
+            if marker and marker[0] == fence_marker[0] and len(marker) >= len(fence_marker) \
+                    and not m.group(0).strip()[len(marker):].strip():
+                fences.append((fence_start, m.end()))
+                fence_start = None
+        elif marker:
+            fence_start, fence_marker = m.start(), marker
+        else:
+            headers[len(m.group(1)) - 1].append(m.start())
+
+    if fence_start is not None:
+        # An unclosed fence runs to the end of the document
+        fences.append((fence_start, len(markdown)))
+    return headers, fences
+
+
+def smart_chunk_markdown(
+    markdown: str,
+    max_len: int = 1000,
+    overlap: int = 0,
+    length_function: Optional[Callable[[str], int]] = None,
+) -> List[str]:
+    """Hierarchically splits markdown by #, ##, ### headers, then by paragraphs, lines and words, to ensure all chunks <= max_len.
+
+    Header and code-fence boundaries are found in one scan and sections are
+    tracked as offsets into the original string, so text is only copied when a
+    chunk is emitted. Code blocks are never split; a single block longer than
+    `max_len` becomes its own oversized chunk.
+
+    Args:
+        markdown: Markdown document to chunk
+        max_len: Maximum chunk size, measured with `length_function`
+        overlap: Size of trailing context repeated at the start of the next
+            chunk when a section has to be split below the header level
+        length_function: Measures a piece of text (e.g. a tokenizer's token
+            count); defaults to the number of characters
+
+    Returns:
+        List of chunk strings
+    """
+    headers, fences = _scan(markdown)
+    fence_starts = [start for start, _ in fences]
+    chunks: List[str] = []
+
+    def measure(start: int, end: int) -> int:
+        if length_function is None:
+            return end - start
+        return length_function(markdown[start:end])
+
+    def strip(start: int, end: int) -> Tuple[int, int]:
+        while start < end and markdown[start].isspace():
+            start += 1
+        while end > start and markdown[end - 1].isspace():
+            end -= 1
+        return start, end
+
+    def fence_at(pos: int) -> Optional[Tuple[int, int]]:
+        i = bisect_right(fence_starts, pos) - 1
+        if i >= 0 and fences[i][0] <= pos < fences[i][1]:
+            return fences[i]
+        return None
+
+    def fence_overlaps(start: int, end: int) -> bool:
+        i = bisect_left(fence_starts, end) - 1
+        return i >= 0 and fences[i][1] > start
+
+    def word_blocks(start: int, end: int) -> Iterator[Span]:
+        """Cut a long run of words at whitespace into small blocks.
+
+        Packs almost as tightly as one unit per word, but without a Python-level
+        step per word. Blocks are no longer than the overlap, so overlap still
+        works at block granularity.
+        """
+        step = max(1, max_len // 8)
+        if overlap > 0:
+            step = min(step, overlap)
+        pos = start
+        while pos < end:
+            limit = pos + step
+            if limit >= end:
+                yield pos, end, end - pos
+                return
+            cut = max(markdown.rfind(' ', pos + 1, limit + 1), markdown.rfind('\n', pos + 1, limit + 1))
+            if cut < 0:
+                # A word longer than the block: end at the next whitespace, or hard split past max_len
+                m = _SEPARATORS[-1].search(markdown, limit, min(end, pos + max_len + 1))
+                cut = m.start() if m else min(end, pos + max_len)
+            yield pos, cut, cut - pos
+            pos = cut
+            while pos < end and markdown[pos].isspace():
+                pos += 1
+
+    def emit(start: int, end: int) -> None:
+        start, end = strip(start, end)
+        if start < end:
+            chunks.append(markdown[start:end])
+
+    def units(start: int, end: int, depth: int) -> Iterator[Span]:
+        """Yield pieces of [start, end) no larger than max_len, never cutting a fence."""
+        start, end = strip(start, end)
+        if start >= end:
+            return
+        size = measure(start, end)
+        if size <= max_len:
+            yield start, end, size
+            return
+        if depth == len(_SEPARATORS):
+            if fence_at(start) is not None or fence_at(end - 1) is not None:
+                yield start, end, size
+                return
+            # A single "word" longer than max_len (e.g. a long URL): hard split
+            step = max(1, (end - start) * max_len // size)
+            for pos in range(start, end, step):
+                yield pos, min(pos + step, end), measure(pos, min(pos + step, end))
+            return
+
+        if depth == len(_SEPARATORS) - 1 and length_function is None and not fence_overlaps(start, end):
+            yield from word_blocks(start, end)
+            return
+
+        pos = start
+        for m in _SEPARATORS[depth].finditer(markdown, start, end):
+            cut = m.start()
+            if fences and fence_at(cut) is not None:
+                continue
+            # Most pieces fit; yield them directly instead of recursing a level deeper
+            size = measure(pos, cut)
+            if size <= max_len:
+                if pos < cut:
+                    yield pos, cut, size
+            else:
+                yield from units(pos, cut, depth + 1)
+            pos = m.end()
+        yield from units(pos, end, depth + 1)
+
+    def split_oversized(start: int, end: int) -> None:
+        """Greedily pack paragraph/line/word units into chunks, with optional overlap."""
+        piece: List[Span] = []
+        piece_size = 0
+
+        def size_with(unit: Span) -> int:
+            if length_function is None:
+                # Exact for characters: separators between units count too
+                return unit[1] - piece[0][0] if piece else unit[2]
+            return piece_size + unit[2]
+
+        for unit in units(start, end, 0):
+            if piece and size_with(unit) > max_len:
+                emit(piece[0][0], piece[-1][1])
+                # Carry trailing units forward as overlap, as long as the new unit still fits
+                carried: List[Span] = []
+                carried_size = 0
+                for prev in reversed(piece):
+                    if carried_size + prev[2] > overlap:
+                        break
+                    carried.insert(0, prev)
+                    carried_size += prev[2]
+                piece, piece_size = carried, carried_size
+                while piece and size_with(unit) > max_len:
+                    piece_size -= piece.pop(0)[2]
+            piece.append(unit)
+            piece_size += unit[2]
+        if piece:
+            emit(piece[0][0], piece[-1][1])
+
+    def split_sections(start: int, end: int, level: int) -> None:
+        s, e = strip(start, end)
+        if s >= e:
+            return
+        if measure(s, e) <= max_len:
+            chunks.append(markdown[s:e])
+            return
+        if level == len(headers):
+            split_oversized(s, e)
+            return
+        offsets = headers[level]
+        cuts = offsets[bisect_right(offsets, start):bisect_left(offsets, end)]
+        if not cuts:
+            split_sections(start, end, level + 1)
+            return
+        bounds = [start, *cuts, end]
+        for a, b in zip(bounds, bounds[1:]):
+            split_sections(a, b, level + 1)
+
+    split_sections(0, len(markdown), 0)
+    return chunks
+
+
+def extract_section_info(chunk: str) -> Dict[str, Any]:
+    """Extracts headers and stats from a chunk."""
+    headers = re.findall(r'^(#+)\s+(.+)$', chunk, re.MULTILINE)
+    header_str = '; '.join([f'{h[0]} {h[1]}' for h in headers]) if headers else ''
+
+    return {
+        "headers": header_str,
+        "char_count": len(chunk),
+        "word_count": len(chunk.split())
+    }
+
+
+def chunk_page(
+    page: Dict[str,Any],
+    chunk_size: int,
+    chunk_overlap: int = 0,
+    token_model: Optional[str] = None
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Chunk one crawled page and pair each chunk with its section metadata.
+
+    When `token_model` is given, chunk_size and chunk_overlap are measured in
+    that embedding model's tokens instead of characters.
+    """
+    length_function = None
+    if token_model:
+        from embeddings import get_token_counter
+        length_function = get_token_counter(token_model)
+    chunks = smart_chunk_markdown(page['markdown'], max_len=chunk_size, overlap=chunk_overlap, length_function=length_function)
+    return [(chunk, extract_section_info(chunk)) for chunk in chunks]
+
+
+def chunk_pages(
+    pages: List[Dict[str,Any]],
+    chunk_size: int,
+    chunk_overlap: int = 0,
+    token_model: Optional[str] = None
+) -> List[List[Tuple[str, Dict[str, Any]]]]:
+    """Chunk a batch of pages; this is the unit of work sent to a worker process."""
+    return [chunk_page(page, chunk_size, chunk_overlap, token_model) for page in pages]
+
+
+def parallel_chunk_pages(
+    pages: Iterable[Dict[str,Any]],
+    chunk_size: int,
+    chunk_overlap: int = 0,
+    token_model: Optional[str] = None,
+    workers: Optional[int] = None,
+    pages_per_task: int = 16
+) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+    """Chunk pages across a process pool, yielding each page's chunks in input order.
+
+    Pages are sent to the workers in batches of `pages_per_task` to keep the
+    pickling overhead per page low.
+    """
+    def page_batches():
+        it = iter(pages)
+        while batch := list(islice(it, pages_per_task)):
+            yield batch
+
+    work = partial(chunk_pages, chunk_size=chunk_size, chunk_overlap=chunk_overlap, token_model=token_model)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(work, page_batches()):
+            yield from results
@@ -0,0 +1,184 @@
+"""Registry of the documentation sites served from one ChromaDB directory, one collection per site."""
+
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from ingest_state import get_manifest
+from utils import list_collection_names, query_collections
+
+
+def collection_name_for_site(url: str) -> str:
+    """Derive a valid Chroma collection name from a site URL (its host, without 'www.').
+
+    Args:
+        url: Site URL, with or without a scheme
+
+    Returns:
+        A name of 3-63 characters made of lowercase letters, digits and underscores
+    """
+    host = urlparse(url if "://" in url else f"https://{url}").hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    name = re.sub(r"[^a-z0-9]+", "_", host.lower()).strip("_")[:63].strip("_")
+    return name if len(name) >= 3 else f"site_{name or 'docs'}"
+
+
+class CollectionRegistry:
+    """Maps sites to collections and routes queries across them.
+
+    Sites are recorded in the ingest manifest (insert_docs registers the start
+    URL of every ingest), so the registry survives restarts and is shared by
+    every process using the directory. Collections are opened lazily: nothing
+    is loaded until a query touches a collection, and with
+    RAG_CHROMA_MEMORY_LIMIT_MB set Chroma keeps only the most recently used
+    indexes in memory (see utils.get_chroma_client).
+
+    A query names the collections (or site URLs) to search; when there are
+    more than `max_collections` of them, it is routed to the ones whose BM25
+    vocabulary matches the query best, so a question about one site doesn't
+    load every other site's index.
+    """
+
+    def __init__(self, db_dir: str, embedding_model: str = "all-MiniLM-L6-v2"):
+        """Create a registry for a ChromaDB directory.
+
+        Args:
+            db_dir: Directory where ChromaDB stores its data
+            embedding_model: Embedding model every collection was ingested with
+        """
+        self.db_dir = db_dir
+        self.embedding_model = embedding_model
+        self.manifest = get_manifest(db_dir)
+
+    def register(self, url: str, collection: Optional[str] = None) -> str:
+        """Register a site, by default under a collection named after its host.
+
+        Args:
+            url: Start URL of the site
+            collection: Collection to ingest it into
+
+        Returns:
+            The collection name
+        """
+        collection = collection or self.collection_for(url)
+        self.manifest.register_site(collection, url)
+        return collection
+
+    def collection_for(self, url: str) -> str:
+        """Collection a site is (or would be) stored in."""
+        sites = self.manifest.sites()
+        if url in sites:
+            return sites[url]
+        host = collection_name_for_site(url)
+        for site, collection in sites.items():
+            if collection_name_for_site(site) == host:
+                return collection
+        return host
+
+    def collections(self) -> List[str]:
+        """List every known collection.
+
+        Besides the collections in the manifest, this includes collections
+        that exist in Chroma without ever being registered, such as a `docs`
+        collection ingested before the registry existed.
+        """
+        return sorted(set(self.manifest.collections()).union(list_collection_names(self.db_dir)))
+
+    def sites(self) -> Dict[str, List[str]]:
+        """Map each collection to the site URLs registered for it."""
+        by_collection: Dict[str, List[str]] = {}
+        for url, collection in self.manifest.sites().items():
+            by_collection.setdefault(collection, []).append(url)
+        return by_collection
+
+    def resolve(self, targets: Sequence[str]) -> List[str]:
+        """Turn collection names and site URLs into collection names, ignoring unknown ones."""
+        known = set(self.collections())
+        resolved = []
+        for target in targets:
+            collection = target if target in known else self.collection_for(target)
+            if collection in known and collection not in resolved:
+                resolved.append(collection)
+        return resolved
+
+    def route(self, query_text: str, collections: Optional[Sequence[str]] = None, max_collections: int = 3) -> List[str]:
+        """Pick the collections most likely to answer a query.
+
+        Args:
+            query_text: Text to search for
+            collections: Candidate collections (default: all)
+            max_collections: Most collections to return
+
+        Returns:
+            Up to max_collections collection names, best match first; the
+            candidates in their given order if no query term matches any of them
+        """
+        candidates = list(collections) if collections is not None else self.collections()
+        if len(candidates) <= max_collections:
+            return candidates
+        from lexical_index import get_lexical_index
+
+        scores = get_lexical_index(self.db_dir).collection_scores(candidates, query_text)
+        if not scores:
+            return candidates[:max_collections]
+        return sorted(scores, key=scores.get, reverse=True)[:max_collections]
+
+    def query(
+        self,
+        query_text: str,
+        targets: Optional[Sequence[str]] = None,
+        n_results: int = 5,
+        max_collections: int = 3,
+        where: Optional[Dict[str, Any]] = None,
+        hybrid: bool = True,
+    ) -> Dict[str, Any]:
+        """Search the routed collections and merge their results (see utils.query_collections).
+
+        Args:
+            query_text: Text to search for
+            targets: Collection names or site URLs to search (default: all collections)
+            n_results: Number of results to return in total
+            max_collections: Most collections one query fans out to
+            where: Optional filter to apply in every collection
+            hybrid: Whether to fuse vector results with the BM25 index
+
+        Returns:
+            Merged query results; each metadata dict names its 'collection'
+
+        Raises:
+            ValueError: If none of the targets is a known collection
+        """
+        candidates = self.resolve(targets) if targets else self.collections()
+        if not candidates:
+            raise ValueError(f"No known collection among {list(targets or [])}")
+        return query_collections(
+            self.db_dir,
+            self.route(query_text, candidates, max_collections),
+            query_text,
+            n_results=n_results,
+            where=where,
+            embedding_model_name=self.embedding_model,
+            hybrid=hybrid
+        )
+
+
+_registries_lock = threading.Lock()
+_registries: Dict[Tuple[str, str], CollectionRegistry] = {}
+
+
+def get_collection_registry(db_dir: str, embedding_model: str = "all-MiniLM-L6-v2") -> CollectionRegistry:
+    """Get the process-wide registry for a ChromaDB directory and embedding model."""
+    key = (os.path.abspath(db_dir), embedding_model)
+    registry = _registries.get(key)
+    if registry is not None:
+        return registry
+
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = CollectionRegistry(db_dir, embedding_model)
+            _registries[key] = registry
+        return registry
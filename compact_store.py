@@ -0,0 +1,492 @@
+"""Compact int8 vector tier for large collections, kept in memory-mapped files."""
+
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Rows scored per step of the coarse scan; bounds the float32 scratch memory
+BLOCK_ROWS = 16384
+# Longest chunk ID that fits in the fixed-width ID file
+MAX_ID_BYTES = 64
+# Stores with fewer vectors are scanned in full; larger ones get an inverted-file (IVF) index
+IVF_MIN_ROWS = 50000
+# Share of the IVF lists probed per query
+IVF_PROBE_FRACTION = 1 / 8
+# k-means iterations, and training vectors sampled per list
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantize rows to int8 with one scale per row (symmetric, max-abs).
+
+    Args:
+        vectors: Float array of shape (n, dim)
+
+    Returns:
+        (codes, scales): int8 codes of shape (n, dim) and float32 scales of shape (n,),
+        with vectors ≈ codes * scales[:, None]
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def train_centroids(vectors: np.ndarray, lists: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: `lists` unit-length centroids for unit-length vectors.
+
+    Args:
+        vectors: Float32 array of shape (n, dim), n >= lists
+        lists: Number of centroids
+        iterations: Assignment/update rounds
+        seed: Seed of the random initial centroids
+
+    Returns:
+        Float32 array of shape (lists, dim)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        # An empty list keeps its old centroid
+        filled = np.bincount(assignment, minlength=lists) > 0
+        centroids[filled] = _normalize(sums[filled])
+    return centroids
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class CompactVectorStore:
+    """Cosine nearest-neighbour search over int8 codes with full-precision re-scoring.
+
+    Each vector is stored L2-normalized in two forms, in append-only files in
+    `directory`:
+
+        codes.i8     int8 codes, dim bytes per vector (the part that stays in RAM)
+        scales.f32   one float32 dequantization scale per vector
+        vectors.f32  the float32 vectors, only read for re-scoring candidates
+        ids.bin      chunk IDs, fixed width
+        deleted.u8   tombstones, one byte per vector
+
+    Everything is memory-mapped, so resident memory is whatever the OS keeps
+    cached. A query scores int8 codes (about a quarter of the float32 size,
+    and no graph) for `candidates` approximate neighbours, then re-scores them
+    exactly against their float32 vectors; only those rows of vectors.f32 are
+    read. Distances are cosine distances (1 - similarity), as in collections
+    created with hnsw:space=cosine.
+
+    Up to IVF_MIN_ROWS vectors, every code is scored. Larger stores get an
+    inverted-file index, so query time stops growing linearly with the store:
+    k-means on a sample of the vectors puts about sqrt(n) centroids in
+    centroids.f32, lists.i32 records each row's nearest centroid, and a query
+    only scores the codes of the rows in its `nprobe` nearest lists (kept in
+    memory grouped by list). Probing fewer lists is faster but can miss
+    neighbours that fell into another list; `python benchmarks.py compact
+    --nprobe N` shows the trade-off. Rows added later are assigned to the
+    existing centroids; the centroids are retrained once the store has grown
+    fourfold. Training takes a few seconds and happens on the first search
+    that needs it.
+
+    Deleted rows are tombstoned, not reclaimed; rebuild the store with
+    backfill() into a fresh directory to drop them. Adds and deletes find the
+    rows of existing IDs through an in-memory ID-to-row map, built from
+    ids.bin on first use and extended with each appended row.
+
+    The store sits next to a Chroma collection, not in place of it: Chroma
+    still keeps its own float32 vectors and HNSW index, so the vectors take
+    roughly twice the disk space. Only queries without a metadata filter are
+    served from this store; they never load the HNSW index, which is where
+    the memory saving comes from. Filtered queries still go to Chroma.
+    """
+
+    def __init__(self, directory: str, dim: Optional[int] = None, embedding_model: Optional[str] = None):
+        """Open (or create) a store.
+
+        Args:
+            directory: Directory holding the store's files
+            dim: Vector dimension; required when creating a store
+            embedding_model: Name of the model the vectors come from, recorded when creating
+
+        Raises:
+            ValueError: If the store does not exist and no dim was given, or dim mismatches
+        """
+        self.directory = directory
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if dim is not None and dim != meta["dim"]:
+                raise ValueError(f"Store in {directory} has dimension {meta['dim']}, not {dim}")
+        else:
+            if dim is None:
+                raise ValueError(f"No compact vector store in {directory}; a dimension is needed to create one")
+            os.makedirs(directory, exist_ok=True)
+            meta = {"dim": dim, "embedding_model": embedding_model}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        self.dim: int = meta["dim"]
+        self.embedding_model: Optional[str] = meta.get("embedding_model")
+        self._lock = threading.Lock()
+        self._count = -1
+        self._arrays: Dict[str, np.ndarray] = {}
+        # Live row of each ID, and how many rows of ids.bin have been read into it
+        self._rows: Dict[bytes, int] = {}
+        self._indexed = 0
+        # IVF centroids, each row's list and the rows grouped by list; see _ivf_locked
+        self._ivf: Optional[Dict[str, Any]] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _row_bytes(self) -> Dict[str, int]:
+        return {"codes.i8": self.dim, "scales.f32": 4, "vectors.f32": 4 * self.dim, "ids.bin": MAX_ID_BYTES, "deleted.u8": 1}
+
+    def _disk_count(self) -> int:
+        # A write interrupted half-way leaves some files a row longer; only complete rows count
+        counts = []
+        for name, row_bytes in self._row_bytes().items():
+            path = self._path(name)
+            counts.append(os.path.getsize(path) // row_bytes if os.path.exists(path) else 0)
+        return min(counts)
+
+    def _load(self) -> Tuple[int, Dict[str, np.ndarray]]:
+        """Memory-map the files, re-mapping them if another writer appended rows."""
+        with self._lock:
+            return self._load_locked()
+
+    def _load_locked(self) -> Tuple[int, Dict[str, np.ndarray]]:
+        """_load() for callers that hold the lock."""
+        count = self._disk_count()
+        if count != self._count:
+            self._arrays = {}
+            if count:
+                self._arrays = {
+                    "codes": np.memmap(self._path("codes.i8"), dtype=np.int8, mode="r", shape=(count, self.dim)),
+                    "scales": np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r", shape=(count,)),
+                    "vectors": np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(count, self.dim)),
+                    "ids": np.memmap(self._path("ids.bin"), dtype=f"S{MAX_ID_BYTES}", mode="r", shape=(count,)),
+                    "deleted": np.memmap(self._path("deleted.u8"), dtype=np.uint8, mode="r", shape=(count,)),
+                }
+            self._count = count
+        return self._count, self._arrays
+
+    def _train_ivf(self, count: int, arrays: Dict[str, np.ndarray]) -> None:
+        lists = int(np.sqrt(count))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(count, min(count, KMEANS_SAMPLE_PER_LIST * lists), replace=False))
+        sample = sample[arrays["deleted"][sample] == 0]
+        centroids = train_centroids(np.asarray(arrays["vectors"][sample]), min(lists, len(sample)))
+        # Replaced atomically; other processes notice the new file and reassign their rows
+        path = self._path("centroids.f32")
+        centroids.astype(np.float32).tofile(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        np.empty(0, dtype=np.int32).tofile(self._path("lists.i32"))
+
+    def _ivf_locked(self, count: int, arrays: Dict[str, np.ndarray]) -> Optional[Dict[str, Any]]:
+        """The IVF index covering the first `count` rows, or None for a store scanned in full; call with the lock held."""
+        if count < IVF_MIN_ROWS:
+            return None
+        centroids_path, lists_path = self._path("centroids.f32"), self._path("lists.i32")
+        trained = os.path.getsize(centroids_path) // (4 * self.dim) if os.path.exists(centroids_path) else 0
+        if 2 * trained < int(np.sqrt(count)):
+            self._train_ivf(count, arrays)
+        stat = os.stat(centroids_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        ivf = self._ivf
+        if ivf is None or ivf["version"] != version:
+            centroids = np.fromfile(centroids_path, dtype=np.float32).reshape(-1, self.dim)
+            ivf = {"version": version, "centroids": centroids, "assignment": np.empty(0, dtype=np.int32)}
+        assigned = len(ivf["assignment"])
+        if assigned < count:
+            # Rows assigned by any process are read back; only the rest are assigned here
+            stored = np.fromfile(lists_path, dtype=np.int32) if os.path.exists(lists_path) else np.empty(0, dtype=np.int32)
+            assignment = [stored[:count]]
+            for start in range(len(assignment[0]), count, BLOCK_ROWS):
+                stop = min(count, start + BLOCK_ROWS)
+                # The per-row scale doesn't change which centroid is nearest
+                block = np.argmax(arrays["codes"][start:stop].astype(np.float32) @ ivf["centroids"].T, axis=1).astype(np.int32)
+                with open(lists_path, "r+b" if os.path.exists(lists_path) else "wb") as f:
+                    f.seek(4 * start)
+                    f.write(block.tobytes())
+                assignment.append(block)
+            ivf["assignment"] = np.concatenate(assignment)
+            order = np.argsort(ivf["assignment"], kind="stable")
+            ivf["order"] = order
+            ivf["offsets"] = np.searchsorted(ivf["assignment"][order], np.arange(len(ivf["centroids"]) + 1))
+            # An in-memory copy of the codes grouped by list, so each probed list is one contiguous block
+            ivf["codes"] = np.asarray(arrays["codes"][:count])[order]
+            ivf["scales"] = np.asarray(arrays["scales"][:count])[order]
+        self._ivf = ivf
+        return ivf
+
+    def __len__(self) -> int:
+        """Number of live (not deleted) vectors."""
+        count, arrays = self._load()
+        return count - int(np.count_nonzero(arrays["deleted"])) if count else 0
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """Bytes of the scanned tier (codes + scales) and of the full-precision tier."""
+        count, _ = self._load()
+        return {"compact": count * (self.dim + 4), "full": count * self.dim * 4}
+
+    def _rows_of(self, ids: Sequence[str], count: int, arrays: Dict[str, np.ndarray]) -> np.ndarray:
+        """Live rows holding the given IDs; call with the lock held."""
+        if count < self._indexed:
+            # The files were replaced; start over
+            self._rows, self._indexed = {}, 0
+        if count > self._indexed:
+            # Only rows appended since the last lookup are read, by this or another writer
+            new_ids = arrays["ids"][self._indexed:count]
+            live = np.flatnonzero(arrays["deleted"][self._indexed:count] == 0)
+            for offset, cid in zip(live.tolist(), new_ids[live].tolist()):
+                self._rows[cid] = self._indexed + offset
+            self._indexed = count
+        rows = []
+        for cid in ids:
+            row = self._rows.get(cid.encode("utf-8"))
+            # Another writer may have tombstoned it since it was indexed
+            if row is not None and not arrays["deleted"][row]:
+                rows.append(row)
+        return np.array(rows, dtype=np.int64)
+
+    def _tombstone(self, rows: np.ndarray) -> None:
+        with open(self._path("deleted.u8"), "r+b") as f:
+            for row in rows:
+                f.seek(int(row))
+                f.write(b"\x01")
+
+    def add(self, ids: Sequence[str], embeddings: Any) -> None:
+        """Append vectors; an ID that is already stored has its old row replaced.
+
+        Args:
+            ids: Chunk IDs (at most 64 bytes of UTF-8 each)
+            embeddings: Array-like of shape (len(ids), dim)
+        """
+        if not len(ids):
+            return
+        encoded = [i.encode("utf-8") for i in ids]
+        if any(len(e) > MAX_ID_BYTES for e in encoded):
+            raise ValueError(f"Chunk IDs longer than {MAX_ID_BYTES} bytes cannot be stored")
+        vectors = _normalize(embeddings)
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"Expected {len(ids)} vectors of dimension {self.dim}, got {vectors.shape}")
+        codes, scales = quantize(vectors)
+
+        with self._lock:
+            # Loaded under the lock, so a concurrent add can't append rows between the lookup and the write
+            count, arrays = self._load_locked()
+            replaced = self._rows_of(ids, count, arrays)
+            if len(replaced):
+                self._tombstone(replaced)
+            # Scales last: a row only counts once every file holds it (see _disk_count)
+            for name, data in (
+                ("vectors.f32", vectors.tobytes()),
+                ("codes.i8", codes.tobytes()),
+                ("ids.bin", np.array(encoded, dtype=f"S{MAX_ID_BYTES}").tobytes()),
+                ("deleted.u8", bytes(len(ids))),
+                ("scales.f32", scales.tobytes()),
+            ):
+                with open(self._path(name), "ab") as f:
+                    f.write(data)
+            self._count = -1
+
+    def delete(self, ids: Sequence[str]) -> None:
+        """Tombstone the rows of the given chunk IDs."""
+        with self._lock:
+            count, arrays = self._load_locked()
+            rows = self._rows_of(ids, count, arrays)
+            if len(rows):
+                self._tombstone(rows)
+                for cid in ids:
+                    self._rows.pop(cid.encode("utf-8"), None)
+                self._count = -1
+
+    def search(
+        self,
+        query_embeddings: Any,
+        n_results: int = 5,
+        candidates: Optional[int] = None,
+        rescore: bool = True,
+        nprobe: Optional[int] = None
+    ) -> Tuple[List[List[str]], List[List[float]]]:
+        """Find the nearest stored vectors of each query.
+
+        Args:
+            query_embeddings: Array-like of shape (queries, dim) or (dim,)
+            n_results: Neighbours to return per query
+            candidates: Approximate neighbours re-scored per query (default: max(10 * n_results, 100))
+            rescore: Whether to re-score candidates with the float32 vectors; without it the
+                int8 scores are returned directly
+            nprobe: IVF lists searched per query, once the store is large enough
+                to have them (default: IVF_PROBE_FRACTION of the lists)
+
+        Returns:
+            (ids, distances): one list per query, nearest first
+        """
+        queries = _normalize(query_embeddings)
+        count, arrays = self._load()
+        if not count:
+            return [[] for _ in queries], [[] for _ in queries]
+        candidates = max(n_results, candidates or max(10 * n_results, 100))
+        if not rescore:
+            candidates = n_results
+        with self._lock:
+            ivf = self._ivf_locked(count, arrays)
+        if ivf is not None:
+            best_rows, best_scores = self._probe(ivf, arrays, queries, candidates, nprobe)
+        else:
+            best_rows, best_scores = self._scan(count, arrays, queries, candidates)
+
+        all_ids: List[List[str]] = []
+        all_distances: List[List[float]] = []
+        for query, rows, scores in zip(queries, best_rows, best_scores):
+            live = np.isfinite(scores)
+            rows, scores = rows[live], scores[live]
+            if rescore and len(rows):
+                # Sorted rows turn the memmap gather into a forward scan
+                rows = np.sort(rows)
+                scores = arrays["vectors"][rows] @ query
+            order = np.argsort(-scores, kind="stable")[:n_results]
+            all_ids.append([arrays["ids"][r].decode("utf-8") for r in rows[order]])
+            all_distances.append([float(1.0 - s) for s in scores[order]])
+        return all_ids, all_distances
+
+    @staticmethod
+    def _scan(count: int, arrays: Dict[str, np.ndarray], queries: np.ndarray, candidates: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score every int8 code, keeping the running best `candidates` rows per query."""
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, count, BLOCK_ROWS):
+            stop = min(count, start + BLOCK_ROWS)
+            scores = (arrays["codes"][start:stop].astype(np.float32) @ queries.T).T * arrays["scales"][start:stop]
+            scores[:, arrays["deleted"][start:stop] != 0] = -np.inf
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, stop), scores.shape)], axis=1)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            if scores.shape[1] > candidates:
+                keep = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+                rows = np.take_along_axis(rows, keep, axis=1)
+                scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows, best_scores = rows, scores
+        return best_rows, best_scores
+
+    @staticmethod
+    def _probe(
+        ivf: Dict[str, Any],
+        arrays: Dict[str, np.ndarray],
+        queries: np.ndarray,
+        candidates: int,
+        nprobe: Optional[int]
+    ) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Score the int8 codes in each query's nearest IVF lists, keeping the best `candidates` rows."""
+        lists = len(ivf["centroids"])
+        nprobe = min(lists, nprobe or max(1, int(np.ceil(lists * IVF_PROBE_FRACTION))))
+        probed = np.argpartition(-(queries @ ivf["centroids"].T), nprobe - 1, axis=1)[:, :nprobe]
+        order, offsets = ivf["order"], ivf["offsets"]
+        best_rows, best_scores = [], []
+        for query, nearest in zip(queries, probed):
+            spans = [(offsets[i], offsets[i + 1]) for i in nearest]
+            positions = np.concatenate([np.arange(start, stop) for start, stop in spans])
+            codes = np.concatenate([ivf["codes"][start:stop] for start, stop in spans])
+            scores = (codes.astype(np.float32) @ query) * ivf["scales"][positions]
+            rows = order[positions]
+            scores[arrays["deleted"][rows] != 0] = -np.inf
+            if len(rows) > candidates:
+                keep = np.argpartition(-scores, candidates - 1)[:candidates]
+                rows, scores = rows[keep], scores[keep]
+            best_rows.append(rows)
+            best_scores.append(scores)
+        return best_rows, best_scores
+
+    def query(self, collection: Any, query_embeddings: Any, n_results: int = 5) -> Dict[str, Any]:
+        """Search the store and fetch the hits' documents from their Chroma collection.
+
+        Only Chroma's document store is read (collection.get), not its HNSW index.
+
+        Returns:
+            Results in the same shape as collection.query (one entry per query)
+        """
+        ids, distances = self.search(query_embeddings, n_results)
+        wanted = sorted({cid for hits in ids for cid in hits})
+        by_id = {}
+        if wanted:
+            fetched = collection.get(ids=wanted, include=["documents", "metadatas"])
+            by_id = {cid: (doc, meta) for cid, doc, meta in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])}
+        results: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for hits, dists in zip(ids, distances):
+            kept = [(cid, d) for cid, d in zip(hits, dists) if cid in by_id]
+            results["ids"].append([cid for cid, _ in kept])
+            results["documents"].append([by_id[cid][0] for cid, _ in kept])
+            results["metadatas"].append([by_id[cid][1] for cid, _ in kept])
+            results["distances"].append([d for _, d in kept])
+        return results
+
+    def backfill(self, collection: Any, batch_size: int = 1000) -> int:
+        """Copy every embedding of a Chroma collection into the store.
+
+        Returns:
+            Number of vectors copied
+        """
+        copied = 0
+        while True:
+            page = collection.get(include=["embeddings"], limit=batch_size, offset=copied)
+            if not len(page["ids"]):
+                return copied
+            self.add(page["ids"], np.asarray(page["embeddings"], dtype=np.float32))
+            copied += len(page["ids"])
+
+
+def compact_store_path(db_dir: str, collection: str) -> str:
+    """Directory of a collection's compact vector tier inside a ChromaDB directory."""
+    return os.path.join(db_dir, "compact", collection)
+
+
+_stores_lock = threading.Lock()
+_stores: Dict[str, CompactVectorStore] = {}
+
+
+def get_compact_store(
+    db_dir: str,
+    collection: str,
+    dim: Optional[int] = None,
+    embedding_model: Optional[str] = None,
+    create: bool = False
+) -> Optional[CompactVectorStore]:
+    """Get the process-wide compact store of a collection.
+
+    Args:
+        db_dir: Directory where ChromaDB stores its data
+        collection: Name of the collection
+        dim: Vector dimension, needed with create
+        embedding_model: Embedding model name recorded when creating
+        create: Whether to create the store if the collection has none
+
+    Returns:
+        The store, or None if the collection has no compact tier and create is False
+    """
+    path = os.path.abspath(compact_store_path(db_dir, collection))
+    store = _stores.get(path)
+    if store is not None:
+        return store
+    if not create and not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = CompactVectorStore(path, dim, embedding_model)
+            _stores[path] = store
+        return store
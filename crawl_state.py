@@ -0,0 +1,231 @@
+"""Persistent crawl state: the URL frontier of resumable crawls and the page cache."""
+
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+class CrawlFrontier:
+    """SQLite-backed work queue of URLs for one crawl, with per-URL status and depth.
+
+    Each URL is recorded once per crawl. Claiming moves it from pending to
+    in_progress and finishing marks it done or failed, so after a crash the
+    crawl resumes from the URLs that were never completed.
+
+    Use as an async context manager:
+
+        async with CrawlFrontier(path, crawl_id) as frontier:
+            resumed = await frontier.start(seed_urls)
+    """
+
+    def __init__(self, path: str, crawl_id: str):
+        """Create a frontier; the database is opened on entering the context.
+
+        Args:
+            path: Path of the SQLite file, or ":memory:" for a throwaway frontier
+            crawl_id: Identifies the crawl so a restart with the same ID resumes it
+        """
+        self.path = path
+        self.crawl_id = crawl_id
+        self._db: Optional[aiosqlite.Connection] = None
+
+    async def __aenter__(self) -> "CrawlFrontier":
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute(
+            "CREATE TABLE IF NOT EXISTS crawls ("
+            " crawl_id TEXT PRIMARY KEY,"
+            " finished INTEGER NOT NULL DEFAULT 0,"
+            " started_at REAL NOT NULL)"
+        )
+        await self._db.execute(
+            "CREATE TABLE IF NOT EXISTS frontier ("
+            " crawl_id TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " depth INTEGER NOT NULL,"
+            " lastmod TEXT,"
+            " status TEXT NOT NULL,"
+            " error TEXT,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (crawl_id, url))"
+        )
+        await self._db.execute(
+            "CREATE INDEX IF NOT EXISTS frontier_pending ON frontier (crawl_id, status, depth)"
+        )
+        await self._db.commit()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._db.close()
+        self._db = None
+
+    async def start(self, seed_urls: Iterable[str], lastmods: Optional[Dict[str, str]] = None) -> bool:
+        """Start the crawl, or resume it if a previous run with the same ID didn't finish.
+
+        Args:
+            seed_urls: URLs to crawl at depth 0
+            lastmods: Sitemap <lastmod> of seed URLs, keyed by URL
+
+        Returns:
+            True if an unfinished crawl was resumed
+        """
+        cursor = await self._db.execute("SELECT finished FROM crawls WHERE crawl_id = ?", (self.crawl_id,))
+        row = await cursor.fetchone()
+        if row is not None and not row[0]:
+            # URLs that were in flight when the previous run died are fetched again
+            await self._db.execute(
+                "UPDATE frontier SET status = ? WHERE crawl_id = ? AND status = ?",
+                (PENDING, self.crawl_id, IN_PROGRESS),
+            )
+            await self._db.commit()
+            return True
+
+        # A finished (or new) crawl starts over from the seeds
+        await self._db.execute("DELETE FROM frontier WHERE crawl_id = ?", (self.crawl_id,))
+        await self._db.execute(
+            "INSERT OR REPLACE INTO crawls (crawl_id, finished, started_at) VALUES (?, 0, ?)",
+            (self.crawl_id, time.time()),
+        )
+        await self.add(seed_urls, depth=0, lastmods=lastmods)
+        return False
+
+    async def add(self, urls: Iterable[str], depth: int, lastmods: Optional[Dict[str, str]] = None) -> None:
+        """Add URLs at a depth; URLs already in the frontier are ignored.
+
+        Args:
+            urls: URLs to add
+            depth: Link distance from the seed URLs
+            lastmods: Sitemap <lastmod> of the URLs, keyed by URL
+        """
+        now = time.time()
+        lastmods = lastmods or {}
+        await self._db.executemany(
+            "INSERT OR IGNORE INTO frontier (crawl_id, url, depth, lastmod, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(self.crawl_id, url, depth, lastmods.get(url), PENDING, now) for url in urls],
+        )
+        await self._db.commit()
+
+    async def claim(self, limit: int) -> List[Tuple[str, int, Optional[str]]]:
+        """Claim up to `limit` pending URLs, shallowest first.
+
+        Returns:
+            (url, depth, lastmod) tuples now marked in_progress
+        """
+        cursor = await self._db.execute(
+            "SELECT url, depth, lastmod FROM frontier WHERE crawl_id = ? AND status = ?"
+            " ORDER BY depth, rowid LIMIT ?",
+            (self.crawl_id, PENDING, limit),
+        )
+        rows = await cursor.fetchall()
+        if rows:
+            now = time.time()
+            await self._db.executemany(
+                "UPDATE frontier SET status = ?, updated_at = ? WHERE crawl_id = ? AND url = ?",
+                [(IN_PROGRESS, now, self.crawl_id, row[0]) for row in rows],
+            )
+            await self._db.commit()
+        return [tuple(row) for row in rows]
+
+    async def complete(self, url: str, error: Optional[str] = None) -> None:
+        """Mark a claimed URL as done, or as failed if an error is given."""
+        await self._db.execute(
+            "UPDATE frontier SET status = ?, error = ?, updated_at = ? WHERE crawl_id = ? AND url = ?",
+            (FAILED if error else DONE, error, time.time(), self.crawl_id, url),
+        )
+        await self._db.commit()
+
+    async def finish(self) -> None:
+        """Mark the crawl finished so the next run with the same ID starts over."""
+        await self._db.execute("UPDATE crawls SET finished = 1 WHERE crawl_id = ?", (self.crawl_id,))
+        await self._db.commit()
+
+
+class PageCache:
+    """Per-URL validators and content hashes from previous crawls.
+
+    Stores the ETag and Last-Modified response headers, the sitemap <lastmod>
+    and a hash of the extracted markdown, plus the page's internal links so a
+    recursive crawl can keep expanding past pages it skips as unchanged.
+    Entries are scoped (e.g. per collection) so a page skipped for one
+    collection is still ingested into another.
+    """
+
+    def __init__(self, path: str, scope: str = ""):
+        """Create a page cache; the database is opened on entering the context.
+
+        Args:
+            path: Path of the SQLite file
+            scope: Namespace for the entries, such as the target collection
+        """
+        self.path = path
+        self.scope = scope
+        self._db: Optional[aiosqlite.Connection] = None
+
+    async def __aenter__(self) -> "PageCache":
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " scope TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " lastmod TEXT,"
+            " content_hash TEXT,"
+            " links TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " PRIMARY KEY (scope, url))"
+        )
+        await self._db.commit()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._db.close()
+        self._db = None
+
+    async def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for a URL, or None if it was never crawled."""
+        cursor = await self._db.execute(
+            "SELECT etag, last_modified, lastmod, content_hash, links FROM pages WHERE scope = ? AND url = ?",
+            (self.scope, url),
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "lastmod": row[2],
+            "content_hash": row[3],
+            "links": json.loads(row[4]) if row[4] else [],
+        }
+
+    async def put(
+        self,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        lastmod: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        links: Optional[List[str]] = None,
+    ) -> None:
+        """Record the validators and content hash of a freshly crawled page."""
+        await self._db.execute(
+            "INSERT OR REPLACE INTO pages (scope, url, etag, last_modified, lastmod, content_hash, links, fetched_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.scope, url, etag, last_modified, lastmod, content_hash, json.dumps(links or []), time.time()),
+        )
+        await self._db.commit()
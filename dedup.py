@@ -0,0 +1,126 @@
+"""Near-duplicate chunk detection with 64-bit SimHash and LSH banding."""
+
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ingest_state import IngestManifest, normalize_chunk_text
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# With 4 bands of 16 bits, two fingerprints within 3 bits of each other share at least one band
+MAX_DISTANCE = BANDS - 1
+SHINGLE_SIZE = 3
+# Below this many words a SimHash is too coarse to trust; such chunks only match identical text
+MIN_NEAR_WORDS = 12
+
+
+def simhash(text: str) -> int:
+    """Compute the 64-bit SimHash of a chunk over its lowercased word shingles.
+
+    Args:
+        text: Chunk text
+
+    Returns:
+        The fingerprint as an unsigned 64-bit integer
+    """
+    words = normalize_chunk_text(text).lower().split()
+    if len(words) > SHINGLE_SIZE:
+        shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    else:
+        shingles = [" ".join(words)]
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(shingles), 64)
+    # Each bit of the fingerprint is the majority vote of that bit over all shingle hashes
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def is_short(text: str) -> bool:
+    """Whether a chunk is too short for near-duplicate matching."""
+    return len(text.split()) < MIN_NEAR_WORDS
+
+
+def fingerprint(text: str) -> int:
+    """Compute the 64-bit fingerprint a chunk is indexed and matched by.
+
+    Chunks of at least MIN_NEAR_WORDS words get their SimHash, so similar
+    texts get nearby fingerprints. Shorter chunks get a content hash of their
+    normalized text instead, independent of the page URL (unlike chunk_id):
+    it only equals the fingerprint of the same text, and is as good as random
+    against every other fingerprint, so a short chunk is never folded into
+    a different text whose SimHash happens to collide with its own.
+    """
+    if is_short(text):
+        digest = hashlib.blake2b(normalize_chunk_text(text).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+    return simhash(text)
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits between two fingerprints."""
+    return bin(a ^ b).count("1")
+
+
+def bands(fingerprint: int) -> List[int]:
+    """Split a fingerprint into its LSH band values."""
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    """Finds stored (or pending) chunks of a collection that a new chunk nearly duplicates.
+
+    Fingerprints of stored chunks live in the ingest manifest; fingerprints of
+    chunks accepted during the current ingest but not written yet are kept in
+    memory so duplicates within one crawl are caught too.
+    """
+
+    def __init__(self, manifest: IngestManifest, collection: str, max_distance: int = MAX_DISTANCE):
+        """Create an index view for one collection.
+
+        Args:
+            manifest: Manifest holding the stored fingerprints
+            collection: Name of the collection
+            max_distance: Largest Hamming distance counted as a near duplicate (0 means exact only)
+        """
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f"max_distance must be between 0 and {MAX_DISTANCE}, got {max_distance}")
+        self.manifest = manifest
+        self.collection = collection
+        self.max_distance = max_distance
+        self._pending: Dict[Tuple[int, int], List[Tuple[str, int, str]]] = {}
+
+    def find(self, text: str, fingerprint: int, source: str) -> Optional[str]:
+        """Return the ID of the closest near duplicate of a chunk from another page, or None.
+
+        Chunks first stored for `source` itself never match: an edited chunk of
+        a page replaces its previous version instead of collapsing into it.
+
+        Args:
+            text: Chunk text (short chunks only match identical text)
+            fingerprint: fingerprint(text)
+            source: URL of the page the chunk belongs to
+
+        Returns:
+            The ID of the matching chunk, if any
+        """
+        limit = 0 if is_short(text) else self.max_distance
+        candidates = self.manifest.find_fingerprints(self.collection, bands(fingerprint))
+        for band, value in enumerate(bands(fingerprint)):
+            candidates.extend(self._pending.get((band, value), ()))
+
+        best = None
+        for cid, other, owner in candidates:
+            if owner == source:
+                continue
+            distance = hamming(fingerprint, other)
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, cid)
+        return best[1] if best else None
+
+    def add(self, chunk_id: str, fingerprint: int, source: str) -> None:
+        """Register a chunk accepted for storage so later chunks can match it before it is written."""
+        for band, value in enumerate(bands(fingerprint)):
+            self._pending.setdefault((band, value), []).append((chunk_id, fingerprint, source))
@@ -0,0 +1,424 @@
+"""Embedding engine, embedding functions and the persistent embedding cache.
+
+Nothing here imports chromadb, so processes that only embed or count tokens
+(chunk workers, the answer cache) never load it; Chroma gets its adapter from
+get_chroma_embedding_function().
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+import metrics
+
+if TYPE_CHECKING:
+    from chromadb.api.types import EmbeddingFunction
+    from sentence_transformers import SentenceTransformer
+
+EmbeddingFunc = Callable[[List[str]], List[np.ndarray]]
+
+
+class EmbeddingCache:
+    """On-disk cache of embedding vectors keyed by (model name, text hash).
+
+    Vectors are stored as float32 blobs in SQLite. Every hit refreshes the
+    entry's recency stamp, and once the cache grows past `max_entries` the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100_000):
+        """Open (or create) the cache database.
+
+        Args:
+            path: Path of the SQLite file
+            max_entries: Maximum number of vectors to keep before evicting
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Chroma may call the embedding function from any thread; access is serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL,"
+                " text_hash TEXT NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " last_used INTEGER NOT NULL,"
+                " PRIMARY KEY (model, text_hash))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()[0]
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Hash a text for use as a cache key."""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """Look up cached vectors.
+
+        Args:
+            model: Name of the embedding model
+            hashes: Text hashes to look up
+
+        Returns:
+            A dict mapping each cached hash to its vector; missing hashes are omitted
+        """
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._clock += 1
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                        [(self._clock, model, h) for h in found],
+                    )
+            hit_count = sum(1 for h in hashes if h in found)
+            self.hits += hit_count
+            self.misses += len(hashes) - hit_count
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]) -> None:
+        """Store vectors, evicting the least recently used entries if over capacity.
+
+        Args:
+            model: Name of the embedding model
+            vectors: A dict mapping text hashes to vectors
+        """
+        if not vectors:
+            return
+        with self._lock, self._conn:
+            self._clock += 1
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes(), self._clock) for h, v in vectors.items()],
+            )
+            self._size += len(vectors)
+            if self._size > self.max_entries:
+                self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._size > self.max_entries:
+                # Evict down to 90% of capacity so eviction doesn't run on every insert
+                excess = self._size - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN"
+                    " (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._size -= excess
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current number of cached vectors."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size,
+        }
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class SentenceTransformerEngine:
+    """Embeds texts with the shared SentenceTransformer for a model.
+
+    Texts are sorted by length before batching so each encode batch holds
+    similarly sized inputs and wastes little work on padding. With more than
+    one worker, encoding is spread over a pool of worker processes; the
+    model's weights are moved to shared memory first, so the workers use the
+    parent's single copy. Vectors are returned as float32 arrays that can go
+    straight to collection.add.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 64, workers: int = 0):
+        """Create an engine; the model itself is loaded on first use.
+
+        Args:
+            model_name: Name of the sentence-transformers model
+            batch_size: Default number of texts per encode batch
+            workers: Default number of worker processes (0 or 1 encodes in-process)
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.workers = workers
+        self._pool: Optional[Dict[str, Any]] = None
+        self._pool_size = 0
+        self._pool_lock = threading.Lock()
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        return get_sentence_transformer(self.model_name)
+
+    def _get_pool(self, workers: int) -> Dict[str, Any]:
+        with self._pool_lock:
+            if self._pool is not None and self._pool_size != workers:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+            if self._pool is None:
+                # Workers receive handles to these shared tensors instead of each unpickling a private copy
+                self.model.share_memory()
+                self._pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+                self._pool_size = workers
+            return self._pool
+
+    def close(self) -> None:
+        """Stop the worker processes, if any were started."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+
+    def embed(self, texts: List[str], batch_size: Optional[int] = None, workers: Optional[int] = None) -> np.ndarray:
+        """Embed texts.
+
+        Args:
+            texts: Texts to embed
+            batch_size: Number of texts per encode batch (defaults to the engine's)
+            workers: Number of worker processes (defaults to the engine's)
+
+        Returns:
+            A float32 array with one row per text, in input order
+        """
+        batch_size = batch_size or self.batch_size
+        workers = self.workers if workers is None else workers
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        with metrics.span("embedding.encode", model=self.model_name):
+            if workers > 1 and len(texts) > batch_size:
+                encoded = self.model.encode_multi_process(sorted_texts, self._get_pool(workers), batch_size=batch_size)
+            else:
+                encoded = self.model.encode(
+                    sorted_texts,
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                    show_progress_bar=False
+                )
+        metrics.increment("embedding_texts", len(texts), model=self.model_name)
+
+        vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+        vectors[order] = encoded
+        return vectors
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        return list(self.embed(list(input)))
+
+
+class CachedEmbeddingFunction:
+    """Embedding function that serves repeated texts from an EmbeddingCache."""
+
+    def __init__(self, embedding_function: EmbeddingFunc, model_name: str, cache: EmbeddingCache):
+        """Wrap an embedding function with a cache.
+
+        Args:
+            embedding_function: The embedding function that computes missing vectors
+            model_name: Name of the embedding model, used as part of the cache key
+            cache: Cache to read from and write to
+        """
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed(self, texts: List[str], **encode_kwargs: Any) -> np.ndarray:
+        """Embed texts, computing only the ones missing from the cache.
+
+        Args:
+            texts: Texts to embed
+            **encode_kwargs: Passed to the wrapped function's embed() (e.g. batch_size, workers)
+
+        Returns:
+            A float32 array with one row per text
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        hashes = [EmbeddingCache.text_hash(t) for t in texts]
+        vectors = self.cache.get_many(self.model_name, hashes)
+
+        # Embed each distinct missing text once, even if it repeats within the batch
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in vectors:
+                missing.setdefault(h, text)
+        metrics.increment("embedding_cache_hits", len(texts) - len(missing), model=self.model_name)
+        metrics.increment("embedding_cache_misses", len(missing), model=self.model_name)
+        if missing:
+            if hasattr(self.embedding_function, "embed"):
+                computed = self.embedding_function.embed(list(missing.values()), **encode_kwargs)
+            else:
+                computed = self.embedding_function(list(missing.values()))
+            new_vectors = {h: np.asarray(v, dtype=np.float32) for h, v in zip(missing, computed)}
+            self.cache.put_many(self.model_name, new_vectors)
+            vectors.update(new_vectors)
+
+        return np.stack([vectors[h] for h in hashes])
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        return list(self.embed(list(input)))
+
+
+# Process-wide registry so each model (and each cache file) is loaded once and
+# shared by every collection handle, asyncio task and Streamlit session.
+_registry_lock = threading.Lock()
+_models: Dict[str, SentenceTransformerEngine] = {}
+_caches: Dict[str, EmbeddingCache] = {}
+_cached_functions: Dict[tuple, CachedEmbeddingFunction] = {}
+_chroma_functions: Dict[tuple, "EmbeddingFunction"] = {}
+_sentence_transformers: Dict[str, "SentenceTransformer"] = {}
+_tokenizers: Dict[str, Any] = {}
+
+
+def get_embedding_function(model_name: str, cache_path: Optional[str] = None) -> EmbeddingFunc:
+    """Get the shared embedding function for a model.
+
+    The result is a SentenceTransformerEngine, wrapped in a CachedEmbeddingFunction
+    when `cache_path` is given; both expose embed() returning float32 arrays.
+
+    Args:
+        model_name: Name of the sentence-transformers model
+        cache_path: Optional path of an on-disk embedding cache to put in front of the model
+
+    Returns:
+        An embedding function that is reused for every call with the same arguments
+    """
+    key = (model_name, os.path.abspath(cache_path) if cache_path else None)
+    # Fast path without the lock once everything is loaded
+    func = _cached_functions.get(key) if cache_path else _models.get(model_name)
+    if func is not None:
+        return func
+
+    with _registry_lock:
+        model = _models.get(model_name)
+        if model is None:
+            model = SentenceTransformerEngine(model_name)
+            _models[model_name] = model
+        if not cache_path:
+            return model
+
+        func = _cached_functions.get(key)
+        if func is None:
+            cache = _caches.get(key[1])
+            if cache is None:
+                cache = EmbeddingCache(key[1])
+                _caches[key[1]] = cache
+            func = CachedEmbeddingFunction(model, model_name, cache)
+            _cached_functions[key] = func
+        return func
+
+
+def get_chroma_embedding_function(model_name: str, cache_path: Optional[str] = None) -> "EmbeddingFunction":
+    """Get the shared embedding function for a model as a Chroma EmbeddingFunction.
+
+    Wraps get_embedding_function(model_name, cache_path); this imports chromadb.
+    """
+    key = (model_name, os.path.abspath(cache_path) if cache_path else None)
+    func = _chroma_functions.get(key)
+    if func is not None:
+        return func
+
+    from chroma_embeddings import ChromaEmbeddingFunction
+
+    embedding_function = get_embedding_function(model_name, cache_path)
+    with _registry_lock:
+        func = _chroma_functions.get(key)
+        if func is None:
+            func = ChromaEmbeddingFunction(embedding_function)
+            _chroma_functions[key] = func
+        return func
+
+
+def _from_local_cache_first(load: Callable[..., Any], name: str) -> Any:
+    """Load a model or tokenizer from the local Hugging Face cache, downloading it only if it isn't there.
+
+    A cold start then never waits on the hub. This only removes the download
+    and lookup cost: loading still copies the weights into the process's own
+    tensors (see SentenceTransformerEngine for how encode workers share them).
+    """
+    try:
+        return load(name, local_files_only=True)
+    except Exception:
+        return load(name)
+
+
+def get_sentence_transformer(model_name: str) -> "SentenceTransformer":
+    """Get the shared SentenceTransformer instance for a model, loading it on first use."""
+    model = _sentence_transformers.get(model_name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        model = _sentence_transformers.get(model_name)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = _from_local_cache_first(SentenceTransformer, model_name)
+            _sentence_transformers[model_name] = model
+        return model
+
+
+def get_tokenizer(model_name: str) -> Any:
+    """Get the tokenizer of a sentence-transformers model without loading the model's weights.
+
+    Chunk worker processes only count tokens, so they load just the tokenizer
+    instead of torch and the whole model. If the model is already loaded in
+    this process, its tokenizer is reused.
+    """
+    model = _sentence_transformers.get(model_name)
+    if model is not None:
+        return model.tokenizer
+
+    if model_name not in _tokenizers:
+        with _registry_lock:
+            if model_name not in _tokenizers:
+                from transformers import AutoTokenizer
+                # sentence-transformers resolves bare names like "all-MiniLM-L6-v2" to its own hub organization
+                repo_id = model_name if "/" in model_name or os.path.isdir(model_name) else f"sentence-transformers/{model_name}"
+                try:
+                    _tokenizers[model_name] = _from_local_cache_first(AutoTokenizer.from_pretrained, repo_id)
+                except Exception:
+                    _tokenizers[model_name] = None
+    tokenizer = _tokenizers[model_name]
+    # Names that don't resolve on their own fall back to the full model's tokenizer
+    return tokenizer if tokenizer is not None else get_sentence_transformer(model_name).tokenizer
+
+
+def get_token_counter(model_name: str) -> Callable[[str], int]:
+    """Get a function that counts tokens the way the model's tokenizer does.
+
+    Args:
+        model_name: Name of the sentence-transformers model
+
+    Returns:
+        A function mapping a text to its number of tokens (without special tokens)
+    """
+    tokenizer = get_tokenizer(model_name)
+
+    def count_tokens(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False, verbose=False))
+
+    return count_tokens
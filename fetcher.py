@@ -0,0 +1,367 @@
+"""Lightweight HTTP fetching used alongside the headless browser."""
+
+import asyncio
+import hashlib
+import re
+from collections import Counter
+from contextlib import asynccontextmanager
+from html.parser import HTMLParser
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import aiohttp
+
+import metrics
+from scheduler import HostScheduler, RETRY_STATUSES, RobotsDisallowed, Slot, Throttled
+
+if TYPE_CHECKING:
+    from crawl4ai import AsyncWebCrawler
+
+USER_AGENT = "Mozilla/5.0 (compatible; WebsiteGPT/1.0)"
+
+
+def create_http_session(max_connections: int = 100, timeout: float = 30.0) -> aiohttp.ClientSession:
+    """Create a pooled HTTP session; the caller is responsible for closing it.
+
+    Args:
+        max_connections: Maximum number of pooled connections
+        timeout: Total timeout per request in seconds
+
+    Returns:
+        An aiohttp ClientSession
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=max_connections, ttl_dns_cache=300),
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        headers={"User-Agent": USER_AGENT},
+        auto_decompress=True,
+    )
+
+
+def content_hash(text: str) -> str:
+    """Hash extracted page content to detect unchanged pages."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def validators_from_headers(headers: Optional[Mapping[str, str]]) -> Dict[str, Optional[str]]:
+    """Pull the ETag and Last-Modified validators out of response headers (case-insensitively)."""
+    lowered = {k.lower(): v for k, v in (headers or {}).items()}
+    return {"etag": lowered.get("etag"), "last_modified": lowered.get("last-modified")}
+
+
+async def is_unchanged(
+    session: aiohttp.ClientSession,
+    url: str,
+    cached: Optional[Dict[str, Any]],
+    lastmod: Optional[str] = None,
+    scheduler: Optional[HostScheduler] = None,
+) -> bool:
+    """Check whether a page changed since it was cached, without rendering it.
+
+    A matching sitemap <lastmod> is trusted outright. Otherwise a conditional
+    HEAD request with If-None-Match / If-Modified-Since is sent and a 304 means
+    unchanged. Any error counts as changed, so the page is simply re-crawled.
+    With a scheduler, the HEAD waits for its slot like any other request and
+    its status feeds the host's rate limit and backoff.
+
+    Args:
+        session: Pooled HTTP session
+        url: Page URL
+        cached: The page's PageCache entry, if any
+        lastmod: The page's <lastmod> from the sitemap, if known
+        scheduler: Per-host politeness and concurrency control for the HEAD request
+
+    Returns:
+        True if the page can be skipped
+    """
+    if not cached:
+        return False
+    if lastmod and cached.get("lastmod") == lastmod:
+        return True
+
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    if not headers:
+        return False
+
+    scheduled = scheduler.slot(url) if scheduler is not None else _unscheduled()
+    try:
+        async with scheduled as slot, session.head(url, headers=headers, allow_redirects=True) as resp:
+            slot.record(resp.status, resp.headers)
+            return resp.status == 304
+    except (aiohttp.ClientError, TimeoutError, RobotsDisallowed):
+        return False
+
+
+FETCH_MODES = ("auto", "http", "browser")
+
+_PLAIN_TEXT_TYPES = ("text/plain", "text/markdown", "text/x-markdown")
+_PLAIN_TEXT_SUFFIXES = (".txt", ".md", ".markdown")
+# Removed before conversion so script and style bodies don't leak into the markdown
+_NON_CONTENT = re.compile(r'<(script|style|noscript|template|svg)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+# Empty single-page-app mount points and "please enable JavaScript" notices
+_JS_SHELL = re.compile(
+    r'<div[^>]+id=["\'](?:root|app|__next|__nuxt|svelte)["\'][^>]*>\s*</div>'
+    r'|(?:enable|requires?) javascript',
+    re.IGNORECASE,
+)
+# Statuses that usually mean bot protection rather than a missing page
+_BROWSER_STATUSES = (401, 403)
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.base: Optional[str] = None
+        self.hrefs: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a" or (tag == "base" and self.base is None):
+            href = dict(attrs).get("href")
+            if href:
+                if tag == "base":
+                    self.base = href
+                else:
+                    self.hrefs.append(href)
+
+
+def _host(url: str) -> str:
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def internal_links(html: str, base_url: str) -> List[str]:
+    """Absolute, fragment-free links of a page that stay on its host (ignoring a www. prefix)."""
+    parser = _LinkParser()
+    parser.feed(html)
+    base = urljoin(base_url, parser.base) if parser.base else base_url
+    host = _host(base_url)
+    links = set()
+    for href in parser.hrefs:
+        link = urldefrag(urljoin(base, href.strip()))[0]
+        if urlparse(link).scheme in ("http", "https") and _host(link) == host:
+            links.add(link)
+    return sorted(links)
+
+
+def html_to_markdown(html: str, base_url: str) -> Tuple[str, List[str]]:
+    """Convert an HTML page to markdown with crawl4ai's generator and collect its internal links.
+
+    Args:
+        html: Page source
+        base_url: URL the page was served from, for resolving relative links
+
+    Returns:
+        (markdown, internal links)
+    """
+    # crawl4ai (and the Playwright and LLM clients it imports) is only loaded once a page is converted
+    from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+
+    cleaned = _NON_CONTENT.sub("", html)
+    result = DefaultMarkdownGenerator().generate_markdown(cleaned, base_url=base_url, citations=False)
+    return result.raw_markdown, internal_links(cleaned, base_url)
+
+
+def needs_javascript(html: str, markdown: str) -> bool:
+    """Guess whether a page only renders its content with JavaScript.
+
+    True for pages that carry scripts but almost no text, and for app shells
+    (an empty #root/#app/#__next mount point or a "please enable JavaScript"
+    notice) without much text.
+    """
+    text_length = len(markdown.strip())
+    if text_length < 200 and re.search(r'<script\b', html, re.IGNORECASE):
+        return True
+    return text_length < 1000 and _JS_SHELL.search(html) is not None
+
+
+@asynccontextmanager
+async def _unscheduled() -> AsyncIterator[Slot]:
+    yield Slot()
+
+
+class TieredFetcher:
+    """Fetch pages over pooled HTTP, escalating to a headless browser only when needed.
+
+    In "auto" mode a page is first fetched with a plain GET and converted to
+    markdown. Plain-text and markdown files never need the browser. HTML pages
+    that look like JavaScript apps (see needs_javascript), or that the server
+    refuses with a bot-protection status, are rendered with crawl4ai instead.
+    Hosts listed in `browser_domains`, and hosts where most pages needed the
+    browser, skip the HTTP attempt. "http" and "browser" force one tier.
+
+    With a `scheduler`, every request (HTTP or browser) waits for its slot, and
+    a 429/503 answer is retried up to scheduler.max_retries times once the
+    host's backoff has passed.
+
+    The browser is only launched for the first page that needs it. Use as an
+    async context manager:
+
+        async with TieredFetcher(session) as fetcher:
+            page = await fetcher.fetch(url)
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        mode: str = "auto",
+        browser_domains: Iterable[str] = (),
+        escalate_after: int = 3,
+        max_bytes: int = 20 * 1024 * 1024,
+        scheduler: Optional[HostScheduler] = None,
+    ):
+        """Create a fetcher.
+
+        Args:
+            session: Pooled HTTP session (owned by the caller)
+            mode: "auto", "http" or "browser"
+            browser_domains: Hosts whose pages are always rendered in the browser
+            escalate_after: Once this many pages of a host needed the browser, and
+                they outnumber its plain-HTTP pages, the host goes straight to the browser
+            max_bytes: Larger HTTP responses are handed to the browser (or fail in "http" mode)
+            scheduler: Per-host politeness and concurrency control for all requests
+        """
+        if mode not in FETCH_MODES:
+            raise ValueError(f"fetch mode must be one of {FETCH_MODES}, got {mode!r}")
+        self.session = session
+        self.mode = mode
+        self.browser_domains = {_host(f"//{domain}") for domain in browser_domains}
+        self.escalate_after = escalate_after
+        self.max_bytes = max_bytes
+        self.scheduler = scheduler
+        self.stats = Counter()
+        self._host_stats: Dict[str, Counter] = {}
+        self._crawler: Optional["AsyncWebCrawler"] = None
+        self._crawler_lock = asyncio.Lock()
+        self._run_config = None
+
+    async def __aenter__(self) -> "TieredFetcher":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._crawler is not None:
+            await self._crawler.__aexit__(*exc_info)
+            self._crawler = None
+
+    def _prefers_browser(self, host: str) -> bool:
+        if self.mode != "auto":
+            return self.mode == "browser"
+        if host in self.browser_domains:
+            return True
+        counts = self._host_stats.get(host)
+        return bool(counts) and counts["browser"] >= self.escalate_after and counts["browser"] > counts["http"]
+
+    async def fetch(self, url: str) -> Dict[str, Any]:
+        """Fetch a page.
+
+        Args:
+            url: Page URL
+
+        Returns:
+            Dict with the final 'url', 'markdown', internal 'links', response
+            'headers' and 'rendered' (whether the browser was used)
+
+        Raises:
+            Throttled: If the server kept answering 429/503
+            RobotsDisallowed: If the scheduler's robots.txt check refuses the URL
+            Exception: If the page could not be fetched
+        """
+        retries = self.scheduler.max_retries if self.scheduler is not None else 0
+        for attempt in range(retries + 1):
+            try:
+                return await self._fetch(url)
+            except Throttled:
+                if attempt == retries:
+                    raise
+
+    def _slot(self, url: str):
+        return self.scheduler.slot(url) if self.scheduler is not None else _unscheduled()
+
+    async def _fetch(self, url: str) -> Dict[str, Any]:
+        host = _host(url)
+        if not self._prefers_browser(host):
+            page = await self._fetch_http(url)
+            if page is not None:
+                metrics.increment("crawl_fetches", tier="http")
+                self.stats["http"] += 1
+                self._host_stats.setdefault(host, Counter())["http"] += 1
+                return page
+            self._host_stats.setdefault(host, Counter())["browser"] += 1
+        metrics.increment("crawl_fetches", tier="browser")
+        self.stats["browser"] += 1
+        return await self._fetch_browser(url)
+
+    async def _fetch_http(self, url: str) -> Optional[Dict[str, Any]]:
+        """Fetch and convert a page over HTTP; None means the browser should render it instead."""
+        escalate = self.mode == "auto"
+        async with self._slot(url) as slot, self.session.get(url, allow_redirects=True) as resp:
+            slot.record(resp.status, resp.headers)
+            if resp.status in RETRY_STATUSES:
+                raise Throttled(url, resp.status)
+            if resp.status in _BROWSER_STATUSES and escalate:
+                return None
+            if resp.status >= 400:
+                raise Exception(f"HTTP {resp.status} for {url}")
+            if (resp.content_length or 0) > self.max_bytes:
+                if escalate:
+                    return None
+                raise Exception(f"{url} is larger than {self.max_bytes} bytes")
+            body = await resp.content.read(self.max_bytes + 1)
+            if len(body) > self.max_bytes:
+                if escalate:
+                    return None
+                raise Exception(f"{url} is larger than {self.max_bytes} bytes")
+            final_url = str(resp.url)
+            content_type = resp.content_type or ""
+            try:
+                text = body.decode(resp.charset or "utf-8", errors="replace")
+            except LookupError:
+                text = body.decode("utf-8", errors="replace")
+            headers = dict(resp.headers)
+
+        is_html = "html" in content_type
+        if content_type in _PLAIN_TEXT_TYPES or (not is_html and urlparse(final_url).path.endswith(_PLAIN_TEXT_SUFFIXES)):
+            return {"url": final_url, "markdown": text, "links": [], "headers": headers, "rendered": False}
+        if not is_html:
+            if escalate:
+                return None
+            raise Exception(f"Unsupported content type {content_type!r} for {url}")
+
+        # Conversion is CPU-bound; keep it off the event loop
+        with metrics.span("crawl.convert"):
+            markdown, links = await asyncio.to_thread(html_to_markdown, text, final_url)
+        if escalate and needs_javascript(text, markdown):
+            return None
+        return {"url": final_url, "markdown": markdown, "links": links, "headers": headers, "rendered": False}
+
+    async def _fetch_browser(self, url: str) -> Dict[str, Any]:
+        if self._crawler is None:
+            async with self._crawler_lock:
+                if self._crawler is None:
+                    from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
+                    crawler = AsyncWebCrawler(config=BrowserConfig(headless=True, verbose=False))
+                    await crawler.__aenter__()
+                    self._run_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS)
+                    self._crawler = crawler
+        async with self._slot(url) as slot:
+            metrics.add_gauge("crawl_browser_sessions", 1)
+            try:
+                result = await self._crawler.arun(url=url, config=self._run_config)
+            finally:
+                metrics.add_gauge("crawl_browser_sessions", -1)
+            status = getattr(result, "status_code", None)
+            slot.record(status, getattr(result, "response_headers", None))
+        if status in RETRY_STATUSES:
+            raise Throttled(url, status)
+        if not result.success:
+            raise Exception(result.error_message or "crawl failed")
+        return {
+            "url": result.url,
+            "markdown": result.markdown or "",
+            "links": sorted({urldefrag(link["href"])[0] for link in result.links.get("internal", [])}),
+            "headers": getattr(result, "response_headers", None) or {},
+            "rendered": True,
+        }
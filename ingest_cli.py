@@ -0,0 +1,394 @@
+"""Bulk-ingest pre-fetched content (markdown trees and WARC archives) without network access.
+
+Usage:
+    python ingest_cli.py --collection docs docs-export/ crawl-00001.warc.gz [--base-url https://docs.example.com/]
+    python ingest_cli.py --collection docs archives/*.warc.gz --chunk-workers 4 --convert-workers 4
+
+Pages run through the same chunk/embed/insert pipeline as insert_docs. The
+page cache in the ChromaDB directory doubles as the checkpoint: a page is
+recorded there once it is stored, so an interrupted run re-reads its input
+but only chunks and embeds what was not stored yet (and a later run skips
+files and records that have not changed).
+"""
+
+import argparse
+import asyncio
+import gzip
+import io
+import os
+import pathlib
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urljoin
+
+from crawl_state import PageCache
+from fetcher import content_hash, html_to_markdown
+from insert_docs import insert_docs
+
+MARKDOWN_SUFFIXES = (".md", ".markdown", ".mdx", ".txt")
+WARC_SUFFIXES = (".warc", ".warc.gz")
+# Records larger than this are skipped without being read into memory
+MAX_RECORD_BYTES = 20 * 1024 * 1024
+READ_BUFFER = 1024 * 1024
+
+
+def iter_input_files(paths: List[str]) -> Iterator[str]:
+    """Expand directories into the markdown and WARC files under them, in a stable order."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(MARKDOWN_SUFFIXES + WARC_SUFFIXES):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def iter_warc_records(path: str) -> Iterator[Tuple[Dict[str, str], Optional[bytes]]]:
+    """Read a WARC file (plain or gzip, including per-record gzip members) record by record.
+
+    Yields:
+        (WARC headers with lowercased names, content block); the block is None for
+        records other than response/resource records and for oversized ones,
+        which are skipped without being kept in memory
+    """
+    raw = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    with io.BufferedReader(raw, READ_BUFFER) as f:
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            if not line.strip():
+                continue
+            if not line.startswith(b"WARC/"):
+                raise ValueError(f"{path}: expected a WARC record, got {line[:40]!r}")
+            headers = {}
+            while (line := f.readline()).strip():
+                name, _, value = line.decode("utf-8", errors="replace").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if headers.get("warc-type") in ("response", "resource") and length <= MAX_RECORD_BYTES:
+                yield headers, f.read(length)
+            else:
+                while length > 0:
+                    length -= len(f.read(min(length, READ_BUFFER)))
+                yield headers, None
+
+
+def _dechunk(body: bytes) -> bytes:
+    out = []
+    while body:
+        size_line, _, body = body.partition(b"\r\n")
+        size = int(size_line.split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            break
+        out.append(body[:size])
+        body = body[size + 2:]
+    return b"".join(out)
+
+
+def parse_http_response(block: bytes) -> Optional[Tuple[Dict[str, str], bytes]]:
+    """Split a WARC response block into HTTP headers and the decoded body; None unless it is a 200."""
+    head, sep, body = block.partition(b"\r\n\r\n")
+    if not sep:
+        return None
+    lines = head.decode("iso-8859-1").split("\r\n")
+    status = lines[0].split()
+    if len(status) < 2 or status[1] != "200":
+        return None
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            body = _dechunk(body)
+        encoding = headers.get("content-encoding", "").lower()
+        if encoding in ("gzip", "x-gzip"):
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+        elif encoding not in ("", "identity"):
+            return None
+    except (ValueError, zlib.error):
+        return None
+    return headers, body
+
+
+def _decode(body: bytes, content_type: str) -> str:
+    charset = "utf-8"
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            charset = value.strip().strip('"') or charset
+    try:
+        return body.decode(charset, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def warc_page(headers: Dict[str, str], block: bytes) -> Optional[Tuple[str, str, bool]]:
+    """Extract (url, text, is_html) from a WARC response/resource record, or None if it holds no page."""
+    url = headers.get("warc-target-uri", "").strip("<>")
+    if not url:
+        return None
+    if headers.get("warc-type") == "response":
+        response = parse_http_response(block)
+        if response is None:
+            return None
+        http_headers, body = response
+        content_type = http_headers.get("content-type", "")
+    else:
+        body = block
+        content_type = headers.get("content-type", "")
+    mime = content_type.split(";")[0].strip().lower()
+    if mime in ("text/html", "application/xhtml+xml"):
+        return url, _decode(body, content_type), True
+    if mime in ("text/markdown", "text/x-markdown", "text/plain") or url.lower().endswith(MARKDOWN_SUFFIXES):
+        return url, _decode(body, content_type), False
+    return None
+
+
+class BulkSource:
+    """Async source of pages read from disk, for insert_docs(page_source=...).
+
+    Markdown files are read as they are; HTML from WARC records is converted
+    to markdown, across `convert_workers` processes if given. Pages whose
+    checkpoint (file size and mtime, or the record's payload digest) or
+    content hash matches the page cache are skipped. A URL captured more
+    than once (in one WARC or across several) is only ingested from its
+    first capture in the run, since every capture would produce the same
+    chunk IDs.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        checkpoint: PageCache,
+        base_url: Optional[str] = None,
+        convert_workers: int = 0,
+        force: bool = False,
+    ):
+        """Create a source.
+
+        Args:
+            paths: Markdown files, WARC files and directories containing them
+            checkpoint: Open page cache of the target collection
+            base_url: URL that markdown paths are made relative to (default: file:// URIs)
+            convert_workers: Processes converting HTML to markdown (0 converts in a thread)
+            force: Ignore the checkpoint and re-ingest everything
+        """
+        self.paths = paths
+        self.checkpoint = checkpoint
+        self.base_url = base_url
+        self.convert_workers = convert_workers
+        self.force = force
+        self.stats = {"files": 0, "records": 0, "bytes": 0, "pages": 0, "skipped": 0, "repeated": 0}
+        # URLs taken from WARC records so far in this run
+        self._warc_urls = set()
+
+    def _page_url(self, root: str, path: str) -> str:
+        if self.base_url:
+            relative = os.path.relpath(path, root) if os.path.isdir(root) else os.path.basename(path)
+            return urljoin(self.base_url.rstrip("/") + "/", quote(pathlib.PurePath(relative).as_posix()))
+        return pathlib.Path(path).resolve().as_uri()
+
+    async def _checkpointed(self, url: str, version: str) -> Tuple[bool, Optional[str]]:
+        """Whether a page is stored at this version already, and its stored content hash."""
+        cached = None if self.force else await self.checkpoint.get(url)
+        if cached is None:
+            return False, None
+        return cached["lastmod"] == version, cached["content_hash"]
+
+    def _page(self, url: str, markdown: str, version: str, cached_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+        digest = content_hash(markdown)
+        if not markdown.strip() or (digest == cached_hash and not self.force):
+            self.stats["skipped"] += 1
+            return None
+        self.stats["pages"] += 1
+        return {
+            "url": url,
+            "markdown": markdown,
+            "cache": {"url": url, "lastmod": version, "content_hash": digest, "links": []},
+        }
+
+    async def _markdown_pages(self, root: str, path: str) -> AsyncIterator[Dict[str, Any]]:
+        url = self._page_url(root, path)
+        stat = os.stat(path)
+        version = f"{stat.st_size}:{stat.st_mtime_ns}"
+        self.stats["files"] += 1
+        unchanged, cached_hash = await self._checkpointed(url, version)
+        if unchanged:
+            self.stats["skipped"] += 1
+            return
+        data = await asyncio.to_thread(pathlib.Path(path).read_bytes)
+        self.stats["bytes"] += len(data)
+        page = self._page(url, data.decode("utf-8", errors="replace"), version, cached_hash)
+        if page is not None:
+            yield page
+
+    async def _warc_pages(self, path: str, pool: Optional[ProcessPoolExecutor]) -> AsyncIterator[Dict[str, Any]]:
+        self.stats["files"] += 1
+        self.stats["bytes"] += os.path.getsize(path)
+        loop = asyncio.get_running_loop()
+        records = iter_warc_records(path)
+        in_flight = deque()
+        limit = max(1, self.convert_workers) * 2
+
+        async def convert(html, url):
+            if pool is not None:
+                markdown, _ = await loop.run_in_executor(pool, html_to_markdown, html, url)
+            else:
+                markdown, _ = await asyncio.to_thread(html_to_markdown, html, url)
+            return markdown
+
+        async def drain():
+            url, version, future, cached_hash = in_flight.popleft()
+            markdown = await future
+            return self._page(url, markdown, version, cached_hash)
+
+        while True:
+            # Reading is blocking I/O (and gunzipping); keep it off the event loop
+            record = await asyncio.to_thread(next, records, None)
+            if record is None:
+                break
+            headers, block = record
+            self.stats["records"] += 1
+            page = warc_page(headers, block) if block is not None else None
+            if page is None:
+                continue
+            url, text, is_html = page
+            if url in self._warc_urls:
+                self.stats["repeated"] += 1
+                continue
+            self._warc_urls.add(url)
+            version = headers.get("warc-payload-digest") or headers.get("warc-date") or ""
+            unchanged, cached_hash = await self._checkpointed(url, version)
+            if unchanged:
+                self.stats["skipped"] += 1
+                continue
+            if is_html:
+                converted = asyncio.ensure_future(convert(text, url))
+            else:
+                converted = loop.create_future()
+                converted.set_result(text)
+            in_flight.append((url, version, converted, cached_hash))
+            # Yield in record order while up to `limit` conversions run ahead
+            while len(in_flight) >= limit or (in_flight and in_flight[0][2].done()):
+                page = await drain()
+                if page is not None:
+                    yield page
+        while in_flight:
+            page = await drain()
+            if page is not None:
+                yield page
+
+    async def pages(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every page to ingest."""
+        pool = ProcessPoolExecutor(max_workers=self.convert_workers) if self.convert_workers > 0 else None
+        try:
+            for root in self.paths:
+                for path in iter_input_files([root]):
+                    lowered = path.lower()
+                    if lowered.endswith(WARC_SUFFIXES):
+                        async for page in self._warc_pages(path, pool):
+                            yield page
+                    elif lowered.endswith(MARKDOWN_SUFFIXES):
+                        async for page in self._markdown_pages(root, path):
+                            yield page
+                    else:
+                        print(f"skipping {path}: not a markdown or WARC file", file=sys.stderr)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    state_path = os.path.join(args.db_dir, "crawl_state.sqlite3")
+    last_report = [0.0]
+
+    def report(progress):
+        now = time.monotonic()
+        if now - last_report[0] >= args.report_every or progress["stage"] != "crawling":
+            last_report[0] = now
+            print(
+                f"[{progress['stage']}] {progress['pages']} pages read, {progress['pages_written']} stored,"
+                f" {progress['added']} chunks added",
+                file=sys.stderr
+            )
+
+    start = time.perf_counter()
+    async with PageCache(state_path, scope=args.collection) as checkpoint:
+        source = BulkSource(
+            args.paths,
+            checkpoint,
+            base_url=args.base_url,
+            convert_workers=args.convert_workers,
+            force=args.force
+        )
+        stats = await insert_docs(
+            url=args.base_url or pathlib.Path(args.paths[0]).resolve().as_uri(),
+            collection=args.collection,
+            db_dir=args.db_dir,
+            embedding_model=args.embedding_model,
+            chunk_size=args.chunk_size,
+            batch_size=args.batch_size,
+            max_tokens=args.max_tokens,
+            chunk_workers=args.chunk_workers,
+            embed_batch_size=args.embed_batch_size,
+            embed_workers=args.embed_workers,
+            dedup=not args.no_dedup,
+            compact_vectors=args.compact_vectors,
+            page_source=source.pages(),
+            progress_callback=report
+        )
+    seconds = time.perf_counter() - start
+    return {**stats, **{f"source_{k}": v for k, v in source.stats.items()}, "seconds": seconds}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Markdown files, WARC files (.warc, .warc.gz) or directories")
+    parser.add_argument("--collection", default="docs")
+    parser.add_argument("--db-dir", default="./chroma_db")
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--base-url", help="URL that markdown file paths are made relative to (default: file:// URIs)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--max-tokens", type=int, help="Limit chunks by embedding-model tokens instead of characters")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--chunk-workers", type=int, help="Chunking processes (default: half the CPUs)")
+    parser.add_argument("--convert-workers", type=int,
+                        help="HTML-to-markdown processes for WARC input (default: the CPUs left after chunking;"
+                             " 0 converts in a thread)")
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--embed-workers", type=int, default=0, help="Embedding processes (0 or 1 embeds in-process)")
+    parser.add_argument("--no-dedup", action="store_true", help="Store near-duplicate chunks separately")
+    parser.add_argument("--compact-vectors", action="store_true", help="Keep an int8 compact vector tier")
+    parser.add_argument("--force", action="store_true", help="Ignore the checkpoint and re-ingest everything")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+    # The two pools share one CPU budget rather than each taking every CPU
+    cpus = os.cpu_count() or 1
+    if args.chunk_workers is None:
+        args.chunk_workers = max(1, cpus // 2)
+    if args.convert_workers is None:
+        args.convert_workers = max(0, cpus - args.chunk_workers)
+
+    result = asyncio.run(run(args))
+    seconds = result["seconds"]
+    print(f"ingested {result['source_pages']} pages ({result['source_skipped']} unchanged or empty skipped)"
+          f" from {result['source_files']} files, {result['source_records']} WARC records,"
+          f" {result['source_bytes'] / 2**20:.1f} MiB in {seconds:.1f} s")
+    print(f"  {result['source_pages'] / seconds:.1f} pages/s, {result['added'] / seconds:.1f} chunks/s embedded,"
+          f" {result['source_bytes'] / 2**20 / seconds:.1f} MiB/s read")
+    print(f"  chunks: {result['chunk_count']} total, {result['added']} added, {result['unchanged']} unchanged,"
+          f" {result['duplicates']} near duplicates, {result['deleted']} deleted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Persistent bookkeeping for incremental ingestion into ChromaDB."""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+
+def normalize_chunk_text(text: str) -> str:
+    """Normalize chunk text so whitespace-only edits don't change its ID.
+
+    Args:
+        text: Chunk text
+
+    Returns:
+        The text with runs of whitespace collapsed and ends stripped
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def chunk_id(source_url: str, text: str) -> str:
+    """Compute a content-addressed ID for a chunk.
+
+    Args:
+        source_url: URL the chunk was taken from
+        text: Chunk text
+
+    Returns:
+        A stable hex ID derived from the URL and the normalized text
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(source_url.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_chunk_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """Per-URL record of the chunk IDs stored in each collection.
+
+    The manifest lives in a SQLite file next to the Chroma data so a re-crawl
+    can tell which chunks of a page are new, which are unchanged and which
+    are stale without reading anything back from the collection.
+
+    A chunk may be referenced by several URLs when near-duplicate detection
+    maps a page's chunk onto one already stored; the number of URLs
+    referencing a chunk acts as its reference count. Chunks a page stopped
+    referencing are recorded as garbage candidates and only deleted once no
+    URL references them (see collect_unreferenced). The manifest also keeps
+    the SimHash fingerprints of stored chunks for near-duplicate lookups.
+    """
+
+    def __init__(self, path: str):
+        """Open (or create) the manifest database.
+
+        Args:
+            path: Path of the SQLite file
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Pipeline stages call in from worker threads; access is serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " collection TEXT NOT NULL,"
+                " url TEXT NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " PRIMARY KEY (collection, url, chunk_id))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS chunks_by_id ON chunks (collection, chunk_id)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS gc_candidates ("
+                " collection TEXT NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " PRIMARY KEY (collection, chunk_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                " collection TEXT NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " simhash INTEGER NOT NULL,"
+                " owner TEXT NOT NULL,"
+                " PRIMARY KEY (collection, chunk_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprint_bands ("
+                " collection TEXT NOT NULL,"
+                " band INTEGER NOT NULL,"
+                " value INTEGER NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " PRIMARY KEY (collection, band, value, chunk_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS collection_versions ("
+                " collection TEXT PRIMARY KEY,"
+                " version INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sites ("
+                " url TEXT PRIMARY KEY,"
+                " collection TEXT NOT NULL)"
+            )
+
+    @classmethod
+    def for_db_dir(cls, db_dir: str) -> "IngestManifest":
+        """Open the manifest stored alongside a ChromaDB directory."""
+        return cls(os.path.join(db_dir, "ingest_manifest.sqlite3"))
+
+    def get_chunk_ids(self, collection: str, url: str) -> Set[str]:
+        """Return the chunk IDs currently recorded for a URL.
+
+        Args:
+            collection: Name of the collection
+            url: Source URL
+
+        Returns:
+            The set of recorded chunk IDs (empty if the URL was never ingested)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE collection = ? AND url = ?",
+                (collection, url),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def replace_chunk_ids(self, collection: str, url: str, chunk_ids: Iterable[str]) -> None:
+        """Record the full set of chunk IDs for a URL, replacing any previous entry.
+
+        Args:
+            collection: Name of the collection
+            url: Source URL
+            chunk_ids: IDs of every chunk the page now consists of
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM chunks WHERE collection = ? AND url = ?",
+                (collection, url),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks (collection, url, chunk_id) VALUES (?, ?, ?)",
+                [(collection, url, cid) for cid in chunk_ids],
+            )
+
+    def add_gc_candidates(self, collection: str, chunk_ids: Iterable[str]) -> None:
+        """Record chunks a page no longer references, for deletion once nothing else does."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO gc_candidates (collection, chunk_id) VALUES (?, ?)",
+                [(collection, cid) for cid in chunk_ids],
+            )
+
+    def collect_unreferenced(self, collection: str) -> List[str]:
+        """Return the garbage candidates that no URL references any more.
+
+        Candidates that are still referenced are dropped from the candidate
+        list. The returned IDs stay recorded until forget_chunks() is called,
+        so a crash before they are deleted from the collection loses nothing.
+
+        Args:
+            collection: Name of the collection
+
+        Returns:
+            IDs of chunks that can be deleted
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM gc_candidates WHERE collection = ? AND EXISTS ("
+                " SELECT 1 FROM chunks c WHERE c.collection = gc_candidates.collection"
+                " AND c.chunk_id = gc_candidates.chunk_id)",
+                (collection,),
+            )
+            rows = self._conn.execute(
+                "SELECT chunk_id FROM gc_candidates WHERE collection = ?",
+                (collection,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def forget_chunks(self, collection: str, chunk_ids: Sequence[str]) -> None:
+        """Drop the fingerprints and garbage-candidate entries of deleted chunks."""
+        with self._lock, self._conn:
+            for table in ("gc_candidates", "fingerprints", "fingerprint_bands"):
+                self._conn.executemany(
+                    f"DELETE FROM {table} WHERE collection = ? AND chunk_id = ?",
+                    [(collection, cid) for cid in chunk_ids],
+                )
+
+    def chunk_sources(self, collection: str, chunk_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """Return the URLs referencing each chunk; unreferenced chunks are left out.
+
+        Args:
+            collection: Name of the collection
+            chunk_ids: Chunk IDs to look up
+
+        Returns:
+            Mapping from chunk ID to its sorted source URLs
+        """
+        ids = list(chunk_ids)
+        sources: Dict[str, List[str]] = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT chunk_id, url FROM chunks WHERE collection = ? AND chunk_id IN ({placeholders})"
+                    f" ORDER BY url",
+                    [collection, *part],
+                ).fetchall()
+                for cid, url in rows:
+                    sources.setdefault(cid, []).append(url)
+        return sources
+
+    def add_fingerprints(self, collection: str, fingerprints: Sequence[Tuple[str, int, List[int], str]]) -> None:
+        """Store (chunk ID, SimHash, band values, owner URL) entries for near-duplicate lookups."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (collection, chunk_id, simhash, owner) VALUES (?, ?, ?, ?)",
+                # SQLite integers are signed 64-bit
+                [(collection, cid, fp - (1 << 64) if fp >= 1 << 63 else fp, owner) for cid, fp, _, owner in fingerprints],
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO fingerprint_bands (collection, band, value, chunk_id) VALUES (?, ?, ?, ?)",
+                [(collection, band, value, cid) for cid, _, values, _ in fingerprints for band, value in enumerate(values)],
+            )
+
+    def find_fingerprints(self, collection: str, band_values: Sequence[int]) -> List[Tuple[str, int, str]]:
+        """Return (chunk ID, SimHash, owner URL) of stored chunks sharing at least one band value."""
+        clauses = " OR ".join("(b.band = ? AND b.value = ?)" for _ in band_values)
+        params = [value for band, v in enumerate(band_values) for value in (band, v)]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT f.chunk_id, f.simhash, f.owner FROM fingerprint_bands b"
+                f" JOIN fingerprints f ON f.collection = b.collection AND f.chunk_id = b.chunk_id"
+                f" WHERE b.collection = ? AND ({clauses})",
+                [collection, *params],
+            ).fetchall()
+        return [(cid, fp + (1 << 64) if fp < 0 else fp, owner) for cid, fp, owner in rows]
+
+    def urls(self, collection: str) -> List[str]:
+        """List every URL recorded for a collection."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT url FROM chunks WHERE collection = ?",
+                (collection,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_version(self, collection: str) -> int:
+        """Return the content version of a collection (0 if it was never written).
+
+        Args:
+            collection: Name of the collection
+
+        Returns:
+            A counter that increases every time ingestion writes to the collection
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM collection_versions WHERE collection = ?",
+                (collection,),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, collection: str) -> int:
+        """Increment the content version of a collection, invalidating cached query results.
+
+        Args:
+            collection: Name of the collection
+
+        Returns:
+            The new version
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO collection_versions (collection, version) VALUES (?, 1)"
+                " ON CONFLICT(collection) DO UPDATE SET version = version + 1",
+                (collection,),
+            )
+            return self._conn.execute(
+                "SELECT version FROM collection_versions WHERE collection = ?",
+                (collection,),
+            ).fetchone()[0]
+
+    def register_site(self, collection: str, url: str) -> None:
+        """Record that a site (a crawl start URL) is ingested into a collection.
+
+        Args:
+            collection: Name of the collection
+            url: Start URL of the site
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sites (url, collection) VALUES (?, ?)"
+                " ON CONFLICT(url) DO UPDATE SET collection = excluded.collection",
+                (url, collection),
+            )
+
+    def sites(self) -> Dict[str, str]:
+        """Map every registered site URL to its collection."""
+        with self._lock:
+            rows = self._conn.execute("SELECT url, collection FROM sites ORDER BY url").fetchall()
+        return dict(rows)
+
+    def collections(self) -> List[str]:
+        """List every collection that has been written to or has a registered site."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT collection FROM collection_versions UNION SELECT collection FROM sites ORDER BY 1"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+_manifests_lock = threading.Lock()
+_manifests: Dict[str, IngestManifest] = {}
+
+
+def get_manifest(db_dir: str) -> IngestManifest:
+    """Get the process-wide manifest for a ChromaDB directory, opening it on first use."""
+    key = os.path.abspath(db_dir)
+    manifest = _manifests.get(key)
+    if manifest is not None:
+        return manifest
+
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = IngestManifest.for_db_dir(db_dir)
+            _manifests[key] = manifest
+        return manifest
@@ -1,143 +1,332 @@
-import re
 import asyncio
-from typing import List, Dict, Any
+import os
+from collections import deque
+from contextlib import AsyncExitStack
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Tuple
 from urllib.parse import urlparse, urldefrag
-from xml.etree import ElementTree
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, MemoryAdaptiveDispatcher
-import requests
-from utils import get_chroma_client, get_or_create_collection, add_documents_to_collection
-
-def smart_chunk_markdown(markdown: str, max_len: int = 1000) -> List[str]:
-    """Hierarchically splits markdown by #, ##, ### headers, then by characters, to ensure all chunks < max_len."""
-    def split_by_header(md, header_pattern):
-        indices = [m.start() for m in re.finditer(header_pattern, md, re.MULTILINE)]
-        indices.append(len(md))
-        return [md[indices[i]:indices[i+1]].strip() for i in range(len(indices)-1) if md[indices[i]:indices[i+1]].strip()]
-
-    chunks = []
-
-    for h1 in split_by_header(markdown, r'^# .+$'):
-        if len(h1) > max_len:
-            for h2 in split_by_header(h1, r'^## .+$'):
-                if len(h2) > max_len:
-                    for h3 in split_by_header(h2, r'^### .+$'):
-                        if len(h3) > max_len:
-                            for i in range(0, len(h3), max_len):
-                                chunks.append(h3[i:i+max_len].strip())
-                        else:
-                            chunks.append(h3)
-                else:
-                    chunks.append(h2)
-        else:
-            chunks.append(h1)
-
-    final_chunks = []
-
-    for c in chunks:
-        if len(c) > max_len:
-            final_chunks.extend([c[i:i+max_len].strip() for i in range(0, len(c), max_len)])
-        else:
-            final_chunks.append(c)
-
-    return [c for c in final_chunks if c]
+from utils import (
+    get_collection,
+    get_embedding_cache_path,
+    add_documents_to_collection,
+    delete_documents_from_collection,
+    update_chunk_sources
+)
+from ingest_state import get_manifest, chunk_id
+from crawl_state import CrawlFrontier, PageCache
+from fetcher import create_http_session, is_unchanged, validators_from_headers, content_hash, TieredFetcher
+from sitemap import stream_sitemap
+from scheduler import HostScheduler
+from lexical_index import get_lexical_index
+from dedup import NearDuplicateIndex, fingerprint as chunk_fingerprint, bands
+from compact_store import get_compact_store
+import metrics
+from chunking import smart_chunk_markdown, extract_section_info, chunk_page, chunk_pages
 
 def is_sitemap(url: str) -> bool:
     return url.endswith('sitemap.xml') or 'sitemap' in urlparse(url).path
 
 def is_txt(url: str) -> bool:
-    return url.endswith('.txt')
-
-async def crawl_recursive_internal_links(start_urls, max_depth=3, max_concurrent=10) -> List[Dict[str,Any]]:
-    """Recursive crawl of internal links, returning list of dicts with url and markdown."""
-    browser_config = BrowserConfig(headless=True, verbose=False)
-    run_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
-    dispatcher = MemoryAdaptiveDispatcher(
-        memory_threshold_percent=70.0,
-        check_interval=1.0,
-        max_session_permit=max_concurrent
-    )
-
-    visited = set()
-
-    def normalize_url(url):
-        return urldefrag(url)[0]
-
-    current_urls = set([normalize_url(u) for u in start_urls])
-    results_all = []
+    return url.endswith(('.txt', '.md'))
 
-    async with AsyncWebCrawler(config=browser_config) as crawler:
-        for depth in range(max_depth):
-            urls_to_crawl = [normalize_url(url) for url in current_urls if normalize_url(url) not in visited]
-            if not urls_to_crawl:
-                break
+def normalize_url(url: str) -> str:
+    return urldefrag(url)[0]
 
-            results = await crawler.arun_many(urls=urls_to_crawl, config=run_config, dispatcher=dispatcher)
-            next_level_urls = set()
-
-            for result in results:
-                norm_url = normalize_url(result.url)
-                visited.add(norm_url)
+async def stream_crawl(
+    seed_urls: List[str],
+    max_depth: int = 1,
+    max_concurrent: int = 10,
+    state_path: Optional[str] = None,
+    crawl_id: Optional[str] = None,
+    page_cache: Optional[PageCache] = None,
+    lastmods: Optional[Dict[str, str]] = None,
+    url_stream: Optional[AsyncIterator[Tuple[str, Optional[str]]]] = None,
+    fetch_mode: str = "auto",
+    browser_domains: Optional[List[str]] = None,
+    scheduler: Optional[HostScheduler] = None,
+    frontier: Optional[CrawlFrontier] = None
+) -> AsyncIterator[Dict[str,Any]]:
+    """Crawl from a SQLite-backed frontier, yielding pages as each one finishes.
+
+    URLs are pulled from the frontier as a continuous work queue: up to
+    `max_concurrent` pages are in flight at any time and, when max_depth > 1,
+    internal links found on a page are queued at depth + 1, with no barrier
+    between depths. Pages deeper than max_depth - 1 are not crawled. With a
+    `state_path`, the frontier survives a crash and rerunning the same crawl
+    (same `crawl_id`) skips pages already completed.
+
+    `url_stream` is an optional async source of extra (url, lastmod) seeds, such
+    as stream_sitemap(); its URLs are added to the frontier while they arrive,
+    so crawling starts before the source is exhausted.
+
+    Pages are fetched by a TieredFetcher: with fetch_mode="auto" a plain HTTP
+    request is tried first and the headless browser is only launched for pages
+    that need JavaScript or for hosts in `browser_domains`; "http" and
+    "browser" force one tier.
+
+    Every request goes through a HostScheduler (per-host rate limits, robots.txt,
+    backoff on 429/503 and adaptive concurrency up to max_concurrent). Pass a
+    `scheduler` to tune it; one with default settings is used otherwise.
+
+    With a `page_cache`, a page whose sitemap <lastmod> matches, or whose server
+    answers a conditional HEAD with 304, is skipped before it is fetched (its
+    cached links are still followed), and a fetched page whose content hash is
+    unchanged is not yielded. Yielded pages carry their new validators
+    under 'cache'; the caller records them with page_cache.put(**page['cache']) once the page is
+    stored, so a failed ingest never marks a page as up to date.
+
+    Pass an open `frontier` to complete pages only once they are stored: each
+    yielded page then stays in progress, and the caller calls
+    frontier.complete(page['crawl_url']) after storing it and frontier.finish()
+    after the last page, so a crash or cancellation before then crawls the
+    page again on resume. Pages that are skipped or fail are completed here.
+    Without one, a frontier at `state_path` is opened and each yielded page is
+    completed as soon as the consumer takes it.
+    """
+    seed_urls = [normalize_url(u) for u in seed_urls]
+    crawl_id = crawl_id or f"{max_depth}:{' '.join(sorted(seed_urls))}"
+    lastmods = {normalize_url(u): lastmod for u, lastmod in (lastmods or {}).items()}
 
-                if result.success and result.markdown:
-                    results_all.append({'url': result.url, 'markdown': result.markdown})
-                    for link in result.links.get("internal", []):
-                        next_url = normalize_url(link["href"])
-                        if next_url not in visited:
-                            next_level_urls.add(next_url)
+    async def fetch(url, depth, lastmod):
+        cached = None
+        try:
+            if not await scheduler.allowed(url):
+                raise Exception(f"{url} is disallowed by robots.txt")
+            if page_cache is not None:
+                cached = await page_cache.get(url)
+                if await is_unchanged(session, url, cached, lastmod, scheduler):
+                    return url, depth, lastmod, cached, None, None
+            with metrics.span("crawl.fetch"):
+                page = await fetcher.fetch(url)
+            return url, depth, lastmod, cached, page, None
+        except Exception as e:
+            return url, depth, lastmod, cached, None, str(e)
 
-            current_urls = next_level_urls
+    async def feed():
+        batch = {}
+        try:
+            async for stream_url, lastmod in url_stream:
+                batch[normalize_url(stream_url)] = lastmod
+                if len(batch) >= 256:
+                    await frontier.add(list(batch), 0, batch)
+                    batch = {}
+            if batch:
+                await frontier.add(list(batch), 0, batch)
+        finally:
+            await url_stream.aclose()
+
+    async def stop_feeder():
+        if feeder is not None:
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+
+    async def stop_fetches():
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+    in_flight = set()
+    async with AsyncExitStack() as stack:
+        owns_frontier = frontier is None
+        if owns_frontier:
+            frontier = await stack.enter_async_context(CrawlFrontier(state_path or ":memory:", crawl_id))
+        session = await stack.enter_async_context(create_http_session(max_connections=max_concurrent * 2))
+        if scheduler is None:
+            scheduler = HostScheduler(session, max_concurrent=max_concurrent)
+        elif scheduler.session is None:
+            # robots.txt is fetched over the crawl's pooled session
+            scheduler.session = session
+        fetcher = await stack.enter_async_context(
+            TieredFetcher(session, mode=fetch_mode, browser_domains=browser_domains or (), scheduler=scheduler)
+        )
+        await frontier.start(seed_urls, lastmods)
+        feeder = asyncio.create_task(feed()) if url_stream is not None else None
+        # Stopped before the frontier closes, even if the consumer abandons the crawl
+        stack.push_async_callback(stop_feeder)
+        # Fetches still running when the consumer stops early are cancelled before the fetcher closes
+        stack.push_async_callback(stop_fetches)
+
+        while True:
+            # Checked before claiming, so every URL of a finished feeder is visible to the claim
+            feeding = feeder is not None and not feeder.done()
+            # Keep the crawler saturated from the frontier
+            if len(in_flight) < max_concurrent:
+                for url, depth, lastmod in await frontier.claim(max_concurrent - len(in_flight)):
+                    in_flight.add(asyncio.create_task(fetch(url, depth, lastmod)))
+            if not in_flight:
+                if not feeding:
+                    if feeder is not None:
+                        feeder.result()
+                    break
+                await asyncio.wait([feeder], timeout=0.2)
+                continue
+
+            # While the URL source is still producing, wake up regularly to claim its new URLs
+            done, in_flight = await asyncio.wait(
+                in_flight,
+                timeout=0.2 if feeding else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                url, depth, lastmod, cached, result, error = task.result()
+                handed_on = False
+                metrics.increment("crawl_pages", result="error" if error else "unchanged" if result is None else "fetched")
+                if error is None:
+                    # Unchanged since the last crawl: nothing fetched, reuse the cached links
+                    links = cached["links"] if result is None else result["links"]
+                    if depth + 1 < max_depth:
+                        await frontier.add(links, depth + 1)
+                    if result is not None and result["markdown"]:
+                        cache_entry = {
+                            "url": url,
+                            **validators_from_headers(result["headers"]),
+                            "lastmod": lastmod,
+                            "content_hash": content_hash(result["markdown"]),
+                            "links": links,
+                        }
+                        if cached and cached["content_hash"] == cache_entry["content_hash"]:
+                            # Re-fetched but identical; just refresh the validators
+                            await page_cache.put(**cache_entry)
+                        else:
+                            yield {'url': result["url"], 'markdown': result["markdown"], 'cache': cache_entry, 'crawl_url': url}
+                            handed_on = True
+                if owns_frontier or not handed_on:
+                    await frontier.complete(url, error)
+
+        if owns_frontier:
+            await frontier.finish()
+
+async def stream_recursive_internal_links(
+    start_urls,
+    max_depth=3,
+    max_concurrent=10,
+    state_path: Optional[str] = None,
+    crawl_id: Optional[str] = None,
+    page_cache: Optional[PageCache] = None,
+    fetch_mode: str = "auto",
+    browser_domains: Optional[List[str]] = None,
+    scheduler: Optional[HostScheduler] = None,
+    frontier: Optional[CrawlFrontier] = None
+) -> AsyncIterator[Dict[str,Any]]:
+    """Recursive crawl of internal links, yielding dicts with url and markdown as each page finishes (see stream_crawl)."""
+    async for page in stream_crawl(
+        start_urls,
+        max_depth=max_depth,
+        max_concurrent=max_concurrent,
+        state_path=state_path,
+        crawl_id=crawl_id,
+        page_cache=page_cache,
+        fetch_mode=fetch_mode,
+        browser_domains=browser_domains,
+        scheduler=scheduler,
+        frontier=frontier
+    ):
+        yield page
 
-    return results_all
+async def crawl_recursive_internal_links(start_urls, max_depth=3, max_concurrent=10) -> List[Dict[str,Any]]:
+    """Recursive crawl of internal links, returning list of dicts with url and markdown."""
+    return [page async for page in stream_recursive_internal_links(start_urls, max_depth=max_depth, max_concurrent=max_concurrent)]
 
 async def crawl_markdown_file(url: str) -> List[Dict[str,Any]]:
-    """Crawl a .txt or markdown file."""
-    browser_config = BrowserConfig(headless=True)
-    crawl_config = CrawlerRunConfig()
-
-    async with AsyncWebCrawler(config=browser_config) as crawler:
-        result = await crawler.arun(url=url, config=crawl_config)
-        if result.success and result.markdown:
-            return [{'url': url, 'markdown': result.markdown}]
-        else:
-            raise Exception(f"Failed to crawl {url}: {result.error_message}")
+    """Fetch a .txt or markdown file over plain HTTP (no browser needed)."""
+    async with create_http_session() as session, TieredFetcher(session, mode="http") as fetcher:
+        try:
+            page = await fetcher.fetch(url)
+        except Exception as e:
+            raise Exception(f"Failed to crawl {url}: {e}")
+    if not page["markdown"]:
+        raise Exception(f"Failed to crawl {url}: empty file")
+    return [{'url': url, 'markdown': page["markdown"]}]
 
 def parse_sitemap(sitemap_url: str) -> List[str]:
-    resp = requests.get(sitemap_url)
-    urls = []
+    """Blocking helper returning every page URL of a sitemap, including nested sitemaps.
 
-    if resp.status_code == 200:
-        try:
-            tree = ElementTree.fromstring(resp.content)
-            urls = [loc.text for loc in tree.findall('.//{*}loc')]
-        except Exception as e:
-            raise Exception(f"Error parsing sitemap XML: {e}")
+    Async callers should iterate sitemap.stream_sitemap() instead.
+    """
+    async def collect():
+        return [url async for url, _ in stream_sitemap(sitemap_url)]
+    return asyncio.run(collect())
 
-    return urls
+async def stream_batch(
+    urls: List[str],
+    max_concurrent: int = 10,
+    state_path: Optional[str] = None,
+    crawl_id: Optional[str] = None,
+    page_cache: Optional[PageCache] = None,
+    lastmods: Optional[Dict[str, str]] = None,
+    url_stream: Optional[AsyncIterator[Tuple[str, Optional[str]]]] = None,
+    fetch_mode: str = "auto",
+    browser_domains: Optional[List[str]] = None,
+    scheduler: Optional[HostScheduler] = None,
+    frontier: Optional[CrawlFrontier] = None
+) -> AsyncIterator[Dict[str,Any]]:
+    """Batch crawl URLs in parallel, yielding each page as soon as it finishes (see stream_crawl)."""
+    async for page in stream_crawl(
+        urls,
+        max_depth=1,
+        max_concurrent=max_concurrent,
+        state_path=state_path,
+        crawl_id=crawl_id,
+        page_cache=page_cache,
+        lastmods=lastmods,
+        url_stream=url_stream,
+        fetch_mode=fetch_mode,
+        browser_domains=browser_domains,
+        scheduler=scheduler,
+        frontier=frontier
+    ):
+        yield page
 
 async def crawl_batch(urls: List[str], max_concurrent: int = 10) -> List[Dict[str,Any]]:
     """Batch crawl URLs in parallel."""
-    browser_config = BrowserConfig(headless=True, verbose=False)
-    crawl_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
-    dispatcher = MemoryAdaptiveDispatcher(
-        memory_threshold_percent=70.0,
-        check_interval=1.0,
-        max_session_permit=max_concurrent
-    )
+    return [page async for page in stream_batch(urls, max_concurrent=max_concurrent)]
 
-    async with AsyncWebCrawler(config=browser_config) as crawler:
-        results = await crawler.arun_many(urls=urls, config=crawl_config, dispatcher=dispatcher)
-        return [{'url': r.url, 'markdown': r.markdown} for r in results if r.success and r.markdown]
-
-def extract_section_info(chunk: str) -> Dict[str, Any]:
-    """Extracts headers and stats from a chunk."""
-    headers = re.findall(r'^(#+)\s+(.+)$', chunk, re.MULTILINE)
-    header_str = '; '.join([f'{h[0]} {h[1]}' for h in headers]) if headers else ''
-
-    return {
-        "headers": header_str,
-        "char_count": len(chunk),
-        "word_count": len(chunk.split())
-    }
+async def stream_pages(
+    url: str,
+    max_depth: int = 3,
+    max_concurrent: int = 10,
+    state_path: Optional[str] = None,
+    crawl_id: Optional[str] = None,
+    page_cache: Optional[PageCache] = None,
+    fetch_mode: str = "auto",
+    browser_domains: Optional[List[str]] = None,
+    scheduler: Optional[HostScheduler] = None,
+    frontier: Optional[CrawlFrontier] = None
+) -> AsyncIterator[Dict[str,Any]]:
+    """Detect the URL type and yield crawled pages as they finish."""
+    if is_txt(url):
+        for page in await crawl_markdown_file(url):
+            yield page
+    elif is_sitemap(url):
+        # Pages are crawled while the sitemap (and any nested sitemaps) are still downloading
+        async with create_http_session() as session:
+            async for page in stream_batch(
+                [],
+                max_concurrent=max_concurrent,
+                state_path=state_path,
+                crawl_id=crawl_id,
+                page_cache=page_cache,
+                url_stream=stream_sitemap(url, session=session),
+                fetch_mode=fetch_mode,
+                browser_domains=browser_domains,
+                scheduler=scheduler,
+                frontier=frontier
+            ):
+                yield page
+    else:
+        async for page in stream_recursive_internal_links(
+            [url],
+            max_depth=max_depth,
+            max_concurrent=max_concurrent,
+            state_path=state_path,
+            crawl_id=crawl_id,
+            page_cache=page_cache,
+            fetch_mode=fetch_mode,
+            browser_domains=browser_domains,
+            scheduler=scheduler,
+            frontier=frontier
+        ):
+            yield page
 
 async def insert_docs(
     url: str,
@@ -147,45 +336,399 @@ async def insert_docs(
     chunk_size: int = 1000,
     max_depth: int = 3,
     max_concurrent: int = 10,
-    batch_size: int = 100
+    batch_size: int = 100,
+    queue_size: int = 8,
+    chunk_overlap: int = 0,
+    max_tokens: Optional[int] = None,
+    chunk_workers: int = 0,
+    pages_per_task: int = 16,
+    embed_batch_size: int = 64,
+    embed_workers: int = 0,
+    fetch_mode: str = "auto",
+    browser_domains: Optional[List[str]] = None,
+    requests_per_second: float = 4.0,
+    min_concurrent: int = 1,
+    adaptive_concurrency: bool = True,
+    respect_robots: bool = True,
+    max_retries: int = 3,
+    dedup: bool = True,
+    dedup_distance: int = 3,
+    compact_vectors: bool = False,
+    page_source: Optional[AsyncIterator[Dict[str, Any]]] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
 ) -> Dict[str, Any]:
     """
     Crawl a URL, chunk the content, and insert into ChromaDB.
-    Returns a dict with the number of chunks inserted.
+
+    Crawling, chunking and embedding/insertion run as concurrent stages connected
+    by bounded queues: pages are chunked as soon as the crawler yields them and
+    batches of `batch_size` chunks are written as they fill up. When a downstream
+    stage falls behind, the queues fill and the upstream stage waits, so peak
+    memory is bounded by `queue_size` pages/batches rather than by the site size.
+
+    Chunk IDs are content-addressed (source URL + normalized text) and a per-URL
+    manifest records which IDs each page produced, so a re-crawl only embeds new
+    or changed chunks and deletes the stale ones of pages that changed. A BM25
+    index next to the Chroma data is updated with the same adds and deletes.
+
+    With `dedup`, a chunk whose SimHash is within `dedup_distance` bits (at
+    most 3) of a chunk already stored for another page, such as a repeated
+    sidebar or footer, is not stored again: the page references the existing
+    chunk, whose 'sources' metadata lists the URLs sharing it. Chunks under
+    12 words are only shared with identical text. Chunks are
+    reference-counted by the manifest and deleted at the end of the ingest once
+    no page references them.
+
+    Chunks are limited to `chunk_size` characters, or to `max_tokens` tokens of
+    the embedding model's tokenizer when given (chunk_overlap then counts tokens
+    too); a chunk never ends inside a code block. With `chunk_workers` > 0,
+    chunking and metadata extraction fan out across that many worker processes,
+    `pages_per_task` pages at a time; chunks are still inserted in crawl order.
+
+    Embedding is its own stage: vectors are computed `embed_batch_size` texts
+    per encode call (optionally across `embed_workers` processes) and passed to
+    Chroma as float32 arrays, so writing one batch overlaps embedding the next.
+
+    Recursive crawls keep their frontier in crawl_state.sqlite3 inside db_dir;
+    if an ingest dies part-way, calling insert_docs again with the same url,
+    collection and max_depth resumes the crawl instead of starting over. A page
+    only counts as done once its chunks are written, so pages that were still
+    queued or in flight are crawled again. The same file holds the page cache, which lets re-crawls skip pages that have
+    not changed (by sitemap <lastmod>, ETag/Last-Modified or content hash)
+    before they are fetched.
+
+    Pages are fetched over plain HTTP and converted to markdown; the headless
+    browser is only started for pages that need JavaScript, or for every page of
+    the hosts in `browser_domains`. fetch_mode="browser" renders every page
+    (the previous behaviour) and "http" never starts a browser.
+
+    Requests are paced per host at `requests_per_second` (or slower, if
+    robots.txt sets a Crawl-delay), URLs disallowed by robots.txt are skipped
+    unless `respect_robots` is False, and 429/503 answers back off and are
+    retried up to `max_retries` times. With `adaptive_concurrency`, the number
+    of requests in flight moves between `min_concurrent` and `max_concurrent`
+    based on error rates and response times.
+
+    With `compact_vectors`, the collection gets a compact vector tier (int8
+    codes in memory-mapped files, see compact_store.py; existing vectors are
+    copied over on first use) that answers unfiltered queries in place of
+    Chroma's in-memory HNSW index. Once a collection has a compact tier, every
+    ingest keeps it up to date.
+
+    `page_source` replaces the crawl with pages from elsewhere, such as files
+    read from disk (see ingest_cli.py): an async iterator of {'url',
+    'markdown'} dicts, optionally with a 'cache' entry that is recorded in the
+    page cache once the page is stored. `url` then only names the source.
+
+    `progress_callback`, if given, is called on the event loop with a copy of
+    the stats plus 'pages' (pages crawled so far), 'pages_written' and 'stage'
+    ('crawling', 'collecting garbage' or 'done') whenever a page is crawled or
+    a batch is written. It must be quick and must not block.
+
+    Returns a dict with the number of chunks crawled, added, deleted, unchanged
+    and folded into a near duplicate.
     """
-    # Detect URL type
-    if is_txt(url):
-        crawl_results = await crawl_markdown_file(url)
-    elif is_sitemap(url):
-        sitemap_urls = parse_sitemap(url)
-        if not sitemap_urls:
-            raise Exception("No URLs found in sitemap.")
-        crawl_results = await crawl_batch(sitemap_urls, max_concurrent=max_concurrent)
-    else:
-        crawl_results = await crawl_recursive_internal_links([url], max_depth=max_depth, max_concurrent=max_concurrent)
-
-    # Chunk and collect metadata
-    ids, documents, metadatas = [], [], []
-    chunk_idx = 0
-    for doc in crawl_results:
-        url = doc['url']
-        md = doc['markdown']
-        chunks = smart_chunk_markdown(md, max_len=chunk_size)
-        for chunk in chunks:
-            ids.append(f"chunk-{chunk_idx}")
-            documents.append(chunk)
-            meta = extract_section_info(chunk)
-            meta["chunk_index"] = chunk_idx
-            meta["source"] = url
-            metadatas.append(meta)
-            chunk_idx += 1
-
-    if not documents:
-        raise Exception("No documents found to insert.")
+    # Loads chromadb; deferred so importing this module (e.g. from the Streamlit app) stays cheap
+    from embeddings import get_embedding_function
+
+    page_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    batch_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    write_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    manifest = get_manifest(db_dir)
+    # Lets the collection registry route queries to the site's collection
+    manifest.register_site(collection, url)
+    lexical_index = get_lexical_index(db_dir)
+    stats = {"chunk_count": 0, "added": 0, "deleted": 0, "unchanged": 0, "duplicates": 0}
+    near_dups = NearDuplicateIndex(manifest, collection, dedup_distance) if dedup else None
+    progress = {"pages": 0, "pages_written": 0}
+
+    def report(stage):
+        if progress_callback is not None:
+            progress_callback({**stats, **progress, "stage": stage})
+
+    state_path = os.path.join(db_dir, "crawl_state.sqlite3")
+    page_cache = PageCache(state_path, scope=collection)
+    # Pages are completed in the frontier once stored, so a resumed crawl re-fetches everything not yet written
+    frontier = CrawlFrontier(state_path, f"{collection}:{max_depth}:{normalize_url(url)}")
+    scheduler = HostScheduler(
+        max_concurrent=max_concurrent,
+        min_concurrent=min_concurrent,
+        requests_per_second=requests_per_second,
+        respect_robots=respect_robots,
+        adaptive=adaptive_concurrency,
+        max_retries=max_retries
+    )
 
-    # Insert into ChromaDB
-    client = get_chroma_client(db_dir)
-    collection_obj = get_or_create_collection(client, collection, embedding_model_name=embedding_model)
-    add_documents_to_collection(collection_obj, ids, documents, metadatas, batch_size=batch_size)
+    def new_batch():
+        return {"ids": [], "documents": [], "metadatas": [], "fingerprints": [], "pages": []}
+
+    async def crawl_stage():
+        pages = page_source if page_source is not None else stream_pages(
+            url,
+            max_depth=max_depth,
+            max_concurrent=max_concurrent,
+            state_path=state_path,
+            crawl_id=frontier.crawl_id,
+            page_cache=page_cache,
+            fetch_mode=fetch_mode,
+            browser_domains=browser_domains,
+            scheduler=scheduler,
+            frontier=frontier
+        )
+        async for page in pages:
+            metrics.increment("ingest_pages")
+            progress["pages"] += 1
+            report("crawling")
+            await page_queue.put(page)
+        await page_queue.put(None)
+
+    def page_info(page):
+        # Everything but the markdown travels with the page's chunks
+        return {k: v for k, v in page.items() if k != 'markdown'}
+
+    chunk_args = (max_tokens or chunk_size, chunk_overlap, embedding_model if max_tokens else None)
+
+    async def chunked_pages():
+        """Yield (page info, chunks) in crawl order, chunking in a thread or across a process pool."""
+        if not chunk_workers:
+            while (page := await page_queue.get()) is not None:
+                # Chunking is CPU-bound; keep it off the event loop so the crawler keeps going
+                with metrics.span("ingest.chunk"):
+                    chunks = await asyncio.to_thread(chunk_page, page, *chunk_args)
+                yield page_info(page), chunks
+            return
+
+        loop = asyncio.get_running_loop()
+        pool = ProcessPoolExecutor(max_workers=chunk_workers)
+        in_flight = deque()
+        done = False
+        try:
+            while True:
+                # Submit more work while there is room and pages are waiting (or nothing else to do)
+                if not done and len(in_flight) < chunk_workers * 2 and (not in_flight or not page_queue.empty()):
+                    pages = [await page_queue.get()]
+                    while len(pages) < pages_per_task and not page_queue.empty():
+                        pages.append(page_queue.get_nowait())
+                    if pages[-1] is None:
+                        done = True
+                        pages.pop()
+                    if pages:
+                        future = loop.run_in_executor(pool, chunk_pages, pages, *chunk_args)
+                        in_flight.append(([page_info(p) for p in pages], future))
+                    continue
+                if not in_flight:
+                    return
+                infos, future = in_flight.popleft()
+                for info, chunks in zip(infos, await future):
+                    yield info, chunks
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def resolve_chunks(source, chunks):
+        """Assign each chunk of a page its ID: its own, or that of a stored near duplicate."""
+        known_ids = manifest.get_chunk_ids(collection, source)
+        resolved = []
+        for idx, (chunk, meta) in enumerate(chunks):
+            cid = chunk_id(source, chunk)
+            fingerprint = shared = None
+            if cid not in known_ids and near_dups is not None:
+                fingerprint = chunk_fingerprint(chunk)
+                shared = near_dups.find(chunk, fingerprint, source)
+                if shared is None:
+                    near_dups.add(cid, fingerprint, source)
+            resolved.append((idx, shared or cid, chunk, meta, fingerprint, shared is not None))
+        return known_ids, resolved
+
+    async def chunk_stage():
+        batch = new_batch()
+        chunked_sources = set()
+        async for info, chunks in chunked_pages():
+            source = info['url']
+            if source in chunked_sources:
+                # Another crawled URL redirected to the same page, which is already stored
+                # (or queued) under its final URL; only record that this URL is done
+                batch["pages"].append({
+                    "url": source,
+                    "ids": None,
+                    "stale": set(),
+                    "shared": set(),
+                    "cache": info.get('cache'),
+                    "crawl_url": info.get('crawl_url')
+                })
+                continue
+            chunked_sources.add(source)
+            with metrics.span("ingest.resolve"):
+                known_ids, resolved = await asyncio.to_thread(resolve_chunks, source, chunks)
+            page_ids = {}
+            shared_ids = set()
+            for idx, cid, chunk, meta, fingerprint, is_shared in resolved:
+                if cid in page_ids:
+                    continue
+                page_ids[cid] = None
+                stats["chunk_count"] += 1
+                if cid in known_ids:
+                    stats["unchanged"] += 1
+                    continue
+                if is_shared:
+                    # Stored once already (or queued for storage); this page just references it
+                    stats["duplicates"] += 1
+                    shared_ids.add(cid)
+                    continue
+                meta["chunk_index"] = idx
+                meta["source"] = source
+                meta["sources"] = source
+                meta["source_count"] = 1
+                batch["ids"].append(cid)
+                batch["documents"].append(chunk)
+                batch["metadatas"].append(meta)
+                if fingerprint is not None:
+                    batch["fingerprints"].append((cid, fingerprint, bands(fingerprint), source))
+                if len(batch["ids"]) >= batch_size:
+                    await batch_queue.put(batch)
+                    batch = new_batch()
+            # The page's manifest entry is committed with the batch holding its last new chunk
+            batch["pages"].append({
+                "url": source,
+                "ids": list(page_ids),
+                "stale": known_ids.difference(page_ids),
+                "shared": shared_ids,
+                "cache": info.get('cache'),
+                "crawl_url": info.get('crawl_url')
+            })
+        if batch["ids"] or batch["pages"]:
+            await batch_queue.put(batch)
+        await batch_queue.put(None)
+
+    embedding_function = get_embedding_function(embedding_model, get_embedding_cache_path(db_dir))
+
+    async def embed_stage():
+        while (batch := await batch_queue.get()) is not None:
+            if batch["documents"]:
+                with metrics.span("ingest.embed"):
+                    batch["embeddings"] = await asyncio.to_thread(
+                        embedding_function.embed,
+                        batch["documents"],
+                        batch_size=embed_batch_size,
+                        workers=embed_workers
+                    )
+            await write_queue.put(batch)
+        await write_queue.put(None)
+
+    def open_compact_store(collection_obj, dim):
+        store = get_compact_store(db_dir, collection)
+        if store is None and compact_vectors:
+            store = get_compact_store(db_dir, collection, dim=dim, embedding_model=embedding_model, create=True)
+            store.backfill(collection_obj)
+        return store
+
+    def drop_repeated_ids(batch):
+        """Keep the first row of each chunk ID; Chroma and the lexical index reject repeats within a write."""
+        keep = {}
+        for row, cid in enumerate(batch["ids"]):
+            keep.setdefault(cid, row)
+        if len(keep) == len(batch["ids"]):
+            return
+        rows = list(keep.values())
+        for key in ("ids", "documents", "metadatas"):
+            batch[key] = [batch[key][row] for row in rows]
+        batch["embeddings"] = batch["embeddings"][rows]
+        fingerprinted = set()
+        batch["fingerprints"] = [
+            entry for entry in batch["fingerprints"]
+            if entry[0] not in fingerprinted and not fingerprinted.add(entry[0])
+        ]
+
+    def write_batch(collection_obj, batch):
+        if batch["ids"]:
+            drop_repeated_ids(batch)
+            compact_store = open_compact_store(collection_obj, batch["embeddings"].shape[1])
+            add_documents_to_collection(
+                collection_obj,
+                batch["ids"],
+                batch["documents"],
+                batch["metadatas"],
+                batch_size=batch_size,
+                embeddings=batch["embeddings"]
+            )
+            lexical_index.add(collection, batch["ids"], batch["documents"])
+            if compact_store is not None:
+                compact_store.add(batch["ids"], batch["embeddings"])
+            manifest.add_fingerprints(collection, batch["fingerprints"])
+            stats["added"] += len(batch["ids"])
+        for page in batch["pages"]:
+            if page["ids"] is None:
+                continue
+            manifest.replace_chunk_ids(collection, page["url"], page["ids"])
+            # Deleted at the end of the ingest if no other page references them by then
+            manifest.add_gc_candidates(collection, page["stale"])
+        # Chunks that gained or lost a referencing page get their source list rewritten
+        touched = set().union(*(page["shared"] | page["stale"] for page in batch["pages"]))
+        updated = update_chunk_sources(collection_obj, manifest.chunk_sources(collection, touched)) if touched else 0
+        if batch["ids"] or updated:
+            # Invalidates cached query results for this collection
+            manifest.bump_version(collection)
+
+    def collect_garbage():
+        unreferenced = manifest.collect_unreferenced(collection)
+        if unreferenced:
+            collection_obj = get_collection(db_dir, collection, embedding_model)
+            delete_documents_from_collection(collection_obj, unreferenced, batch_size=batch_size)
+            lexical_index.delete(collection, unreferenced)
+            compact_store = get_compact_store(db_dir, collection)
+            if compact_store is not None:
+                compact_store.delete(unreferenced)
+            manifest.forget_chunks(collection, unreferenced)
+            manifest.bump_version(collection)
+            stats["deleted"] += len(unreferenced)
+
+    async def insert_stage():
+        collection_obj = None
+        while (batch := await write_queue.get()) is not None:
+            if collection_obj is None:
+                collection_obj = await asyncio.to_thread(get_collection, db_dir, collection, embedding_model)
+            with metrics.span("ingest.write"):
+                await asyncio.to_thread(write_batch, collection_obj, batch)
+            metrics.increment("ingest_chunks", len(batch["ids"]), status="added")
+            progress["pages_written"] += len(batch["pages"])
+            report("crawling")
+            # Only now that the pages are stored may later crawls skip them as unchanged,
+            # and may a resumed crawl treat them as done
+            for page in batch["pages"]:
+                if page["cache"]:
+                    await page_cache.put(**page["cache"])
+                if page["crawl_url"]:
+                    await frontier.complete(page["crawl_url"])
+
+    try:
+        async with page_cache, frontier:
+            tasks = [asyncio.create_task(stage()) for stage in (crawl_stage, chunk_stage, embed_stage, insert_stage)]
+            try:
+                await asyncio.gather(*tasks)
+                # Every page is stored; the next run with this crawl ID starts over
+                await frontier.finish()
+            finally:
+                # If one stage fails the others would block forever on their queues
+                for task in tasks:
+                    task.cancel()
+                # Let cancelled stages unwind before the page cache and frontier close
+                await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        if embed_workers > 1:
+            # Free the worker processes (and their model copies) once the ingest is done
+            get_embedding_function(embedding_model).close()
+
+    # Also picks up candidates left behind by an earlier ingest that died
+    report("collecting garbage")
+    with metrics.span("ingest.gc"):
+        await asyncio.to_thread(collect_garbage)
+    metrics.increment("ingest_chunks", stats["unchanged"], status="unchanged")
+    metrics.increment("ingest_chunks", stats["duplicates"], status="duplicate")
+    metrics.increment("ingest_chunks", stats["deleted"], status="deleted")
+
+    # Nothing crawled is only an error if the collection has never been ingested
+    # (a re-crawl may legitimately skip every page as unchanged)
+    if not stats["chunk_count"] and not manifest.urls(collection):
+        raise Exception("No documents found to insert.")
 
-    return {"chunk_count": len(documents)}
\ No newline at end of file
+    report("done")
+    return stats
@@ -0,0 +1,267 @@
+"""Persistent BM25 inverted index over ingested chunks."""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import snowballstemmer
+
+_TOKEN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|\d+(?:\.\d+)*')
+_CAMEL = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have if in into is it its of on or "
+    "that the their then there these this to was were will with you your".split()
+)
+
+_stemmer = snowballstemmer.stemmer("english")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into index terms.
+
+    Words are lowercased and stemmed. Identifiers such as `get_or_create_collection`
+    or `ModuleNotFoundError` are kept whole (so exact API names and error types
+    match) and are also split into their stemmed parts.
+
+    Args:
+        text: Text to tokenize
+
+    Returns:
+        The list of terms, with repetitions
+    """
+    terms = []
+    for token in _TOKEN.findall(text):
+        parts = [p for piece in token.split("_") for p in _CAMEL.findall(piece)]
+        lowered = token.lower()
+        if len(parts) > 1:
+            terms.append(lowered)
+        words = [p.lower() for p in parts] if parts else [lowered]
+        terms.extend(_stemmer.stemWords([w for w in words if w not in _STOPWORDS]))
+    return terms
+
+
+class LexicalIndex:
+    """BM25 index kept in SQLite next to the Chroma data.
+
+    Postings are updated incrementally as chunks are added and deleted, so a
+    query only reads the postings of its own terms instead of re-tokenizing
+    the corpus.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        """Open (or create) the index database.
+
+        Args:
+            path: Path of the SQLite file
+            k1: BM25 term-frequency saturation parameter
+            b: BM25 length-normalization parameter
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        # Pipeline stages and agent tool calls come in from worker threads; access is serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " collection TEXT NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " length INTEGER NOT NULL,"
+                " PRIMARY KEY (collection, chunk_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                " collection TEXT NOT NULL,"
+                " term TEXT NOT NULL,"
+                " chunk_id TEXT NOT NULL,"
+                " tf INTEGER NOT NULL,"
+                " PRIMARY KEY (collection, term, chunk_id))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS postings_chunk ON postings (collection, chunk_id)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS collection_stats ("
+                " collection TEXT PRIMARY KEY,"
+                " doc_count INTEGER NOT NULL,"
+                " total_length INTEGER NOT NULL)"
+            )
+
+    @classmethod
+    def for_db_dir(cls, db_dir: str) -> "LexicalIndex":
+        """Open the lexical index stored alongside a ChromaDB directory."""
+        return cls(os.path.join(db_dir, "lexical_index.sqlite3"))
+
+    def _delete_locked(self, collection: str, ids: Sequence[str]) -> None:
+        for start in range(0, len(ids), 500):
+            part = list(ids[start:start + 500])
+            placeholders = ",".join("?" * len(part))
+            row = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs"
+                f" WHERE collection = ? AND chunk_id IN ({placeholders})",
+                [collection, *part],
+            ).fetchone()
+            if not row[0]:
+                continue
+            self._conn.execute(
+                f"DELETE FROM postings WHERE collection = ? AND chunk_id IN ({placeholders})",
+                [collection, *part],
+            )
+            self._conn.execute(
+                f"DELETE FROM docs WHERE collection = ? AND chunk_id IN ({placeholders})",
+                [collection, *part],
+            )
+            self._conn.execute(
+                "UPDATE collection_stats SET doc_count = doc_count - ?, total_length = total_length - ?"
+                " WHERE collection = ?",
+                (row[0], row[1], collection),
+            )
+
+    def add(self, collection: str, ids: Sequence[str], documents: Sequence[str]) -> None:
+        """Index documents, replacing any existing entries with the same IDs.
+
+        Args:
+            collection: Name of the collection
+            ids: Chunk IDs
+            documents: Chunk texts, one per ID
+        """
+        tokenized = [(cid, Counter(tokenize(doc))) for cid, doc in zip(ids, documents)]
+        with self._lock, self._conn:
+            self._delete_locked(collection, list(ids))
+            self._conn.executemany(
+                "INSERT INTO docs (collection, chunk_id, length) VALUES (?, ?, ?)",
+                [(collection, cid, sum(tf.values())) for cid, tf in tokenized],
+            )
+            self._conn.executemany(
+                "INSERT INTO postings (collection, term, chunk_id, tf) VALUES (?, ?, ?, ?)",
+                [(collection, term, cid, count) for cid, tf in tokenized for term, count in tf.items()],
+            )
+            self._conn.execute(
+                "INSERT INTO collection_stats (collection, doc_count, total_length) VALUES (?, ?, ?)"
+                " ON CONFLICT(collection) DO UPDATE SET"
+                " doc_count = doc_count + excluded.doc_count,"
+                " total_length = total_length + excluded.total_length",
+                (collection, len(tokenized), sum(sum(tf.values()) for _, tf in tokenized)),
+            )
+
+    def delete(self, collection: str, ids: Sequence[str]) -> None:
+        """Remove documents from the index.
+
+        Args:
+            collection: Name of the collection
+            ids: Chunk IDs to remove
+        """
+        with self._lock, self._conn:
+            self._delete_locked(collection, list(ids))
+
+    def search(self, collection: str, query_text: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """Score documents against a query with BM25.
+
+        Args:
+            collection: Name of the collection
+            query_text: Text to search for
+            n_results: Number of results to return
+
+        Returns:
+            (chunk ID, score) pairs, best first
+        """
+        terms = list(dict.fromkeys(tokenize(query_text)))
+        if not terms:
+            return []
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_count, total_length FROM collection_stats WHERE collection = ?",
+                (collection,),
+            ).fetchone()
+            if not row or not row[0]:
+                return []
+            doc_count, avg_length = row[0], row[1] / row[0]
+            placeholders = ",".join("?" * len(terms))
+            postings = self._conn.execute(
+                f"SELECT p.term, p.chunk_id, p.tf, d.length FROM postings p"
+                f" JOIN docs d ON d.collection = p.collection AND d.chunk_id = p.chunk_id"
+                f" WHERE p.collection = ? AND p.term IN ({placeholders})",
+                [collection, *terms],
+            ).fetchall()
+
+        doc_freq = Counter(term for term, _, _, _ in postings)
+        scores: Dict[str, float] = {}
+        for term, cid, tf, length in postings:
+            df = doc_freq[term]
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+            scores[cid] = scores.get(cid, 0.0) + idf * norm
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+    def collection_scores(self, collections: Sequence[str], query_text: str) -> Dict[str, float]:
+        """Score how well each collection matches a query's terms, for routing.
+
+        Only document frequencies are read, not postings. A collection earns
+        each query term it contains, weighted by how few of the candidate
+        collections contain it and scaled up by the fraction of its documents
+        that contain the term.
+
+        Args:
+            collections: Candidate collections
+            query_text: Text to search for
+
+        Returns:
+            Score per collection; collections containing none of the terms are omitted
+        """
+        terms = list(dict.fromkeys(tokenize(query_text)))
+        if not terms or not collections:
+            return {}
+
+        with self._lock:
+            collection_marks = ",".join("?" * len(collections))
+            term_marks = ",".join("?" * len(terms))
+            doc_freqs = self._conn.execute(
+                f"SELECT collection, term, COUNT(*) FROM postings"
+                f" WHERE collection IN ({collection_marks}) AND term IN ({term_marks})"
+                f" GROUP BY collection, term",
+                [*collections, *terms],
+            ).fetchall()
+            doc_counts = dict(self._conn.execute(
+                f"SELECT collection, doc_count FROM collection_stats WHERE collection IN ({collection_marks})",
+                list(collections),
+            ).fetchall())
+
+        spread = Counter(term for _, term, _ in doc_freqs)
+        scores: Dict[str, float] = {}
+        for collection, term, df in doc_freqs:
+            weight = math.log(1 + len(collections) / spread[term])
+            scores[collection] = scores.get(collection, 0.0) + weight * (1 + df / max(1, doc_counts.get(collection, 0)))
+        return scores
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+_indexes_lock = threading.Lock()
+_indexes: Dict[str, LexicalIndex] = {}
+
+
+def get_lexical_index(db_dir: str) -> LexicalIndex:
+    """Get the process-wide lexical index for a ChromaDB directory, opening it on first use."""
+    key = os.path.abspath(db_dir)
+    index = _indexes.get(key)
+    if index is not None:
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = LexicalIndex.for_db_dir(db_dir)
+            _indexes[key] = index
+        return index
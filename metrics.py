@@ -0,0 +1,263 @@
+"""In-process spans, counters and gauges with Prometheus and JSON-lines export.
+
+Metrics are off by default and every call is then a near no-op. Turn them on
+with configure(), or by setting RAG_METRICS=1 (and optionally
+RAG_METRICS_JSONL=<path> to stream every span as a JSON line):
+
+    import metrics
+    metrics.configure(jsonl_path="metrics.jsonl")
+    with metrics.span("ingest.embed", model="all-MiniLM-L6-v2"):
+        ...
+    metrics.increment("ingest_pages")
+    print(metrics.export_prometheus())
+
+Span names become histograms named rag_<name>_seconds (dots turn into
+underscores) and counters become rag_<name>_total.
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_enabled = os.environ.get("RAG_METRICS", "").lower() in ("1", "true", "yes") or bool(os.environ.get("RAG_METRICS_JSONL"))
+_jsonl: Optional[TextIO] = None
+_started = time.time()
+_counters: Dict[_Key, float] = {}
+_gauges: Dict[_Key, float] = {}
+# Per histogram: bucket counts (one per bound, then +Inf), sum and count
+_histograms: Dict[_Key, List[float]] = {}
+
+
+def _key(name: str, labels: Dict[str, Any]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def configure(enabled: bool = True, jsonl_path: Optional[str] = None) -> None:
+    """Turn metrics collection on or off.
+
+    Args:
+        enabled: Whether to record metrics
+        jsonl_path: Optional file to append one JSON line per finished span to
+    """
+    global _enabled, _jsonl
+    with _lock:
+        if _jsonl is not None:
+            _jsonl.close()
+            _jsonl = None
+        if enabled and jsonl_path:
+            _jsonl = open(jsonl_path, "a", buffering=1, encoding="utf-8")
+        _enabled = enabled
+
+
+def is_enabled() -> bool:
+    """Whether metrics are being recorded."""
+    return _enabled
+
+
+def reset() -> None:
+    """Forget every recorded value."""
+    global _started
+    with _lock:
+        _started = time.time()
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def increment(name: str, value: float = 1, **labels: Any) -> None:
+    """Add to a counter."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    """Set a gauge to a value."""
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def add_gauge(name: str, delta: float, **labels: Any) -> None:
+    """Move a gauge up or down (e.g. +1/-1 around a resource in use)."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+
+def observe(name: str, seconds: float, **labels: Any) -> None:
+    """Record one duration in a span histogram."""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(BUCKETS)] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+        if _jsonl is not None:
+            _jsonl.write(json.dumps({"ts": time.time(), "span": name, "seconds": seconds, **labels}, default=str) + "\n")
+
+
+class _Span:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: Dict[str, Any]):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            increment(f"{self.name}.errors", **self.labels)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **labels: Any):
+    """Time a block of code; a shared no-op when metrics are off.
+
+    Args:
+        name: Span name, such as "ingest.embed"
+        **labels: Label values recorded with the span
+
+    Returns:
+        A context manager
+    """
+    return _Span(name, labels) if _enabled else _NOOP
+
+
+def _metric_name(name: str, suffix: str) -> str:
+    return "rag_" + name.replace(".", "_").replace("-", "_") + suffix
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def export_prometheus() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    lines: List[str] = []
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+
+    typed = set()
+    for (name, labels), value in counters:
+        metric = _metric_name(name, "_total")
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+    for (name, labels), value in gauges:
+        metric = _metric_name(name, "")
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+    for (name, labels), values in histograms:
+        metric = _metric_name(name, "_seconds")
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), values[:len(BUCKETS) + 1]):
+            cumulative += count
+            lines.append(f"{metric}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {values[-2]}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return counters, gauges and span summaries (count, total and mean seconds) as a dict.
+
+    'elapsed' is the time since start-up or the last reset(), so counters can be
+    turned into rates such as pages/s.
+    """
+    def label_key(name, labels):
+        return name + "".join(f"[{k}={v}]" for k, v in labels)
+
+    with _lock:
+        return {
+            "elapsed": time.time() - _started,
+            "counters": {label_key(*key): value for key, value in _counters.items()},
+            "gauges": {label_key(*key): value for key, value in _gauges.items()},
+            "spans": {
+                label_key(*key): {"count": h[-1], "seconds": h[-2], "mean": h[-2] / h[-1] if h[-1] else 0.0}
+                for key, h in _histograms.items()
+            },
+        }
+
+
+def write_snapshot(path: str) -> None:
+    """Append the current snapshot() as one JSON line to a file."""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"ts": time.time(), **snapshot()}) + "\n")
+
+
+def serve_prometheus(port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve export_prometheus() over HTTP from a daemon thread (call shutdown() on the result to stop).
+
+    Args:
+        port: Port to listen on
+        host: Interface to bind
+
+    Returns:
+        The running server
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = export_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,25 +1,42 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import TYPE_CHECKING, Hashable, List, Optional, Tuple
 import asyncio
-import chromadb
 from pydantic_ai import RunContext
 from pydantic_ai.agent import Agent
 from openai import AsyncOpenAI
+import metrics
+from answer_cache import answer_cache_key, get_answer_cache
+from collection_registry import get_collection_registry
+from rerank import DEFAULT_RERANK_MODEL, get_reranker
 from utils import (
     get_chroma_client,
-    get_or_create_collection,
-    query_collection,
+    cached_query_collection,
     format_results_as_context
 )
 
+if TYPE_CHECKING:
+    import chromadb
+
 @dataclass
 class RAGDeps:
     """Dependencies for the RAG agent."""
-    chroma_client: chromadb.PersistentClient
+    chroma_client: "chromadb.PersistentClient"
     collection_name: str
     embedding_model: str
     model_choice: str
     api_key: str
+    db_directory: str = "./chroma_db"
+    context_max_tokens: Optional[int] = 3000
+    hybrid_search: bool = True
+    # Collections (or site URLs) to search; when set, collection_name is not used for retrieval
+    collection_names: Optional[List[str]] = None
+    max_collections: int = 3
+    # Over-fetch rerank_candidates chunks and keep the cross-encoder's top n_results
+    rerank: bool = False
+    rerank_candidates: int = 20
+    rerank_model: str = DEFAULT_RERANK_MODEL
+    # Reuse the answer to a semantically equivalent question asked before (see answer_cache)
+    answer_cache: bool = True
 
 # Create the RAG agent with explicit API key handling
 agent = Agent(
@@ -33,33 +50,76 @@ agent = Agent(
 )
 
 @agent.tool
-async def retrieve(context: RunContext[RAGDeps], search_query: str, n_results: int = 5) -> str:
+async def retrieve(
+    context: RunContext[RAGDeps],
+    search_query: str,
+    n_results: int = 5,
+    site: Optional[str] = None
+) -> str:
     """Retrieve relevant documents from ChromaDB based on a search query.
     
     Args:
         context: The run context containing dependencies.
         search_query: The search query to find relevant documents.
         n_results: Number of results to return (default: 5).
+        site: Optional site URL or collection name to search; all configured
+            documentation sites are searched if omitted.
         
     Returns:
         Formatted context information from the retrieved documents.
     """
-    # Get ChromaDB client and collection
-    collection = get_or_create_collection(
-        context.deps.chroma_client,
-        context.deps.collection_name,
-        embedding_model_name=context.deps.embedding_model
-    )
-    
-    # Query the collection
-    query_results = query_collection(
-        collection,
-        search_query,
-        n_results=n_results
+    deps = context.deps
+    fetch = max(n_results, deps.rerank_candidates) if deps.rerank else n_results
+    with metrics.span("retrieve"):
+        registry = get_collection_registry(deps.db_directory, deps.embedding_model)
+        targets = [site] if site and registry.resolve([site]) else deps.collection_names
+        if targets:
+            # Route to (or fan out across) the registered sites and merge their rankings
+            query_results = await asyncio.to_thread(
+                registry.query,
+                search_query,
+                targets,
+                n_results=fetch,
+                max_collections=deps.max_collections,
+                hybrid=deps.hybrid_search
+            )
+        else:
+            # Query through the shared collection handle and the query-result cache,
+            # off the event loop so concurrent chats aren't blocked
+            query_results = await asyncio.to_thread(
+                cached_query_collection,
+                deps.db_directory,
+                deps.collection_name,
+                search_query,
+                n_results=fetch,
+                embedding_model_name=deps.embedding_model,
+                hybrid=deps.hybrid_search
+            )
+        if deps.rerank:
+            # One batched cross-encoder pass, capped by the reranker's candidate budget and time limit
+            query_results = await asyncio.to_thread(
+                get_reranker(deps.rerank_model).rerank, search_query, query_results, n_results
+            )
+        
+        # Format the results as context, within the token budget
+        return format_results_as_context(query_results, max_tokens=deps.context_max_tokens)
+
+def answer_cache_scope(deps: RAGDeps) -> Tuple[Hashable, Hashable]:
+    """Scope and content version under which answers produced with these deps are cached."""
+    if deps.collection_names:
+        registry = get_collection_registry(deps.db_directory, deps.embedding_model)
+        collections = registry.resolve(deps.collection_names) or list(deps.collection_names)
+    else:
+        collections = [deps.collection_name]
+    settings = (
+        deps.embedding_model,
+        deps.model_choice,
+        deps.hybrid_search,
+        deps.context_max_tokens,
+        deps.max_collections,
+        deps.rerank and deps.rerank_model,
     )
-    
-    # Format the results as context
-    return format_results_as_context(query_results)
+    return answer_cache_key(deps.db_directory, collections, settings)
 
 async def run_rag_agent(
     question: str,
@@ -68,7 +128,10 @@ async def run_rag_agent(
     embedding_model: str = "all-MiniLM-L6-v2",
     model_choice: str = "gpt-4.1-mini",
     api_key: str = None,
-    n_results: int = 5
+    n_results: int = 5,
+    collection_names: Optional[List[str]] = None,
+    rerank: bool = False,
+    answer_cache: bool = True
 ) -> str:
     """Run the RAG agent to answer a question about Pydantic AI.
     
@@ -80,6 +143,10 @@ async def run_rag_agent(
         model_choice: The model to use for the agent.
         api_key: The OpenAI API key.
         n_results: Number of results to return from the retrieval.
+        collection_names: Collections or site URLs to search across instead of collection_name.
+        rerank: Whether to rerank retrieved chunks with a cross-encoder.
+        answer_cache: Whether to answer from the semantic answer cache when a
+            similar question was answered from the same, unchanged collections.
         
     Returns:
         The agent's response.
@@ -93,10 +160,24 @@ async def run_rag_agent(
         collection_name=collection_name,
         embedding_model=embedding_model,
         model_choice=model_choice,
-        api_key=api_key
+        api_key=api_key,
+        db_directory=db_directory,
+        collection_names=collection_names,
+        rerank=rerank,
+        answer_cache=answer_cache
     )
     
+    if deps.answer_cache:
+        # The version is read before the run, so an answer racing an ingest is not cached as current
+        cache = get_answer_cache(db_directory, embedding_model)
+        scope, version = await asyncio.to_thread(answer_cache_scope, deps)
+        cached = await asyncio.to_thread(cache.get, scope, version, question)
+        if cached is not None:
+            return cached["answer"]
+    
     # Run the agent
     result = await agent.run(question, deps=deps, model=deps.model_choice)
     
+    if deps.answer_cache:
+        await asyncio.to_thread(cache.put, scope, version, question, result.data)
     return result.data
\ No newline at end of file
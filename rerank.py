@@ -0,0 +1,154 @@
+"""Cross-encoder reranking of retrieved chunks."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import metrics
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class Reranker:
+    """Re-orders query results by a cross-encoder's (query, chunk) relevance score.
+
+    All candidates are scored in one batched forward pass. Latency is capped
+    two ways: at most `max_candidates` candidates are scored, fewer when the
+    measured cost per pair says they would not fit in `time_limit`; and if
+    scoring still runs past `time_limit`, the results are returned in their
+    original order. While a late pass is still running, later calls skip
+    reranking rather than queue behind it.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        max_candidates: int = 20,
+        time_limit: float = 0.5,
+        max_length: int = 512,
+    ):
+        """Create a reranker; the model is loaded on first use.
+
+        Args:
+            model_name: Name of the sentence-transformers cross-encoder
+            max_candidates: Most candidates scored per query
+            time_limit: Seconds to wait for scores before giving up on reranking
+            max_length: Token limit of each (query, chunk) pair
+        """
+        self.model_name = model_name
+        self.max_candidates = max_candidates
+        self.time_limit = time_limit
+        self.max_length = max_length
+        self._model: Optional["CrossEncoder"] = None
+        self._lock = threading.Lock()
+        # One scoring pass at a time; a pass that overran its time limit finishes in the background
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._busy = threading.Lock()
+        self._pair_seconds: Optional[float] = None
+        self.stats = {"reranked": 0, "timed_out": 0, "skipped": 0}
+
+    @property
+    def model(self) -> "CrossEncoder":
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def budget(self) -> int:
+        """Number of candidates that can be scored within the time limit, by the measured cost per pair."""
+        if self._pair_seconds is None:
+            return self.max_candidates
+        return max(2, min(self.max_candidates, int(self.time_limit / self._pair_seconds)))
+
+    def _score(self, query: str, documents: List[str]) -> List[float]:
+        try:
+            start = time.perf_counter()
+            scores = self.model.predict(
+                [(query, doc) for doc in documents],
+                batch_size=len(documents),
+                show_progress_bar=False
+            )
+            per_pair = (time.perf_counter() - start) / len(documents)
+            self._pair_seconds = per_pair if self._pair_seconds is None else 0.8 * self._pair_seconds + 0.2 * per_pair
+            return [float(s) for s in scores]
+        finally:
+            self._busy.release()
+
+    def score(self, query: str, documents: List[str]) -> Optional[List[float]]:
+        """Score documents against a query within the time limit.
+
+        Returns:
+            One score per document (higher is more relevant), or None if
+            scoring was skipped or did not finish in time
+        """
+        if not documents:
+            return []
+        if not self._busy.acquire(blocking=False):
+            self.stats["skipped"] += 1
+            return None
+        # The first call also loads the model, which the time limit is not meant to cover
+        timeout = self.time_limit if self._model is not None else None
+        future = self._executor.submit(self._score, query, documents)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.stats["timed_out"] += 1
+            return None
+
+    def rerank(self, query: str, results: Dict[str, Any], n_results: int) -> Dict[str, Any]:
+        """Rerank the first query's results and keep the top n.
+
+        Args:
+            query: The query the results were retrieved for
+            results: Results in query_collection's shape, best first by retrieval score
+            n_results: Number of results to return
+
+        Returns:
+            Results in the same shape, plus 'rerank_scores' (None for candidates
+            that were not scored, which keep their order after the scored ones)
+        """
+        rows: List[Tuple[Any, ...]] = list(zip(
+            results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+        ))
+        budget = self.budget()
+        with metrics.span("query.rerank"):
+            scores = self.score(query, [doc for _, doc, _, _ in rows[:budget]])
+        if scores is None:
+            metrics.increment("rerank_fallbacks")
+            ranked = [(row, None) for row in rows]
+        else:
+            self.stats["reranked"] += 1
+            scored = sorted(zip(rows[:budget], scores), key=lambda item: item[1], reverse=True)
+            ranked = scored + [(row, None) for row in rows[budget:]]
+        ranked = ranked[:n_results]
+        return {
+            "ids": [[row[0] for row, _ in ranked]],
+            "documents": [[row[1] for row, _ in ranked]],
+            "metadatas": [[row[2] for row, _ in ranked]],
+            "distances": [[row[3] for row, _ in ranked]],
+            "rerank_scores": [[score for _, score in ranked]],
+        }
+
+
+_rerankers_lock = threading.Lock()
+_rerankers: Dict[str, Reranker] = {}
+
+
+def get_reranker(model_name: str = DEFAULT_RERANK_MODEL) -> Reranker:
+    """Get the process-wide reranker for a cross-encoder model."""
+    reranker = _rerankers.get(model_name)
+    if reranker is not None:
+        return reranker
+
+    with _rerankers_lock:
+        reranker = _rerankers.get(model_name)
+        if reranker is None:
+            reranker = Reranker(model_name)
+            _rerankers[model_name] = reranker
+        return reranker
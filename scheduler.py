@@ -0,0 +1,288 @@
+"""Per-host politeness and adaptive concurrency for the crawler."""
+
+import asyncio
+import email.utils
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Mapping, Optional
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+
+import metrics
+
+RETRY_STATUSES = (429, 503)
+
+
+class Throttled(Exception):
+    """A server answered 429 or 503; the request may be retried once the host's backoff has passed."""
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+
+
+class RobotsDisallowed(Exception):
+    """robots.txt does not allow crawling the URL."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def take(self) -> None:
+        """Wait until a token is available and consume it."""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Slot:
+    """The outcome of one scheduled request, reported by the caller via record()."""
+
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.retry_after: Optional[float] = None
+
+    def record(self, status: Optional[int], headers: Optional[Mapping[str, str]] = None) -> None:
+        """Record the response status (and Retry-After header, if any)."""
+        self.status = status
+        if headers:
+            lowered = {k.lower(): v for k, v in headers.items()}
+            self.retry_after = parse_retry_after(lowered.get("retry-after"))
+
+
+class _HostState:
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_rate = rate
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.min_latency: Optional[float] = None
+        self.robots: Optional[asyncio.Task] = None
+
+
+class HostScheduler:
+    """Decides when each request may go out.
+
+    Every host gets a token bucket of `requests_per_second` (lowered to honour
+    a robots.txt Crawl-delay), and URLs that robots.txt disallows are refused.
+    A 429 or 503 halves the host's rate and blocks it for the Retry-After
+    period, or for an exponential backoff; later successes raise the rate
+    back step by step.
+
+    Overall concurrency is adjusted AIMD-style between `min_concurrent` and
+    `max_concurrent`. Each success adds 1/limit, so the limit grows by about one
+    per round of requests. Errors (429, 5xx, network failures) halve it. A
+    response slower than `latency_factor` times the fastest one seen from its
+    host trims it by 10%. Decreases happen at most once per typical response
+    time, so a burst of failures from requests that were already in flight
+    counts as one congestion signal.
+
+    Use slot() around each request:
+
+        async with scheduler.slot(url) as slot:
+            async with session.get(url) as resp:
+                slot.record(resp.status, resp.headers)
+    """
+
+    def __init__(
+        self,
+        session: Optional[aiohttp.ClientSession] = None,
+        max_concurrent: int = 10,
+        min_concurrent: int = 1,
+        requests_per_second: float = 4.0,
+        burst: Optional[float] = None,
+        respect_robots: bool = True,
+        adaptive: bool = True,
+        max_retries: int = 3,
+        latency_factor: float = 3.0,
+        user_agent: str = "WebsiteGPT",
+    ):
+        """Create a scheduler.
+
+        Args:
+            session: HTTP session used to fetch robots.txt (robots.txt is not checked without one)
+            max_concurrent: Upper bound on requests in flight across all hosts
+            min_concurrent: Lower bound the adaptive limit never drops below
+            requests_per_second: Request rate allowed per host
+            burst: Requests a host may receive back to back (default: requests_per_second)
+            respect_robots: Whether to honour robots.txt rules and Crawl-delay
+            adaptive: Whether to adapt concurrency; if False it stays at max_concurrent
+            max_retries: How often a throttled request is retried
+            latency_factor: Slowdown relative to a host's fastest response that counts as congestion
+            user_agent: Product token matched against robots.txt User-agent lines
+        """
+        self.session = session
+        self.max_concurrent = max_concurrent
+        self.min_concurrent = max(1, min(min_concurrent, max_concurrent))
+        self.requests_per_second = requests_per_second
+        self.burst = burst if burst is not None else max(1.0, requests_per_second)
+        self.respect_robots = respect_robots
+        self.adaptive = adaptive
+        self.max_retries = max_retries
+        self.latency_factor = latency_factor
+        self.user_agent = user_agent
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "disallowed": 0}
+        self._hosts: Dict[str, _HostState] = {}
+        self._limit = float(max_concurrent)
+        self._active = 0
+        self._condition = asyncio.Condition()
+        self._latency = None
+        self._last_decrease = 0.0
+
+    @property
+    def concurrency_limit(self) -> int:
+        """The current adaptive limit on requests in flight."""
+        return int(self._limit)
+
+    def _host(self, url: str) -> _HostState:
+        host = urlparse(url).netloc.lower()
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.requests_per_second, self.burst)
+        return state
+
+    async def _load_robots(self, url: str, state: _HostState) -> Optional[RobotFileParser]:
+        parts = urlparse(url)
+        try:
+            async with self.session.get(f"{parts.scheme}://{parts.netloc}/robots.txt") as resp:
+                if resp.status != 200:
+                    # A missing or unreadable robots.txt places no restrictions
+                    return None
+                text = await resp.text(errors="replace")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+        robots = RobotFileParser()
+        robots.parse(text.splitlines())
+        delay = robots.crawl_delay(self.user_agent)
+        if delay:
+            rate = min(state.max_rate, 1.0 / float(delay))
+            state.max_rate = state.bucket.rate = rate
+            state.bucket.burst = state.bucket.tokens = 1.0
+        return robots
+
+    async def allowed(self, url: str) -> bool:
+        """Whether robots.txt allows crawling a URL (always True when robots are ignored)."""
+        if not self.respect_robots or self.session is None:
+            return True
+        state = self._host(url)
+        if state.robots is None:
+            state.robots = asyncio.create_task(self._load_robots(url, state))
+        robots = await state.robots
+        return robots is None or robots.can_fetch(self.user_agent, url)
+
+    async def _acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < int(self._limit))
+            self._active += 1
+
+    async def _release(self) -> None:
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[Slot]:
+        """Wait until a request to `url` may be sent, and learn from its outcome.
+
+        Raises:
+            RobotsDisallowed: If robots.txt disallows the URL
+        """
+        if not await self.allowed(url):
+            self.stats["disallowed"] += 1
+            raise RobotsDisallowed(f"{url} is disallowed by robots.txt")
+
+        state = self._host(url)
+        while True:
+            delay = state.blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await state.bucket.take()
+            # The host may have been blocked while we waited for the token
+            if state.blocked_until <= time.monotonic():
+                break
+
+        await self._acquire()
+        slot = Slot()
+        start = time.monotonic()
+        network_error = False
+        try:
+            yield slot
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            network_error = True
+            raise
+        finally:
+            # Observed first so waiters woken by the release see the updated limit
+            self._observe(state, slot, time.monotonic() - start, network_error)
+            await self._release()
+
+    def _observe(self, state: _HostState, slot: Slot, latency: float, network_error: bool) -> None:
+        now = time.monotonic()
+        self.stats["requests"] += 1
+        throttled = slot.status in RETRY_STATUSES
+        failed = network_error or throttled or (slot.status or 0) >= 500
+
+        if throttled:
+            self.stats["throttled"] += 1
+            state.failures += 1
+            backoff = slot.retry_after if slot.retry_after is not None else min(60.0, 2.0 ** state.failures)
+            # Jitter keeps queued requests from hitting the host again all at once
+            state.blocked_until = max(state.blocked_until, now + backoff * random.uniform(1.0, 1.25))
+            state.bucket.rate = max(state.max_rate / 16, state.bucket.rate / 2)
+        elif failed:
+            self.stats["errors"] += 1
+        else:
+            state.failures = 0
+            state.bucket.rate = min(state.max_rate, state.bucket.rate + state.max_rate / 20)
+
+        slow = False
+        if not failed:
+            state.min_latency = latency if state.min_latency is None else min(state.min_latency, latency)
+            slow = latency > self.latency_factor * state.min_latency > 0
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+
+        if throttled:
+            metrics.increment("crawl_throttled")
+        elif failed:
+            metrics.increment("crawl_errors")
+
+        if not self.adaptive:
+            return
+        if failed or slow:
+            # One decrease per typical response time, however many in-flight requests fail
+            if now - self._last_decrease >= max(0.1, self._latency or 0.0):
+                self._limit = max(float(self.min_concurrent), self._limit * (0.5 if failed else 0.9))
+                self._last_decrease = now
+        else:
+            self._limit = min(float(self.max_concurrent), self._limit + 1.0 / self._limit)
+        metrics.set_gauge("crawl_concurrency_limit", int(self._limit))
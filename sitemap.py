@@ -0,0 +1,137 @@
+"""Asynchronous, incremental sitemap reader."""
+
+import asyncio
+import logging
+import zlib
+from typing import AsyncIterator, List, Optional, Tuple
+from xml.etree.ElementTree import XMLPullParser
+
+import aiohttp
+
+from fetcher import create_http_session
+
+logger = logging.getLogger(__name__)
+
+SitemapEntry = Tuple[str, Optional[str]]  # (url, lastmod)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+async def _parse_sitemap(session: aiohttp.ClientSession, url: str) -> AsyncIterator[Tuple[str, str, Optional[str]]]:
+    """Yield ('url' | 'sitemap', loc, lastmod) entries while the document downloads.
+
+    Gzipped sitemaps (.xml.gz served without Content-Encoding) are detected by
+    their magic bytes and decompressed on the fly.
+    """
+    parser = XMLPullParser(events=("start", "end"))
+    root = None
+    decompressor = None
+    first = True
+
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        async for data in resp.content.iter_chunked(64 * 1024):
+            if first:
+                first = False
+                if data[:2] == b'\x1f\x8b':
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            parser.feed(decompressor.decompress(data) if decompressor else data)
+
+            for event, elem in parser.read_events():
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    continue
+                kind = _local_name(elem.tag)
+                if kind not in ("url", "sitemap"):
+                    continue
+                loc = lastmod = None
+                for child in elem:
+                    name = _local_name(child.tag)
+                    if name == "loc" and child.text:
+                        loc = child.text.strip()
+                    elif name == "lastmod" and child.text:
+                        lastmod = child.text.strip()
+                # Drop the parsed subtree and detach the entries from the <urlset>/<sitemapindex>
+                # root, so memory stays flat on huge sitemaps
+                elem.clear()
+                root.clear()
+                if loc:
+                    yield kind, loc, lastmod
+
+    if decompressor:
+        parser.feed(decompressor.flush())
+    parser.close()
+
+
+async def stream_sitemap(
+    sitemap_url: str,
+    session: Optional[aiohttp.ClientSession] = None,
+    max_concurrent: int = 8
+) -> AsyncIterator[SitemapEntry]:
+    """Yield (url, lastmod) entries from a sitemap as they are parsed.
+
+    Sitemap index files are followed recursively, with up to `max_concurrent`
+    nested sitemaps downloading at once. A nested sitemap that fails to load is
+    logged and skipped; a failure of the top-level sitemap raises.
+
+    Args:
+        sitemap_url: URL of a sitemap or sitemap index (optionally gzipped)
+        session: Pooled HTTP session to use (one is created if omitted)
+        max_concurrent: Maximum number of sitemaps fetched concurrently
+
+    Returns:
+        An async iterator of (page URL, lastmod or None)
+    """
+    own_session = session is None
+    session = session or create_http_session()
+    output: asyncio.Queue = asyncio.Queue(maxsize=1000)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    seen = {sitemap_url}
+    tasks: List[asyncio.Task] = []
+
+    async def process(url: str, is_root: bool):
+        try:
+            async with semaphore:
+                async for kind, loc, lastmod in _parse_sitemap(session, url):
+                    if kind == "sitemap":
+                        if loc not in seen:
+                            seen.add(loc)
+                            tasks.append(asyncio.create_task(process(loc, False)))
+                    else:
+                        await output.put((loc, lastmod))
+        except Exception as e:
+            if is_root:
+                raise Exception(f"Error reading sitemap {url}: {e}") from e
+            logger.warning("Skipping sitemap %s: %s", url, e)
+
+    async def supervise():
+        try:
+            # Children are appended while their parents run, so keep waiting until none are left
+            while pending := [task for task in tasks if not task.done()]:
+                await asyncio.wait(pending)
+            for task in tasks:
+                task.result()
+            await output.put(None)
+        except Exception as e:
+            await output.put(e)
+
+    tasks.append(asyncio.create_task(process(sitemap_url, True)))
+    supervisor = asyncio.create_task(supervise())
+    count = 0
+    try:
+        while (item := await output.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            count += 1
+            yield item
+        if not count:
+            raise Exception("No URLs found in sitemap.")
+    finally:
+        supervisor.cancel()
+        for task in tasks:
+            task.cancel()
+        if own_session:
+            await session.close()
@@ -1,12 +1,14 @@
 import streamlit as st
 import asyncio
+import dataclasses
 import platform
+import re
 
 # Set Windows Proactor event loop policy for Playwright compatibility
 if platform.system() == "Windows":
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
-from insert_docs import insert_docs
+from background_loop import get_background_loop
 
 # Lazy import message parts
 def get_message_parts():
@@ -40,24 +42,50 @@ def get_rag_agent():
     from rag_agent import agent, RAGDeps
     return agent, RAGDeps
 
+# Lazy import the collection registry
+def get_registry():
+    from collection_registry import get_collection_registry
+    return get_collection_registry("./chroma_db", "all-MiniLM-L6-v2")
+
 # Lazy import utils
 def get_utils():
-    from utils import get_chroma_client
-    return get_chroma_client
+    from utils import get_chroma_client, warm_up
+    return get_chroma_client, warm_up
 
 MODEL_CHOICE = 'gpt-4.1-mini'
 
 async def get_agent_deps(api_key):
-    get_chroma_client = get_utils()
+    get_chroma_client, _ = get_utils()
     _, RAGDeps = get_rag_agent()
     return RAGDeps(
         chroma_client=get_chroma_client("./chroma_db"),
         collection_name="docs",
         embedding_model="all-MiniLM-L6-v2",
         model_choice=MODEL_CHOICE,
-        api_key=api_key
+        api_key=api_key,
+        db_directory="./chroma_db"
     )
 
+def warm_up_collections():
+    """Load the embedding model and a handle to every registered site's collection."""
+    _, warm_up = get_utils()
+    collections = get_registry().collections()
+    for collection in collections:
+        warm_up("./chroma_db", collection, "all-MiniLM-L6-v2")
+    if not collections:
+        # Nothing ingested yet; only the model is worth loading (warm_up would create an empty collection)
+        from embeddings import get_embedding_function
+        get_embedding_function("all-MiniLM-L6-v2")(["warm up"])
+
+@st.cache_resource
+def warm_up_resources():
+    """Start loading the embedding model and collection handles once per process, shared by all sessions.
+
+    Loading runs on a worker thread, so the page renders right away and the
+    first query only waits for whatever hasn't finished loading yet.
+    """
+    return get_background_loop().submit(asyncio.to_thread(warm_up_collections))
+
 def display_message_part(part):
     """
     Display a single part of a message in the Streamlit UI.
@@ -69,22 +97,116 @@ def display_message_part(part):
         with st.chat_message("assistant"):
             st.markdown(part.content)
 
-async def run_agent_with_streaming(user_input):
+async def run_agent_with_streaming(user_input, deps, message_history, new_messages):
+    """Stream the agent's answer; runs on the background loop, so it must not touch st.session_state.
+
+    The run's new messages are appended to `new_messages` once the stream ends.
+    A question that opens a conversation is answered from the semantic answer
+    cache when a similar one was answered before; follow-ups always run the
+    agent, since their answer depends on the conversation.
+    """
+    from answer_cache import get_answer_cache
+    from rag_agent import answer_cache_scope
+
     agent, _ = get_rag_agent()
+    cache = None
+    if deps.answer_cache and not message_history:
+        cache = get_answer_cache(deps.db_directory, deps.embedding_model)
+        scope, version = await asyncio.to_thread(answer_cache_scope, deps)
+        cached = await asyncio.to_thread(cache.get, scope, version, user_input)
+        if cached is not None:
+            # Recorded first, so the history is complete even if the consumer stops reading early
+            parts = get_message_parts()
+            new_messages.extend([
+                parts["ModelRequest"](parts=[parts["UserPromptPart"](content=user_input)]),
+                parts["ModelResponse"](parts=[parts["TextPart"](content=cached["answer"])])
+            ])
+            # Streamed a few words at a time, like an answer from the model
+            words = re.findall(r"\s*\S+\s*", cached["answer"])
+            for start in range(0, len(words), 8):
+                yield "".join(words[start:start + 8])
+                await asyncio.sleep(0.02)
+            return
+
+    answer = ""
     async with agent.run_stream(
         user_input,
-        deps=st.session_state.agent_deps,
-        message_history=st.session_state.messages
+        deps=deps,
+        message_history=message_history
     ) as result:
         async for message in result.stream_text(delta=True):
+            answer += message
             yield message
 
-    # Add new messages to chat history
-    st.session_state.messages.extend(result.new_messages())
+    new_messages.extend(result.new_messages())
+    if cache is not None:
+        await asyncio.to_thread(cache.put, scope, version, user_input, answer)
+
+def start_ingest_job(website_url):
+    """Run insert_docs as a background job on the shared loop and return its job ID.
+
+    Each site is ingested into its own collection from the registry.
+    """
+    # The crawler and ingest pipeline are only loaded once a site is ingested
+    from insert_docs import insert_docs
+
+    collection = get_registry().register(website_url)
+    return get_background_loop().start_job(
+        lambda report: insert_docs(
+            url=website_url,
+            collection=collection,
+            db_dir="./chroma_db",
+            embedding_model="all-MiniLM-L6-v2",
+            chunk_size=1000,
+            max_depth=3,
+            max_concurrent=10,
+            batch_size=100,
+            progress_callback=report
+        ),
+        name=website_url
+    )
+
+@st.fragment(run_every=1.0)
+def show_ingest_progress():
+    """Poll the running ingest job; only this fragment reruns, not the chat history."""
+    job_id = st.session_state.ingest_job
+    if job_id is None:
+        return
+    job = get_background_loop().job(job_id)
+    if job is None:
+        st.session_state.ingest_job = None
+        return
+    progress = job["progress"]
+    running = job["status"] == "running"
+    if st.session_state.ingest_running and not running:
+        # Re-enable the crawl button, which lives outside this fragment
+        st.session_state.ingest_running = False
+        st.rerun()
+    st.session_state.ingest_running = running
+    if running:
+        st.info(
+            f"Crawling {job['name']}: {progress.get('pages', 0)} pages, "
+            f"{progress.get('added', 0)} chunks added ({progress.get('stage', 'starting')})"
+        )
+        if st.button("Cancel crawl"):
+            get_background_loop().cancel_job(job_id)
+    elif job["status"] == "done":
+        st.success(f"Successfully inserted {job['result']['chunk_count']} chunks from {job['name']}")
+    elif job["status"] == "failed":
+        st.error(f"Error inserting documents: {job['error']}")
+    else:
+        st.warning(f"Crawl of {job['name']} was cancelled")
 
 def main():
     st.title("ChromaDB Crawl4AI RAG AI Agent")
 
+    warm_up = warm_up_resources()
+    if warm_up.done() and warm_up.exception() is not None:
+        st.sidebar.error(f"Failed to load embedding model: {str(warm_up.exception())}")
+
+    # The agent, the Chroma client and crawl jobs live on one background event loop
+    runtime = get_background_loop()
+
     # Initialize session state
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -94,6 +216,9 @@ def main():
         st.session_state.website_url = ""
     if "agent_deps" not in st.session_state:
         st.session_state.agent_deps = None
+    if "ingest_job" not in st.session_state:
+        st.session_state.ingest_job = None
+        st.session_state.ingest_running = False
 
     # Sidebar for configuration
     st.sidebar.header("Configuration")
@@ -108,9 +233,7 @@ def main():
     if api_key and api_key != st.session_state.api_key:
         st.session_state.api_key = api_key
         try:
-            async def initialize_agent_deps():
-                st.session_state.agent_deps = await get_agent_deps(api_key)
-            asyncio.run(initialize_agent_deps())
+            st.session_state.agent_deps = runtime.run(get_agent_deps(api_key))
         except Exception as e:
             st.sidebar.error(f"Failed to initialize agent: {str(e)}")
             st.session_state.agent_deps = None
@@ -118,28 +241,29 @@ def main():
     if website_url:
         st.session_state.website_url = website_url
 
-    # Button to trigger document insertion
-    if st.sidebar.button("Crawl and Insert Documents"):
+    # Button to trigger document insertion; the crawl runs in the background while chat stays usable
+    job = runtime.job(st.session_state.ingest_job) if st.session_state.ingest_job else None
+    crawling = job is not None and job["status"] == "running"
+    if st.sidebar.button("Crawl and Insert Documents", disabled=crawling):
         if not website_url:
             st.sidebar.error("Please enter a website URL.")
         else:
-            with st.spinner("Crawling and inserting documents..."):
-                try:
-                    async def run_crawl():
-                        return await insert_docs(
-                            url=website_url,
-                            collection="docs",
-                            db_dir="./chroma_db",
-                            embedding_model="all-MiniLM-L6-v2",
-                            chunk_size=1000,
-                            max_depth=3,
-                            max_concurrent=10,
-                            batch_size=100
-                        )
-                    result = asyncio.run(run_crawl())
-                    st.sidebar.success(f"Successfully inserted {result['chunk_count']} chunks from {website_url}")
-                except Exception as e:
-                    st.sidebar.error(f"Error inserting documents: {str(e)}")
+            st.session_state.ingest_job = start_ingest_job(website_url)
+    with st.sidebar:
+        show_ingest_progress()
+
+    # Sites to answer from; retrieval fans out across them and merges the rankings
+    registry = get_registry()
+    collections = registry.collections()
+    sites = registry.sites()
+    selected = st.sidebar.multiselect(
+        "Search sites",
+        collections,
+        default=collections,
+        format_func=lambda name: ", ".join(sites.get(name, [name]))
+    )
+    rerank = st.sidebar.checkbox("Rerank results with a cross-encoder", value=False)
+    reuse_answers = st.sidebar.checkbox("Reuse answers to similar questions", value=True)
 
     # Check if API key and agent_deps are ready
     if not st.session_state.api_key:
@@ -149,6 +273,15 @@ def main():
         st.warning("Agent initialization failed. Please check your API key.")
         return
 
+    # A copy per run: the background loop may still be streaming an answer with the session's deps
+    deps = dataclasses.replace(
+        st.session_state.agent_deps,
+        # Every ingest goes to a site's own collection, so with nothing selected search them all
+        collection_names=selected or collections or None,
+        rerank=rerank,
+        answer_cache=reuse_answers
+    )
+
     # Load message parts for rendering
     message_parts = get_message_parts()
 
@@ -170,23 +303,23 @@ def main():
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
             full_response = ""
+            new_messages = []
 
-            async def run_query():
-                generator = run_agent_with_streaming(user_input)
-                async for message in generator:
-                    yield message
-
-            loop = asyncio.get_event_loop()
-            generator = run_query()
-            while True:
-                try:
-                    message = loop.run_until_complete(anext(generator))
-                    full_response += message
-                    message_placeholder.markdown(full_response + "▌")
-                except StopAsyncIteration:
-                    break
+            # Tokens arrive through a thread-safe queue from the background loop
+            tokens = runtime.stream(run_agent_with_streaming(
+                user_input,
+                deps,
+                list(st.session_state.messages),
+                new_messages
+            ))
+            for message in tokens:
+                full_response += message
+                message_placeholder.markdown(full_response + "▌")
 
             message_placeholder.markdown(full_response)
 
+        # Add new messages to chat history
+        st.session_state.messages.extend(new_messages)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
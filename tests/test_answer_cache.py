@@ -0,0 +1,113 @@
+"""AnswerCache with a stub embedding whose similarities are set by hand."""
+
+import time
+
+import numpy as np
+
+from answer_cache import AnswerCache, answer_cache_key
+from ingest_state import get_manifest
+
+DIM = 8
+
+
+def unit(*components):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[:len(components)] = components
+    return vector / np.linalg.norm(vector)
+
+
+def at_similarity(base, similarity, axis=DIM - 1):
+    """A unit vector with the given cosine similarity to `base` (which must be orthogonal to `axis`)."""
+    other = np.zeros(DIM, dtype=np.float32)
+    other[axis] = 1.0
+    return similarity * base + np.sqrt(1 - similarity ** 2) * other
+
+
+WINDOWS = unit(1.0, 0.2)
+# Roughly what a sentence embedding model gives for a rewording of the same question...
+QUESTIONS = {
+    "How do I install it on Windows?": WINDOWS,
+    "How can I install this on Windows?": at_similarity(WINDOWS, 0.97),
+    # ...and for the same question about another platform or with a negation
+    "How do I install it on macOS?": at_similarity(WINDOWS, 0.9, axis=DIM - 2),
+    "Why can't I install it on Windows?": at_similarity(WINDOWS, 0.92, axis=DIM - 3),
+}
+
+
+def stub_embed(texts):
+    return [QUESTIONS[text] for text in texts]
+
+
+def test_default_threshold_is_strict():
+    assert AnswerCache(stub_embed).threshold >= 0.95
+
+
+def test_paraphrase_hits():
+    cache = AnswerCache(stub_embed)
+    cache.put("scope", 1, "How do I install it on Windows?", "Run the installer.")
+
+    hit = cache.get("scope", 1, "How can I install this on Windows?")
+
+    assert hit is not None
+    assert hit["answer"] == "Run the installer."
+    assert hit["question"] == "How do I install it on Windows?"
+    assert cache.stats()["hits"] == 1
+
+
+def test_other_platform_and_negation_miss():
+    cache = AnswerCache(stub_embed)
+    cache.put("scope", 1, "How do I install it on Windows?", "Run the installer.")
+
+    assert cache.get("scope", 1, "How do I install it on macOS?") is None
+    assert cache.get("scope", 1, "Why can't I install it on Windows?") is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_scopes_are_separate():
+    cache = AnswerCache(stub_embed)
+    cache.put("docs", 1, "How do I install it on Windows?", "Run the installer.")
+
+    assert cache.get("other_docs", 1, "How do I install it on Windows?") is None
+
+
+def test_ingest_invalidates_answers(tmp_path):
+    db_dir = str(tmp_path)
+    cache = AnswerCache(stub_embed)
+    scope, version = answer_cache_key(db_dir, ["docs"])
+    cache.put(scope, version, "How do I install it on Windows?", "Run the installer.")
+    assert cache.get(scope, version, "How do I install it on Windows?") is not None
+
+    # What insert_docs does after writing to the collection
+    get_manifest(db_dir).bump_version("docs")
+    scope, new_version = answer_cache_key(db_dir, ["docs"])
+
+    assert new_version != version
+    assert cache.get(scope, new_version, "How do I install it on Windows?") is None
+    # An answer produced before the ingest is not cached under the new version
+    cache.put(scope, version, "How do I install it on Windows?", "Run the old installer.")
+    assert cache.get(scope, new_version, "How do I install it on Windows?") is None
+
+
+def test_answers_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = AnswerCache(stub_embed, ttl=60.0)
+    cache.put("scope", 1, "How do I install it on Windows?", "Run the installer.")
+
+    now[0] += 59.0
+    assert cache.get("scope", 1, "How do I install it on Windows?") is not None
+    now[0] += 2.0
+    assert cache.get("scope", 1, "How do I install it on Windows?") is None
+
+
+def test_full_scope_evicts_least_recently_used():
+    cache = AnswerCache(stub_embed, max_entries=2)
+    cache.put("scope", 1, "How do I install it on Windows?", "Windows")
+    cache.put("scope", 1, "How do I install it on macOS?", "macOS")
+    # Touch the Windows answer so macOS is the least recently used
+    assert cache.get("scope", 1, "How do I install it on Windows?")["answer"] == "Windows"
+    cache.put("scope", 1, "Why can't I install it on Windows?", "Permissions")
+
+    assert cache.get("scope", 1, "How do I install it on macOS?") is None
+    assert cache.get("scope", 1, "How do I install it on Windows?")["answer"] == "Windows"
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,56 @@
+"""BulkSource reading WARC archives."""
+
+import asyncio
+
+from crawl_state import PageCache
+from ingest_cli import BulkSource
+
+
+def warc_record(url: str, body: str, date: str) -> bytes:
+    block = body.encode("utf-8")
+    headers = (
+        "WARC/1.0\r\n"
+        "WARC-Type: resource\r\n"
+        f"WARC-Target-URI: {url}\r\n"
+        f"WARC-Date: {date}\r\n"
+        "Content-Type: text/markdown\r\n"
+        f"Content-Length: {len(block)}\r\n"
+        "\r\n"
+    )
+    return headers.encode("utf-8") + block + b"\r\n\r\n"
+
+
+def read_pages(paths, state_path):
+    async def main():
+        async with PageCache(state_path, scope="docs") as checkpoint:
+            source = BulkSource(paths, checkpoint)
+            return [page async for page in source.pages()], source.stats
+
+    return asyncio.run(main())
+
+
+def test_repeated_captures_of_a_url_are_ingested_once(tmp_path):
+    archive = tmp_path / "crawl.warc"
+    archive.write_bytes(
+        warc_record("https://docs.example.com/install", "# Install\n\nFirst capture.", "2024-01-01T00:00:00Z")
+        + warc_record("https://docs.example.com/install", "# Install\n\nSecond capture.", "2024-02-01T00:00:00Z")
+        + warc_record("https://docs.example.com/usage", "# Usage\n\nRun it.", "2024-01-01T00:00:00Z")
+    )
+
+    pages, stats = read_pages([str(archive)], str(tmp_path / "state.sqlite3"))
+
+    assert [page["url"] for page in pages] == ["https://docs.example.com/install", "https://docs.example.com/usage"]
+    assert "First capture." in pages[0]["markdown"]
+    assert stats["records"] == 3
+    assert stats["repeated"] == 1
+
+
+def test_repeated_captures_across_archives(tmp_path):
+    first, second = tmp_path / "a.warc", tmp_path / "b.warc"
+    first.write_bytes(warc_record("https://docs.example.com/install", "# Install\n\nOld.", "2024-01-01T00:00:00Z"))
+    second.write_bytes(warc_record("https://docs.example.com/install", "# Install\n\nNew.", "2024-02-01T00:00:00Z"))
+
+    pages, stats = read_pages([str(first), str(second)], str(tmp_path / "state.sqlite3"))
+
+    assert len(pages) == 1
+    assert stats["repeated"] == 1
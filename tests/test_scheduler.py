@@ -0,0 +1,174 @@
+"""HostScheduler against a local aiohttp server: backoff, robots.txt and adaptive concurrency."""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from scheduler import HostScheduler, RobotsDisallowed
+
+ROBOTS_TXT = "User-agent: *\nDisallow: /private\n"
+
+
+@asynccontextmanager
+async def serve(**scheduler_args):
+    """Start a test server and yield (scheduler, session, url) for it.
+
+    /status/<code> answers with that status; ?retry_after=<seconds> adds a
+    Retry-After header.
+    """
+    async def status(request):
+        headers = {}
+        if "retry_after" in request.query:
+            headers["Retry-After"] = request.query["retry_after"]
+        return web.Response(status=int(request.match_info["code"]), headers=headers)
+
+    async def robots(request):
+        return web.Response(text=ROBOTS_TXT)
+
+    async def page(request):
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_get("/robots.txt", robots)
+    app.router.add_get("/status/{code}", status)
+    app.router.add_get("/{path:.*}", page)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        async with aiohttp.ClientSession() as session:
+            scheduler = HostScheduler(session, **{"requests_per_second": 1000.0, **scheduler_args})
+            yield scheduler, session, lambda path: str(server.make_url(path))
+    finally:
+        await server.close()
+
+
+async def request(scheduler, session, url):
+    async with scheduler.slot(url) as slot:
+        async with session.get(url) as resp:
+            slot.record(resp.status, resp.headers)
+            return resp.status
+
+
+def test_retry_after_blocks_the_host():
+    async def main():
+        async with serve() as (scheduler, session, url):
+            assert await request(scheduler, session, url("/status/503?retry_after=0.5")) == 503
+            start = time.monotonic()
+            assert await request(scheduler, session, url("/page")) == 200
+            return time.monotonic() - start, scheduler.stats
+
+    waited, stats = asyncio.run(main())
+    # Retry-After times a jitter of 1 to 1.25
+    assert 0.5 <= waited < 1.0
+    assert stats["throttled"] == 1
+
+
+def test_429_backs_off_exponentially_and_halves_the_rate():
+    async def main():
+        async with serve(requests_per_second=8.0) as (scheduler, session, url):
+            target = url("/status/429")
+            state = scheduler._host(target)
+            await request(scheduler, session, target)
+            first = state.blocked_until - time.monotonic()
+            rate = state.bucket.rate
+            # Skip the wait instead of sleeping through the backoff
+            state.blocked_until = 0.0
+            await request(scheduler, session, target)
+            second = state.blocked_until - time.monotonic()
+            return first, second, rate, state.bucket.rate
+
+    first, second, rate_after_one, rate_after_two = asyncio.run(main())
+    assert 1.9 <= first <= 2.5
+    assert 3.9 <= second <= 5.0
+    assert rate_after_one == pytest.approx(4.0)
+    assert rate_after_two == pytest.approx(2.0)
+
+
+def test_success_after_throttling_restores_the_rate():
+    async def main():
+        async with serve(requests_per_second=8.0) as (scheduler, session, url):
+            state = scheduler._host(url("/"))
+            await request(scheduler, session, url("/status/429?retry_after=0"))
+            throttled = state.bucket.rate
+            for _ in range(20):
+                await request(scheduler, session, url("/page"))
+            return throttled, state.bucket.rate, state.failures
+
+    throttled, recovered, failures = asyncio.run(main())
+    assert throttled == pytest.approx(4.0)
+    assert recovered == pytest.approx(8.0)
+    assert failures == 0
+
+
+def test_robots_txt_disallow():
+    async def main():
+        async with serve() as (scheduler, session, url):
+            assert await scheduler.allowed(url("/public/page"))
+            assert not await scheduler.allowed(url("/private/page"))
+            with pytest.raises(RobotsDisallowed):
+                await request(scheduler, session, url("/private/page"))
+            assert await request(scheduler, session, url("/public/page")) == 200
+            return scheduler.stats
+
+    stats = asyncio.run(main())
+    assert stats["disallowed"] == 1
+    assert stats["requests"] == 1
+
+
+def test_robots_txt_ignored_when_not_respected():
+    async def main():
+        async with serve(respect_robots=False) as (scheduler, session, url):
+            return await request(scheduler, session, url("/private/page"))
+
+    assert asyncio.run(main()) == 200
+
+
+def test_concurrency_shrinks_on_errors_and_recovers():
+    async def main():
+        async with serve(max_concurrent=8, min_concurrent=2, latency_factor=100.0) as (scheduler, session, url):
+            limits = [scheduler.concurrency_limit]
+            await request(scheduler, session, url("/status/500"))
+            limits.append(scheduler.concurrency_limit)
+            # A failure right after a decrease counts as the same congestion signal
+            await request(scheduler, session, url("/status/500"))
+            limits.append(scheduler.concurrency_limit)
+            for _ in range(3):
+                await asyncio.sleep(0.11)
+                await request(scheduler, session, url("/status/500"))
+            limits.append(scheduler.concurrency_limit)
+            for _ in range(40):
+                await request(scheduler, session, url("/page"))
+            limits.append(scheduler.concurrency_limit)
+            return limits
+
+    initial, halved, same, floored, recovered = asyncio.run(main())
+    assert initial == 8
+    assert halved == 4
+    assert same == 4
+    assert floored == 2
+    assert recovered == 8
+
+
+def test_concurrency_limit_bounds_requests_in_flight():
+    async def main():
+        async with serve(max_concurrent=3, adaptive=False) as (scheduler, session, url):
+            active = peak = 0
+
+            async def one(i):
+                nonlocal active, peak
+                async with scheduler.slot(url(f"/page/{i}")) as slot:
+                    active += 1
+                    peak = max(peak, active)
+                    await asyncio.sleep(0.02)
+                    slot.record(200)
+                    active -= 1
+
+            await asyncio.gather(*(one(i) for i in range(12)))
+            return peak
+
+    assert asyncio.run(main()) == 3
@@ -1,36 +1,82 @@
 """Utility functions for text processing and ChromaDB operations."""
 
+import json
 import os
 import pathlib
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Optional, Sequence, Tuple
 
-import chromadb
-from chromadb.utils import embedding_functions
 from more_itertools import batched
 
+import metrics
+from ingest_state import get_manifest
 
-def get_chroma_client(persist_directory: str) -> chromadb.PersistentClient:
+if TYPE_CHECKING:
+    import chromadb
+    import numpy as np
+
+    from compact_store import CompactVectorStore
+    from lexical_index import LexicalIndex
+
+# Memory budget for loaded collection indexes; 0 keeps every index loaded once used
+CHROMA_MEMORY_LIMIT_BYTES = int(float(os.environ.get("RAG_CHROMA_MEMORY_LIMIT_MB", "0")) * 1024 * 1024)
+
+
+def get_chroma_client(persist_directory: str) -> "chromadb.PersistentClient":
     """Get a ChromaDB client with the specified persistence directory.
     
+    Chroma loads a collection's HNSW index on its first query. When
+    RAG_CHROMA_MEMORY_LIMIT_MB is set, the client uses Chroma's LRU segment
+    cache, so the most recently queried indexes stay loaded and the least
+    recently used ones are unloaded once the budget is exceeded.
+    
     Args:
         persist_directory: Directory where ChromaDB will store its data
         
     Returns:
         A ChromaDB PersistentClient
     """
+    # chromadb is imported on first use so importing this module stays cheap
+    import chromadb
+    from chromadb.config import Settings
+
     # Create the directory if it doesn't exist
     os.makedirs(persist_directory, exist_ok=True)
     
     # Return the client
+    if CHROMA_MEMORY_LIMIT_BYTES:
+        settings = Settings(
+            chroma_segment_cache_policy="LRU",
+            chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_BYTES
+        )
+        return chromadb.PersistentClient(persist_directory, settings=settings)
     return chromadb.PersistentClient(persist_directory)
 
 
+def list_collection_names(persist_directory: str) -> List[str]:
+    """List the collections stored in a ChromaDB directory (none if it holds no database yet)."""
+    if not os.path.exists(os.path.join(persist_directory, "chroma.sqlite3")):
+        return []
+    collections = get_chroma_client(persist_directory).list_collections()
+    # Chroma >= 0.6 returns names, older versions Collection objects
+    return [getattr(collection, "name", collection) for collection in collections]
+
+
+def get_embedding_cache_path(persist_directory: str) -> str:
+    """Get the path of the embedding cache stored alongside a ChromaDB directory."""
+    return os.path.join(persist_directory, "embedding_cache.sqlite3")
+
+
 def get_or_create_collection(
-    client: chromadb.PersistentClient,
+    client: "chromadb.PersistentClient",
     collection_name: str,
     embedding_model_name: str = "all-MiniLM-L6-v2",
     distance_function: str = "cosine",
-) -> chromadb.Collection:
+    embedding_cache_path: Optional[str] = None,
+) -> "chromadb.Collection":
     """Get an existing collection or create a new one if it doesn't exist.
     
     Args:
@@ -38,14 +84,16 @@ def get_or_create_collection(
         collection_name: Name of the collection
         embedding_model_name: Name of the embedding model to use
         distance_function: Distance function to use for similarity search
+        embedding_cache_path: Optional path of an on-disk embedding cache; when
+            given, texts that were embedded before are served from the cache
         
     Returns:
         A ChromaDB Collection
     """
-    # Create embedding function
-    embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=embedding_model_name
-    )
+    from embeddings import get_chroma_embedding_function
+
+    # Get the shared embedding function (the model is only loaded once per process)
+    embedding_func = get_chroma_embedding_function(embedding_model_name, embedding_cache_path)
     
     # Try to get the collection, create it if it doesn't exist
     try:
@@ -61,14 +109,83 @@ def get_or_create_collection(
         )
 
 
+_handles_lock = threading.Lock()
+_collection_handles: Dict[Tuple[str, str, str], "chromadb.Collection"] = {}
+
+
+def get_collection(
+    persist_directory: str,
+    collection_name: str,
+    embedding_model_name: str = "all-MiniLM-L6-v2",
+) -> "chromadb.Collection":
+    """Get the process-wide collection handle for (directory, collection, model).
+    
+    The first call creates the client, loads the embedding model and opens (or
+    creates) the collection; later calls return the same handle, so tool calls
+    and Streamlit reruns don't reload the model.
+    
+    Args:
+        persist_directory: Directory where ChromaDB stores its data
+        collection_name: Name of the collection
+        embedding_model_name: Name of the embedding model to use
+        
+    Returns:
+        A shared ChromaDB Collection
+    """
+    key = (os.path.abspath(persist_directory), collection_name, embedding_model_name)
+    handle = _collection_handles.get(key)
+    if handle is not None:
+        return handle
+    
+    with _handles_lock:
+        handle = _collection_handles.get(key)
+        if handle is None:
+            handle = get_or_create_collection(
+                get_chroma_client(persist_directory),
+                collection_name,
+                embedding_model_name=embedding_model_name,
+                embedding_cache_path=get_embedding_cache_path(persist_directory)
+            )
+            _collection_handles[key] = handle
+        return handle
+
+
+def warm_up(
+    persist_directory: str,
+    collection_name: str,
+    embedding_model_name: str = "all-MiniLM-L6-v2",
+) -> "chromadb.Collection":
+    """Eagerly load the collection handle and run one embedding so the first query is fast.
+    
+    Args:
+        persist_directory: Directory where ChromaDB stores its data
+        collection_name: Name of the collection
+        embedding_model_name: Name of the embedding model to use
+        
+    Returns:
+        The shared ChromaDB Collection
+    """
+    from embeddings import get_embedding_function
+
+    collection = get_collection(persist_directory, collection_name, embedding_model_name)
+    # Bypass the cache so the model itself runs once
+    get_embedding_function(embedding_model_name)(["warm up"])
+    return collection
+
+
 def add_documents_to_collection(
-    collection: chromadb.Collection,
+    collection: "chromadb.Collection",
     ids: List[str],
     documents: List[str],
     metadatas: Optional[List[Dict[str, Any]]] = None,
     batch_size: int = 100,
+    embeddings: Optional["np.ndarray"] = None,
 ) -> None:
     """Add documents to a ChromaDB collection in batches.
+
+    Documents are upserted, so re-adding an existing ID overwrites it in place.
+    When `embeddings` are given, Chroma stores them as-is instead of embedding
+    the documents itself.
     
     Args:
         collection: ChromaDB collection
@@ -76,6 +193,7 @@ def add_documents_to_collection(
         documents: List of document texts
         metadatas: Optional list of metadata dictionaries for each document
         batch_size: Size of batches for adding documents
+        embeddings: Optional float32 array with one precomputed vector per document
     """
     # Create default metadata if none provided
     if metadatas is None:
@@ -90,19 +208,79 @@ def add_documents_to_collection(
         start_idx = batch[0]
         end_idx = batch[-1] + 1  # +1 because end_idx is exclusive
         
-        # Add the batch to the collection
-        collection.add(
+        # Upsert the batch into the collection
+        collection.upsert(
             ids=ids[start_idx:end_idx],
             documents=documents[start_idx:end_idx],
             metadatas=metadatas[start_idx:end_idx],
+            embeddings=embeddings[start_idx:end_idx] if embeddings is not None else None,
         )
 
 
+def delete_documents_from_collection(
+    collection: "chromadb.Collection",
+    ids: List[str],
+    batch_size: int = 100,
+) -> None:
+    """Delete documents from a ChromaDB collection in batches.
+    
+    Args:
+        collection: ChromaDB collection
+        ids: List of document IDs to delete
+        batch_size: Size of batches for deleting documents
+    """
+    for batch in batched(ids, batch_size):
+        collection.delete(ids=list(batch))
+
+
+def update_chunk_sources(
+    collection: "chromadb.Collection",
+    sources: Dict[str, List[str]],
+    max_listed: int = 50,
+    batch_size: int = 100,
+) -> int:
+    """Record every source URL of deduplicated chunks in their metadata.
+
+    Chroma metadata values must be scalars, so the URLs are stored space-separated
+    under 'sources' (at most `max_listed` of them) with the full count under
+    'source_count'. 'source' keeps its URL while that page still references the
+    chunk and otherwise moves to the first remaining one.
+
+    Args:
+        collection: ChromaDB collection
+        sources: Mapping from chunk ID to the URLs referencing it
+        max_listed: Maximum number of URLs written to 'sources'
+        batch_size: Size of batches for reading and updating metadata
+
+    Returns:
+        The number of chunks whose metadata changed
+    """
+    changed = 0
+    for batch in batched(list(sources), batch_size):
+        existing = collection.get(ids=list(batch), include=["metadatas"])
+        ids, metadatas = [], []
+        for cid, metadata in zip(existing["ids"], existing["metadatas"]):
+            urls = sources[cid]
+            updated = dict(metadata or {})
+            if updated.get("source") not in urls:
+                updated["source"] = urls[0]
+            updated["sources"] = " ".join(urls[:max_listed])
+            updated["source_count"] = len(urls)
+            if updated != metadata:
+                ids.append(cid)
+                metadatas.append(updated)
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            changed += len(ids)
+    return changed
+
+
 def query_collection(
-    collection: chromadb.Collection,
+    collection: "chromadb.Collection",
     query_text: str,
     n_results: int = 5,
     where: Optional[Dict[str, Any]] = None,
+    compact_store: Optional["CompactVectorStore"] = None,
 ) -> Dict[str, Any]:
     """Query a ChromaDB collection for similar documents.
     
@@ -111,10 +289,17 @@ def query_collection(
         query_text: Text to search for
         n_results: Number of results to return
         where: Optional filter to apply to the query
+        compact_store: The collection's compact vector tier, if it has one; it
+            answers unfiltered queries instead of Chroma's HNSW index
         
     Returns:
         Query results containing documents, metadatas, distances, and ids
     """
+    if compact_store is not None and where is None:
+        from embeddings import get_embedding_function
+        embedding_function = get_embedding_function(compact_store.embedding_model or "all-MiniLM-L6-v2")
+        return compact_store.query(collection, embedding_function.embed([query_text]), n_results=n_results)
+    
     # Query the collection
     return collection.query(
         query_texts=[query_text],
@@ -124,31 +309,550 @@ def query_collection(
     )
 
 
-def format_results_as_context(query_results: Dict[str, Any]) -> str:
+def vector_query(
+    collection: "chromadb.Collection",
+    query_embeddings: Any,
+    n_results: int = 5,
+    where: Optional[Dict[str, Any]] = None,
+    compact_store: Optional["CompactVectorStore"] = None,
+) -> Dict[str, Any]:
+    """Query a collection with precomputed embeddings, through its compact tier when it has one.
+    
+    Args:
+        collection: ChromaDB collection
+        query_embeddings: One embedding per query
+        n_results: Number of results to return per query
+        where: Optional filter (filtered queries always go to Chroma)
+        compact_store: The collection's compact vector tier, if any
+        
+    Returns:
+        Query results in collection.query's shape, one entry per query
+    """
+    if compact_store is not None and where is None:
+        return compact_store.query(collection, query_embeddings, n_results=n_results)
+    return collection.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        where=where,
+        include=["documents", "metadatas", "distances"]
+    )
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge ranked ID lists with reciprocal-rank fusion.
+    
+    Args:
+        rankings: Ranked lists of IDs, best first
+        k: RRF constant; larger values flatten the contribution of top ranks
+        
+    Returns:
+        (ID, fused score) pairs, best first
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_query_collection(
+    collection: "chromadb.Collection",
+    lexical_index: "LexicalIndex",
+    query_text: str,
+    n_results: int = 5,
+    where: Optional[Dict[str, Any]] = None,
+    candidates: Optional[int] = None,
+    vector_results: Optional[Dict[str, Any]] = None,
+    compact_store: Optional["CompactVectorStore"] = None,
+) -> Dict[str, Any]:
+    """Query a collection with both vector search and BM25, fused with reciprocal-rank fusion.
+    
+    Args:
+        collection: ChromaDB collection
+        lexical_index: BM25 index built at ingest time
+        query_text: Text to search for
+        n_results: Number of results to return
+        where: Optional filter to apply to the query
+        candidates: Number of candidates to take from each retriever (default 4 * n_results)
+        vector_results: Vector hits already retrieved for this query (in query_collection's
+            shape, with `candidates` results), e.g. by a batched query; searched if omitted
+        compact_store: The collection's compact vector tier, if any (see query_collection)
+        
+    Returns:
+        Query results in the same shape as query_collection; lexical-only hits have a distance of None
+    """
+    candidates = candidates or n_results * 4
+    if vector_results is None:
+        vector_results = query_collection(
+            collection, query_text, n_results=candidates, where=where, compact_store=compact_store
+        )
+    lexical_hits = lexical_index.search(collection.name, query_text, n_results=candidates)
+    
+    vector_ids = vector_results["ids"][0]
+    by_id = {
+        cid: (doc, meta, dist)
+        for cid, doc, meta, dist in zip(
+            vector_ids,
+            vector_results["documents"][0],
+            vector_results["metadatas"][0],
+            vector_results["distances"][0]
+        )
+    }
+    
+    def fetch_lexical_only(ids):
+        fetched = collection.get(ids=ids, where=where, include=["documents", "metadatas"])
+        for cid, doc, meta in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+            by_id[cid] = (doc, meta, None)
+    
+    lexical_ids = [cid for cid, _ in lexical_hits]
+    if where is not None:
+        # The BM25 index knows nothing of metadata: filter its hits before fusion,
+        # so hits the filter drops don't take places in the top n_results
+        unseen = [cid for cid in lexical_ids if cid not in by_id]
+        if unseen:
+            fetch_lexical_only(unseen)
+        lexical_ids = [cid for cid in lexical_ids if cid in by_id]
+    fused = reciprocal_rank_fusion([vector_ids, lexical_ids])
+    
+    # Fetch the documents of the top hits that only the lexical index found
+    lexical_only = [cid for cid, _ in fused[:n_results] if cid not in by_id]
+    if lexical_only:
+        fetch_lexical_only(lexical_only)
+    
+    ids = [cid for cid, _ in fused if cid in by_id][:n_results]
+    return {
+        "ids": [ids],
+        "documents": [[by_id[cid][0] for cid in ids]],
+        "metadatas": [[by_id[cid][1] for cid in ids]],
+        "distances": [[by_id[cid][2] for cid in ids]],
+    }
+
+
+def normalize_query(query_text: str) -> str:
+    """Normalize a query for cache lookups: case, surrounding punctuation and whitespace are ignored."""
+    return " ".join(query_text.lower().split()).strip(" ?!.")
+
+
+class QueryCache:
+    """In-process LRU cache of query results with a time-to-live.
+    
+    Keys include the collection's content version, so results cached before an
+    ingest are never served after it; stale entries simply age out.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0):
+        """Create an empty cache.
+        
+        Args:
+            max_entries: Maximum number of cached results
+            ttl: Seconds after which a cached result expires
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(
+        collection_key: Tuple,
+        version: int,
+        query_text: str,
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Tuple:
+        """Build a cache key from the collection identity, its version and the query parameters."""
+        where_key = json.dumps(where, sort_keys=True, default=str) if where else ""
+        return (collection_key, version, normalize_query(query_text), n_results, where_key)
+    
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """Return the cached result for a key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.increment("query_cache_hits")
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            metrics.increment("query_cache_misses")
+            return None
+    
+    def put(self, key: Tuple, value: Dict[str, Any]) -> None:
+        """Cache a result, evicting the least recently used entry if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Drop every cached result."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current number of cached results."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+# Shared by every agent run in the process
+query_cache = QueryCache()
+
+
+def cached_query_collection(
+    persist_directory: str,
+    collection_name: str,
+    query_text: str,
+    n_results: int = 5,
+    where: Optional[Dict[str, Any]] = None,
+    embedding_model_name: str = "all-MiniLM-L6-v2",
+    cache: Optional[QueryCache] = None,
+    hybrid: bool = True,
+) -> Dict[str, Any]:
+    """Query a collection through the query-result cache.
+    
+    The cache is keyed by the collection, the normalized query, n_results and
+    the filter, plus the collection's content version from the ingest manifest,
+    which insert_docs bumps whenever it writes to the collection.
+    
+    Args:
+        persist_directory: Directory where ChromaDB stores its data
+        collection_name: Name of the collection
+        query_text: Text to search for
+        n_results: Number of results to return
+        where: Optional filter to apply to the query
+        embedding_model_name: Name of the embedding model to use
+        cache: Cache to use (defaults to the process-wide query_cache)
+        hybrid: Whether to fuse vector results with the BM25 index (see hybrid_query_collection)
+        
+    Returns:
+        Query results containing documents, metadatas, distances, and ids
+    """
+    cache = cache or query_cache
+    collection_key = (os.path.abspath(persist_directory), collection_name, embedding_model_name, hybrid)
+    version = get_manifest(persist_directory).get_version(collection_name)
+    key = QueryCache.make_key(collection_key, version, query_text, n_results, where)
+    
+    results = cache.get(key)
+    if results is None:
+        from compact_store import get_compact_store
+        from lexical_index import get_lexical_index
+
+        collection = get_collection(persist_directory, collection_name, embedding_model_name)
+        compact_store = get_compact_store(persist_directory, collection_name)
+        with metrics.span("query.search", hybrid=hybrid):
+            if hybrid:
+                results = hybrid_query_collection(
+                    collection,
+                    get_lexical_index(persist_directory),
+                    query_text,
+                    n_results=n_results,
+                    where=where,
+                    compact_store=compact_store
+                )
+            else:
+                results = query_collection(
+                    collection, query_text, n_results=n_results, where=where, compact_store=compact_store
+                )
+        cache.put(key, results)
+    return results
+
+
+def batch_query_collection(
+    persist_directory: str,
+    collection_name: str,
+    query_texts: Sequence[str],
+    n_results: int = 5,
+    where: Optional[Dict[str, Any]] = None,
+    embedding_model_name: str = "all-MiniLM-L6-v2",
+    cache: Optional[QueryCache] = None,
+    hybrid: bool = True,
+    embed_batch_size: int = 64,
+) -> List[Dict[str, Any]]:
+    """Query a collection for many queries at once.
+    
+    Queries found in the query-result cache are answered from it. The rest are
+    embedded together in one model call and searched with a single
+    collection.query(query_embeddings=...); with `hybrid`, each query's vector
+    hits are then fused with its BM25 hits. Identical queries (after
+    normalization) are only searched once.
+    
+    Args:
+        persist_directory: Directory where ChromaDB stores its data
+        collection_name: Name of the collection
+        query_texts: Texts to search for
+        n_results: Number of results to return per query
+        where: Optional filter to apply to every query
+        embedding_model_name: Name of the embedding model to use
+        cache: Cache to use (defaults to the process-wide query_cache)
+        hybrid: Whether to fuse vector results with the BM25 index
+        embed_batch_size: Number of queries per encode call
+        
+    Returns:
+        One result per query, each in the same shape as query_collection's
+    """
+    cache = cache or query_cache
+    collection_key = (os.path.abspath(persist_directory), collection_name, embedding_model_name, hybrid)
+    version = get_manifest(persist_directory).get_version(collection_name)
+    keys = [QueryCache.make_key(collection_key, version, text, n_results, where) for text in query_texts]
+    results: List[Optional[Dict[str, Any]]] = [cache.get(key) for key in keys]
+    
+    pending: Dict[Tuple, List[int]] = {}
+    for i, (key, result) in enumerate(zip(keys, results)):
+        if result is None:
+            pending.setdefault(key, []).append(i)
+    if not pending:
+        return results
+    
+    from compact_store import get_compact_store
+    from embeddings import get_embedding_function
+    from lexical_index import get_lexical_index
+
+    collection = get_collection(persist_directory, collection_name, embedding_model_name)
+    embedding_function = get_embedding_function(embedding_model_name, get_embedding_cache_path(persist_directory))
+    texts = [query_texts[positions[0]] for positions in pending.values()]
+    with metrics.span("query.embed", batch=len(texts) > 1):
+        embeddings = embedding_function.embed(texts, batch_size=embed_batch_size)
+    with metrics.span("query.vector", batch=len(texts) > 1):
+        vector_results = vector_query(
+            collection,
+            embeddings,
+            n_results=n_results * 4 if hybrid else n_results,
+            where=where,
+            compact_store=get_compact_store(persist_directory, collection_name)
+        )
+    
+    lexical_index = get_lexical_index(persist_directory) if hybrid else None
+    for j, (key, positions) in enumerate(pending.items()):
+        result = {field: [vector_results[field][j]] for field in ("ids", "documents", "metadatas", "distances")}
+        if hybrid:
+            with metrics.span("query.fuse"):
+                result = hybrid_query_collection(
+                    collection,
+                    lexical_index,
+                    texts[j],
+                    n_results=n_results,
+                    where=where,
+                    vector_results=result
+                )
+        cache.put(key, result)
+        for i in positions:
+            results[i] = result
+    return results
+
+
+def query_collections(
+    persist_directory: str,
+    collection_names: Sequence[str],
+    query_text: str,
+    n_results: int = 5,
+    where: Optional[Dict[str, Any]] = None,
+    embedding_model_name: str = "all-MiniLM-L6-v2",
+    cache: Optional[QueryCache] = None,
+    hybrid: bool = True,
+) -> Dict[str, Any]:
+    """Query several collections at once and merge their hits into one ranking.
+    
+    The query is embedded once and the collections are searched in parallel.
+    Vector hits from every collection are ranked together by distance (the
+    collections share the embedding model and distance function, so distances
+    are comparable); with `hybrid`, BM25 hits are ranked together by score and
+    the two rankings are fused with reciprocal-rank fusion, as in
+    hybrid_query_collection. Results are cached like cached_query_collection's,
+    keyed by the versions of all the collections.
+    
+    Args:
+        persist_directory: Directory where ChromaDB stores its data
+        collection_names: Collections to search
+        query_text: Text to search for
+        n_results: Number of results to return in total
+        where: Optional filter to apply in every collection
+        embedding_model_name: Name of the embedding model to use
+        cache: Cache to use (defaults to the process-wide query_cache)
+        hybrid: Whether to fuse vector results with the BM25 index
+        
+    Returns:
+        Query results in the same shape as query_collection; each metadata dict
+        carries the name of its collection under 'collection'
+    """
+    names = sorted(set(collection_names))
+    if not names:
+        raise ValueError("No collections to query.")
+    cache = cache or query_cache
+    manifest = get_manifest(persist_directory)
+    collection_key = (os.path.abspath(persist_directory), tuple(names), embedding_model_name, hybrid)
+    version = tuple(manifest.get_version(name) for name in names)
+    key = QueryCache.make_key(collection_key, version, query_text, n_results, where)
+    results = cache.get(key)
+    if results is not None:
+        return results
+    
+    from compact_store import get_compact_store
+    from embeddings import get_embedding_function
+    from lexical_index import get_lexical_index
+
+    candidates = n_results * 4 if hybrid else n_results
+    embedding_function = get_embedding_function(embedding_model_name, get_embedding_cache_path(persist_directory))
+    with metrics.span("query.embed", batch=False):
+        embedding = embedding_function.embed([query_text])
+    lexical_index = get_lexical_index(persist_directory) if hybrid else None
+    
+    def search(name):
+        collection = get_collection(persist_directory, name, embedding_model_name)
+        vector_results = vector_query(
+            collection,
+            embedding,
+            n_results=candidates,
+            where=where,
+            compact_store=get_compact_store(persist_directory, name)
+        )
+        lexical_hits = lexical_index.search(name, query_text, n_results=candidates) if hybrid else []
+        filtered = {}
+        if where is not None and lexical_hits:
+            # Filter the BM25 hits before fusion, so hits the filter drops don't take places in the top n_results
+            seen = set(vector_results["ids"][0])
+            unseen = [cid for cid, _ in lexical_hits if cid not in seen]
+            if unseen:
+                fetched = collection.get(ids=unseen, where=where, include=["documents", "metadatas"])
+                filtered = {cid: (doc, meta) for cid, doc, meta in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])}
+            lexical_hits = [(cid, score) for cid, score in lexical_hits if cid in seen or cid in filtered]
+        return collection, vector_results, lexical_hits, filtered
+    
+    with metrics.span("query.fan_out", collections=len(names)):
+        with ThreadPoolExecutor(max_workers=min(8, len(names))) as pool:
+            searched = dict(zip(names, pool.map(search, names)))
+    
+    # Hits are keyed by (collection, chunk ID): the same page may be stored in two collections
+    by_key: Dict[Tuple[str, str], Tuple[Any, Any, Optional[float]]] = {}
+    vector_hits = []
+    lexical_hits = []
+    for name, (_, vector_results, hits, filtered) in searched.items():
+        for cid, doc, meta, dist in zip(
+            vector_results["ids"][0],
+            vector_results["documents"][0],
+            vector_results["metadatas"][0],
+            vector_results["distances"][0]
+        ):
+            by_key[(name, cid)] = (doc, meta, dist)
+            vector_hits.append((dist, name, cid))
+        lexical_hits.extend((-score, name, cid) for cid, score in hits)
+        for cid, (doc, meta) in filtered.items():
+            by_key.setdefault((name, cid), (doc, meta, None))
+    rankings = [[(name, cid) for _, name, cid in sorted(vector_hits)]]
+    if hybrid:
+        rankings.append([(name, cid) for _, name, cid in sorted(lexical_hits)])
+    fused = reciprocal_rank_fusion(rankings)
+    
+    # Fetch the documents of the top hits that only the lexical index found
+    lexical_only: Dict[str, List[str]] = {}
+    for (name, cid), _ in fused[:n_results]:
+        if (name, cid) not in by_key:
+            lexical_only.setdefault(name, []).append(cid)
+    for name, ids in lexical_only.items():
+        fetched = searched[name][0].get(ids=ids, where=where, include=["documents", "metadatas"])
+        for cid, doc, meta in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+            by_key[(name, cid)] = (doc, meta, None)
+    
+    keys = [k for k, _ in fused if k in by_key][:n_results]
+    results = {
+        "ids": [[cid for _, cid in keys]],
+        "documents": [[by_key[k][0] for k in keys]],
+        "metadatas": [[{**(by_key[k][1] or {}), "collection": k[0]} for k in keys]],
+        "distances": [[by_key[k][2] for k in keys]],
+    }
+    cache.put(key, results)
+    return results
+
+
+DEFAULT_CONTEXT_METADATA_FIELDS = ("source", "headers")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheaply estimate the number of LLM tokens in a text (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    """Hashes of the word n-grams of a text, for near-duplicate detection."""
+    words = text.lower().split()
+    if len(words) < size:
+        return {hash(tuple(words))}
+    return {hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+def format_results_as_context(
+    query_results: Dict[str, Any],
+    max_tokens: Optional[int] = None,
+    metadata_fields: Optional[Sequence[str]] = DEFAULT_CONTEXT_METADATA_FIELDS,
+    dedupe_threshold: float = 0.9,
+    token_counter: Optional[Callable[[str], int]] = None,
+) -> str:
     """Format query results as a context string for the agent.
     
+    Results are taken in rank order. A result whose text overlaps an already
+    included result from the same source by at least `dedupe_threshold`
+    (Jaccard similarity of word 3-grams) is skipped, and results stop being
+    added once the token budget is reached (the top result is always included).
+    The string is assembled in one join.
+    
     Args:
         query_results: Results from a ChromaDB query
+        max_tokens: Optional token budget for the whole context
+        metadata_fields: Metadata keys to include for each document (None includes all)
+        dedupe_threshold: Similarity above which same-source results count as duplicates
+        token_counter: Function counting tokens in a text (defaults to estimate_tokens)
         
     Returns:
         Formatted context string
     """
-    context = "CONTEXT INFORMATION:\n\n"
+    count_tokens = token_counter or estimate_tokens
+    header = "CONTEXT INFORMATION:\n\n"
+    parts = [header]
+    used_tokens = count_tokens(header)
+    seen_by_source: Dict[Any, List[set]] = {}
     
-    for i, (doc, metadata, distance) in enumerate(zip(
+    results = zip(
         query_results["documents"][0],
         query_results["metadatas"][0],
         query_results["distances"][0]
-    )):
+    )
+    for doc, metadata, distance in results:
+        metadata = metadata or {}
+        
+        # Skip exact and near duplicates of a chunk already taken from the same source
+        shingles = _shingles(doc)
+        seen = seen_by_source.setdefault(metadata.get("source"), [])
+        if any(len(shingles & other) / len(shingles | other) >= dedupe_threshold for other in seen):
+            continue
+        
         # Add document information
-        context += f"Document {i+1} (Relevance: {1 - distance:.2f}):\n"
+        relevance = f" (Relevance: {1 - distance:.2f})" if distance is not None else ""
+        lines = [f"Document {len(parts)}{relevance}:\n"]
         
-        # Add metadata if available
-        if metadata:
-            for key, value in metadata.items():
-                context += f"{key}: {value}\n"
+        # Add the selected metadata
+        keys = metadata.keys() if metadata_fields is None else metadata_fields
+        lines.extend(f"{key}: {metadata[key]}\n" for key in keys if metadata.get(key) not in (None, ""))
         
         # Add document content
-        context += f"Content: {doc}\n\n"
+        lines.append(f"Content: {doc}\n\n")
+        entry = "".join(lines)
+        
+        entry_tokens = count_tokens(entry)
+        # The top result is always kept, even if it alone exceeds the budget
+        if max_tokens is not None and used_tokens + entry_tokens > max_tokens and len(parts) > 1:
+            break
+        parts.append(entry)
+        used_tokens += entry_tokens
+        seen.append(shingles)
     
-    return context
+    return "".join(parts)